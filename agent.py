@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import threading
+import socketserver
+
+from getpass import getpass
+from argparse import ArgumentParser
+from bismuthclient import bismuthcrypto
+from multiwallet import MultiWallet
+from Cryptodome.PublicKey import RSA
+
+
+"""
+ssh-agent like daemon that holds an unlocked wallet in memory behind a Unix socket.
+Clients ask the agent for signatures, private keys never leave the agent process.
+"""
+
+
+DEFAULT_SOCKET = os.environ.get(
+    "TANSANIT_AGENT_SOCK",
+    os.path.join(os.path.expanduser("~"), ".tansanit", "agent.sock"))
+
+
+class _AgentServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    agent = None
+
+
+class _AgentHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        # One JSON request per line, one JSON reply per line
+        for line in self.rfile:
+            try:
+                request = json.loads(line.decode("utf-8"))
+                result = self.server.agent.dispatch(request["command"], request.get("args", []))
+                reply = {"result": result}
+            except Exception as e:
+                self.server.agent.log.error(e)
+                reply = {"error": str(e)}
+            self.wfile.write(json.dumps(reply).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+class WalletAgent:
+
+    __slots__ = ('log', 'socket_path', 'timeout', 'expires', '_wallet', '_wallet_file', '_keys', '_server')
+
+    COMMANDS = ('ping', 'info', 'addresses', 'sign_transaction', 'sign_message',
+                'decrypt_message', 'set_label', 'new_address', 'stop')
+
+    def __init__(self, wallet_file='wallet.json', password=None, socket_path=DEFAULT_SOCKET, timeout=3600, log=None):
+        """
+        Unlocks the wallet once and keeps it in memory
+
+        :param wallet_file: string, a wallet.json file
+        :param password: string, password to decrypt wallet
+        :param socket_path: string, Unix socket to listen on
+        :param timeout: int, seconds after which the agent forgets the keys and exits. 0 = never
+        """
+        self.log = log if log else logging
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.expires = time.time() + timeout if timeout else None
+        self._wallet = MultiWallet(wallet_file, password=password, log=self.log)
+        self._wallet_file = os.path.abspath(wallet_file)
+        self._keys = {}
+        self._server = None
+
+    def serve(self):
+        """Listens on the socket until stopped or until the timeout is reached"""
+        directory = os.path.dirname(self.socket_path)
+        directory and os.makedirs(directory, mode=0o700, exist_ok=True)
+
+        if os.path.exists(self.socket_path):
+            if AgentClient(self.socket_path).available():
+                raise RuntimeWarning(f"Agent already running on '{self.socket_path}'")
+            # Stale socket of a crashed agent
+            os.remove(self.socket_path)
+
+        # Socket must only be accessible by the current user
+        umask = os.umask(0o177)
+        try:
+            self._server = _AgentServer(self.socket_path, _AgentHandler)
+        finally:
+            os.umask(umask)
+        self._server.agent = self
+
+        if self.timeout:
+            timer = threading.Timer(self.timeout, self.stop)
+            timer.daemon = True
+            timer.start()
+
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            self._forget()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    def stop(self):
+        """Stops serving. Keys are forgotten once the server loop exits"""
+        if self._server:
+            # shutdown() blocks until serve_forever() returns, so don't call it from a handler directly
+            threading.Thread(target=self._server.shutdown, daemon=True).start()
+        return True
+
+    def dispatch(self, command, args):
+        if command not in self.COMMANDS:
+            raise RuntimeWarning(f"Unknown command '{command}'")
+        if not self._wallet:
+            raise RuntimeWarning("Agent is locked")
+        return getattr(self, f"_do_{command}")(*args)
+
+    def _forget(self):
+        self._keys = {}
+        if self._wallet and self._wallet.info()['encrypted']:
+            self._wallet.lock()
+        self._wallet = None
+
+    def _key(self, address):
+        if address not in self._keys:
+            key = self._wallet.get_key(address)
+            if not key:
+                raise RuntimeWarning(f"Address '{address}' not in wallet")
+            self._keys[address] = RSA.importKey(key['private_key'])
+        return self._keys[address]
+
+    def _do_ping(self):
+        return {"file": self._wallet_file, "expires": self.expires}
+
+    def _do_info(self):
+        info = dict(self._wallet.info())
+        # Spend protection stays in the agent
+        info.pop('spend', None)
+        return info
+
+    def _do_addresses(self):
+        return [{"address": a['address'], "public_key": a['public_key'],
+                 "label": a.get('label', ''), "timestamp": a.get('timestamp')}
+                for a in self._wallet.addresses]
+
+    def _do_sign_transaction(self, address, timestamp, recipient, amount, operation='', data=''):
+        return bismuthcrypto.sign_with_key(
+            timestamp, address, recipient, amount, operation, data, self._key(address))
+
+    def _do_sign_message(self, address, message):
+        return bismuthcrypto.sign_message_with_key(message, self._key(address))
+
+    def _do_decrypt_message(self, address, message):
+        return bismuthcrypto.decrypt_message_with_key(message, self._key(address))
+
+    def _do_set_label(self, address, label):
+        self._wallet.set_label(address, label)
+        return True
+
+    def _do_new_address(self, label='', password='', salt=''):
+        self._wallet.new_address(label, password, salt)
+        return self._wallet.addresses[-1]['address']
+
+    def _do_stop(self):
+        return self.stop()
+
+
+class AgentClient:
+
+    __slots__ = ('socket_path', 'timeout')
+
+    def __init__(self, socket_path=DEFAULT_SOCKET, timeout=10):
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def command(self, command, *args):
+        """
+        Sends a command to the agent and returns the result.
+
+        :param command: the command as a string
+        :param args: the arguments of the command
+        :return: the result as a native structure
+        """
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            sock.sendall(json.dumps({"command": command, "args": list(args)}).encode("utf-8") + b"\n")
+            with sock.makefile("rb") as f:
+                line = f.readline()
+        if not line:
+            raise RuntimeWarning("No reply from wallet agent")
+        reply = json.loads(line.decode("utf-8"))
+        if "error" in reply:
+            raise RuntimeWarning(reply["error"])
+        return reply["result"]
+
+    def available(self):
+        """Returns the agent ping info if an agent answers on the socket, else None"""
+        try:
+            return self.command("ping")
+        except (OSError, ValueError, RuntimeWarning):
+            return None
+
+    def stop(self):
+        return self.command("stop")
+
+
+class AgentWallet:
+    """
+    Drop-in for MultiWallet when the keys are held by a WalletAgent.
+    Only public data is kept locally, signing is delegated to the agent.
+    """
+
+    __slots__ = ('_agent', '_address', '_addresses', '_infos', 'key', 'public_key')
+
+    def __init__(self, agent: AgentClient):
+        self._agent = agent
+        self._address = None
+        self.key = None  # Private keys never leave the agent
+        self.public_key = ''
+        self._infos = agent.command("info")
+        self._addresses = agent.command("addresses")
+        if self._addresses:
+            self.set_address(self._addresses[0]['address'])
+
+    def info(self):
+        self._infos['count'] = len(self._addresses)
+        return self._infos
+
+    def set_address(self, address: str = ''):
+        """Select an address from the wallet"""
+        key = self.get_key(address)
+        if not key:
+            raise RuntimeError("Address not in wallet")
+        self.public_key = key['public_key']
+        self._address = address
+        self._infos['address'] = address
+
+        # Move selected address to top of list
+        for index, address_data in enumerate(self._addresses):
+            if address_data['address'] == address:
+                self._addresses.insert(0, self._addresses.pop(index))
+                break
+
+    def is_address_in_wallet(self, address: str = ''):
+        return self.get_key(address) is not None
+
+    def get_key(self, address: str = ''):
+        for key in self._addresses:
+            if address == key['address']:
+                return key
+        return None
+
+    def new_address(self, label: str = '', password: str = '', salt: str = ''):
+        address = self._agent.command("new_address", label, password, salt)
+        self._addresses = self._agent.command("addresses")
+        return address
+
+    def set_label(self, address: str = '', label: str = ''):
+        self._agent.command("set_label", address, label)
+        for single_address in self._addresses:
+            if single_address['address'] == address:
+                single_address['label'] = label
+
+    def sign_transaction(self, timestamp, recipient, amount, operation='', data=''):
+        return self._agent.command(
+            "sign_transaction", self._address, timestamp, recipient, amount, operation, data)
+
+    def sign_message(self, message: str):
+        return self._agent.command("sign_message", self._address, message)
+
+    def decrypt_message(self, message: str):
+        return self._agent.command("decrypt_message", self._address, message)
+
+    def _unsupported(self, *args, **kwargs):
+        raise RuntimeWarning("Not possible while the wallet is held by the agent")
+
+    import_der = encrypt = unlock = lock = save = _unsupported
+
+    @property
+    def address(self):
+        """Returns the currently loaded address, or None"""
+        return self._address
+
+    @property
+    def addresses(self):
+        """Returns the list of all addresses"""
+        return self._addresses
+
+
+def main():
+    parser = ArgumentParser(description="Tansanit wallet agent - keeps an unlocked wallet in memory")
+    parser.add_argument("-w", dest="wallet", help="wallet file location", default="wallet.json")
+    parser.add_argument("-s", dest="socket", help="socket path", default=DEFAULT_SOCKET)
+    parser.add_argument("-t", dest="timeout", type=int, help="seconds until keys are forgotten (0 = never)", default=3600)
+    parser.add_argument("--stop", dest="stop", action="store_true", help="stop a running agent", default=False)
+    args = parser.parse_args()
+
+    if args.stop:
+        try:
+            AgentClient(args.socket).stop()
+            print("Agent stopped")
+        except (OSError, RuntimeWarning) as e:
+            print(f"No agent running: {e}")
+        return
+
+    if not os.path.isfile(args.wallet):
+        print(f"No wallet '{args.wallet}' found!")
+        sys.exit(1)
+
+    with open(args.wallet, 'r') as f:
+        encrypted = json.load(f)["encrypted"]
+    password = getpass("Password: ") if encrypted else None
+
+    try:
+        agent = WalletAgent(args.wallet, password=password, socket_path=args.socket, timeout=args.timeout)
+    except RuntimeWarning as e:
+        print(e)
+        sys.exit(1)
+
+    print(f"TANSANIT_AGENT_SOCK={args.socket}; export TANSANIT_AGENT_SOCK;")
+    agent.serve()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Balance history and flow analytics over the local transaction history.
+The history is held as NumPy columns with amounts as int64 fixed point (1e-8 BIS),
+so that sums over years of transactions don't drift, and every figure is one vectorized pass.
+"""
+
+
+# Smallest amount, 8 decimals
+UNIT = 10 ** 8
+
+# numpy datetime64 units of the report periods
+PERIODS = {"day": "D", "month": "M", "year": "Y"}
+
+
+def _numpy():
+    """Returns numpy, only needed for analytics"""
+    try:
+        import numpy
+    except ImportError:
+        raise RuntimeError("Analytics need numpy: pip install numpy")
+    return numpy
+
+
+def to_amount(units):
+    """Returns an integer of 1e-8 as a decimal string, '-1.50000000'"""
+    units = int(units)
+    sign = "-" if units < 0 else ""
+    return f"{sign}{abs(units) // UNIT}.{abs(units) % UNIT:08d}"
+
+
+class Ledger:
+    """Transactions of one address as columns, oldest first. Grows with extend(), never re-reads old rows"""
+
+    __slots__ = ('address', 'counterparties', 'block_height', 'timestamp', 'incoming', 'outgoing', 'counterparty',
+                 'amount', 'fee', 'reward', '_codes', '_np')
+
+    def __init__(self, address):
+        np = _numpy()
+        self._np = np
+        self.address = address
+        # Counterparty addresses, the counterparty column holds indexes into it
+        self.counterparties = []
+        self._codes = {}
+        self.block_height = np.empty(0, dtype=np.int64)
+        self.timestamp = np.empty(0, dtype=np.float64)
+        self.incoming = np.empty(0, dtype=bool)
+        self.outgoing = np.empty(0, dtype=bool)
+        self.counterparty = np.empty(0, dtype=np.int32)
+        self.amount = np.empty(0, dtype=np.int64)
+        self.fee = np.empty(0, dtype=np.int64)
+        self.reward = np.empty(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.block_height)
+
+    @property
+    def last_block(self):
+        return int(self.block_height[-1]) if len(self) else None
+
+    def extend(self, rows):
+        """Appends rows from HistoryStore.ledger()"""
+        if not rows:
+            return
+        np = self._np
+        block_height, timestamp, incoming, outgoing, counterparty, amount, fee, reward = zip(*rows)
+        codes = self._codes
+        for address in set(counterparty).difference(codes):
+            codes[address] = len(self.counterparties)
+            self.counterparties.append(address)
+        columns = {'block_height': (block_height, np.int64), 'timestamp': (timestamp, np.float64),
+                   'incoming': (incoming, bool), 'outgoing': (outgoing, bool),
+                   'counterparty': ([codes[address] for address in counterparty], np.int32),
+                   'amount': (amount, np.int64), 'fee': (fee, np.int64), 'reward': (reward, np.int64)}
+        for name, (values, dtype) in columns.items():
+            setattr(self, name, np.concatenate((getattr(self, name), np.array(values, dtype=dtype))))
+
+    def delta(self):
+        """Balance change of every transaction. A transfer to self only costs the fee"""
+        np = self._np
+        return np.where(self.incoming, self.amount + self.reward, 0) - np.where(self.outgoing, self.amount + self.fee, 0)
+
+    def balances(self):
+        """Returns block heights, timestamps and the balance after every transaction"""
+        return self.block_height, self.timestamp, self._np.cumsum(self.delta())
+
+    def totals(self):
+        """Returns a dict of integer totals"""
+        np = self._np
+        received = int(np.sum(self.amount, where=self.incoming))
+        sent = int(np.sum(self.amount, where=self.outgoing))
+        fees = int(np.sum(self.fee, where=self.outgoing))
+        rewards = int(np.sum(self.reward, where=self.incoming))
+        return {"transactions": len(self), "received": received, "sent": sent, "fees": fees, "rewards": rewards,
+                "balance": received + rewards - sent - fees}
+
+    def by_counterparty(self, top=10):
+        """Returns [(address, received, sent, count)] with the largest volume first"""
+        np = self._np
+        size = len(self.counterparties)
+        received = np.zeros(size, dtype=np.int64)
+        sent = np.zeros(size, dtype=np.int64)
+        # add.at stays in int64, bincount would sum as float
+        np.add.at(received, self.counterparty, np.where(self.incoming, self.amount, 0))
+        np.add.at(sent, self.counterparty, np.where(self.outgoing, self.amount, 0))
+        count = np.bincount(self.counterparty, minlength=size)
+        order = np.argsort(-(received + sent), kind='stable')[:top]
+        return [(self.counterparties[i], int(received[i]), int(sent[i]), int(count[i])) for i in order]
+
+    def flows(self, period="month"):
+        """Returns [(period, received with rewards, sent, fees, balance at the end)] oldest first"""
+        np = self._np
+        if not len(self):
+            return []
+        buckets = self.timestamp.astype('datetime64[s]').astype(f'datetime64[{PERIODS[period]}]')
+        keys, index = np.unique(buckets, return_inverse=True)
+        received = np.zeros(len(keys), dtype=np.int64)
+        sent = np.zeros(len(keys), dtype=np.int64)
+        fees = np.zeros(len(keys), dtype=np.int64)
+        np.add.at(received, index, np.where(self.incoming, self.amount + self.reward, 0))
+        np.add.at(sent, index, np.where(self.outgoing, self.amount, 0))
+        np.add.at(fees, index, np.where(self.outgoing, self.fee, 0))
+        balance = np.cumsum(received - sent - fees)
+        return [(str(key), int(r), int(s), int(f), int(b)) for key, r, s, f, b in zip(keys, received, sent, fees, balance)]
@@ -0,0 +1,177 @@
+import os
+import sys
+import json
+import time
+import shlex
+import itertools
+import logging
+
+from contextlib import redirect_stdout
+from export import parse_options
+
+
+"""
+Non-interactive command runner. Runs wallet commands against one Client and writes one JSON object per command.
+"""
+
+
+# Commands that don't need a server connection, in the REPL and in batches
+OFFLINE_COMMANDS = ["about", "addresses", "wallet", "receive", "label", "msg_decrypt",
+                    "select", "new", "import", "encrypt", "decrypt", "shell", "help", "quit", "stats",
+                    "profile"]
+
+
+class Batch:
+
+    def __init__(self, client, ready=None, yes=False, out=None, tracker=None):
+        """
+        :param client: a connected or connecting Client
+        :param ready: optional Future that is done once the client is connected
+        :param yes: bool, confirm sends without asking
+        :param out: file to write the JSON lines to, default stdout
+        :param tracker: optional TransactionTracker, sent transactions are tracked until confirmed
+        """
+        self.client = client
+        self.ready = ready
+        self.yes = yes
+        self.out = out if out else sys.stdout
+        self.tracker = tracker
+
+    def run(self, lines):
+        """
+        Runs every command line and writes its JSON result.
+
+        :param lines: iterable of command lines. Empty lines and lines starting with '#' are skipped
+        :return: 0 if all commands succeeded, 1 otherwise
+        """
+        code = 0
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            result = self.execute(line)
+            if not result["ok"]:
+                code = 1
+            self.out.write(json.dumps(result) + "\n")
+            self.out.flush()
+        return code
+
+    def execute(self, line):
+        """Runs a single command line and returns the result as a dict"""
+        start = time.time()
+        try:
+            args = shlex.split(line)
+            command, args = args[0], args[1:]
+            handler = getattr(self, f"do_{command}", None)
+            if not handler:
+                raise ValueError(f"Unknown command '{command}'")
+            if self.ready and command not in OFFLINE_COMMANDS:
+                # Waits for the connection, online commands fail without running if it failed
+                error = self.ready.exception()
+                if error:
+                    raise RuntimeError(f"Not connected: {error}")
+            # Keep library prints out of the JSON output
+            with redirect_stdout(sys.stderr):
+                result = {"command": line, "ok": True, "result": handler(*args)}
+        except Exception as e:
+            logging.error(e)
+            result = {"command": line, "ok": False, "error": str(e)}
+        result["ms"] = round((time.time() - start) * 1000, 3)
+        return result
+
+    def do_balance(self, which=None):
+        if which == "all":
+            balance = self.client.global_balance()
+        else:
+            balance = self.client.balance()
+        if balance == "N/A":
+            raise RuntimeError("Balance not available")
+        return {"balance": str(balance)}
+
+    def do_transactions(self, num="10", count=None):
+        if num == "all":
+            # Merged timeline of every wallet address
+            return [tx.to_json() for tx in itertools.islice(self.client.iter_wallet_transactions(),
+                                                            int(count if count else 10))]
+        return self.client.latest_transactions(num=int(num))
+
+    def do_export(self, *args):
+        filename, fmt, from_block = parse_options(list(args))
+        return self.client.export_transactions(filename, fmt=fmt, from_block=from_block)
+
+    def do_report(self, period="month", top="10"):
+        return self.client.report(period=period, top=int(top))
+
+    def do_addresses(self):
+        return [{"address": a["address"], "label": a.get("label", ""), "selected": a["address"] == self.client.address}
+                for a in self.client.addresses()]
+
+    def do_wallet(self):
+        result = self.client.wallet()
+        return {"address": self.client.address, "file": os.path.abspath(result["file"]),
+                "encrypted": result["encrypted"]}
+
+    def do_receive(self):
+        return {"address": self.client.address}
+
+    def do_status(self):
+        return self.client.info()
+
+    def do_servers(self):
+        return self.client.info()["full_servers_list"]
+
+    def do_refresh(self):
+        self.client.refresh_servers()
+        return self.do_servers()
+
+    def do_connect(self, server="auto"):
+        if server == "auto":
+            result = self.client.get_server()
+        else:
+            result = self.client.set_server(server)
+        if not result:
+            raise RuntimeError("Could not connect")
+        return {"server": result}
+
+    def do_select(self, address):
+        self.client.set_address(address)
+        return {"address": self.client.address}
+
+    def do_label(self, label):
+        self.client.set_label(self.client.address, label)
+        return {"address": self.client.address, "label": label}
+
+    def do_send(self, address, amount, operation="", data=""):
+        from bismuthclient.bismuthutil import BismuthUtil
+
+        if not self.yes:
+            raise RuntimeError("Sending needs confirmation, use --yes")
+        if not BismuthUtil.valid_address(address):
+            raise ValueError(f"'{address}' is not a valid address!")
+        amount = float(amount)
+        if self.client.reject_empty_msg(address) and not data:
+            raise ValueError("This address needs a 'Data' entry!")
+
+        error_reply = []
+        txid = self.client.send(address, amount, operation=operation, data=data, error_reply=error_reply)
+        if not txid:
+            raise RuntimeError(error_reply[-1] if error_reply else "Transaction couldn't be send")
+        if self.tracker:
+            self.tracker.track(txid, recipient=address, amount=amount)
+        return {"txid": txid}
+
+    def do_pending(self, wait=None):
+        if not self.tracker:
+            raise RuntimeError("No transaction tracker")
+        if wait == "wait":
+            # Until every sent transaction is confirmed, dropped or timed out
+            self.tracker.wait()
+        elif wait:
+            raise ValueError(f"Unknown argument '{wait}'")
+        return self.tracker.pending()
+
+    def do_msg_encrypt(self, recipient, message):
+        return {"message": self.client.encrypt_message(message, recipient)}
+
+    def do_msg_decrypt(self, message):
+        return {"message": self.client.decrypt_message(message)}
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+"""
+End-to-end benchmark of Client methods and REPL commands against the mock wallet server
+"""
+
+import io
+import os
+import sys
+import tempfile
+
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from benchutil import summary, measure, print_table, check, add_baseline_args, isolate_home
+from mockserver import MockServer
+
+RECIPIENT = "f6c0363ca1c5aa28cc584252e65a63998493ff0a5ec1bb16beda9bac"
+
+
+def client_benchmarks(client, iterations):
+    """Returns {name: summary} for the Client methods"""
+    counterparties = [tx["recipient"] for tx in client.latest_transactions(num=20)]
+
+    def uncached(func):
+        def run():
+            client.clear_cache()
+            return func()
+        return run
+
+    benchmarks = {
+        "balance": uncached(client.balance),
+        "balance (cached)": client.balance,
+        "global_balance": uncached(client.global_balance),
+        "status": uncached(client.status),
+        "latest_transactions 10": uncached(lambda: client.latest_transactions(num=10)),
+        "latest_transactions 100": uncached(lambda: client.latest_transactions(num=100)),
+        "latest_transactions page 10": uncached(lambda: client.latest_transactions(num=10, offset=500)),
+        "get_aliases 20": lambda: client.get_aliases(counterparties),
+        "send": lambda: client.send(RECIPIENT, 0.01, data="bench"),
+    }
+
+    results = {}
+    for name, func in benchmarks.items():
+        results[f"client {name}"] = summary(measure(func, iterations=iterations))
+    return results
+
+
+def repl_benchmarks(wallet, server, iterations):
+    """Returns {name: summary} for REPL commands, output is discarded"""
+    import tansanit
+
+    sys.argv = ["tansanit.py", "-w", wallet, "-s", server, "--no-clear", "--no-banner"]
+    with redirect_stdout(io.StringIO()):
+        t = tansanit.Tansanit()
+        t.ready.result()
+
+    # The spinner sleeps its delay at the end of every command: measure the command, not the spinner
+    spinner = tansanit.Spinner.__enter__, tansanit.Spinner.__exit__
+    tansanit.Spinner.__enter__ = lambda self: None
+    tansanit.Spinner.__exit__ = lambda self, exception, value, tb: False
+
+    results = {}
+    try:
+        for line in ["balance", "balance all", "transactions", "transactions 50", "status", "addresses"]:
+            def run():
+                t.client.clear_cache()
+                t.onecmd(line)
+            with redirect_stdout(io.StringIO()):
+                results[f"repl {line}"] = summary(measure(run, iterations=iterations))
+    finally:
+        tansanit.Spinner.__enter__, tansanit.Spinner.__exit__ = spinner
+    return results
+
+
+def main():
+    parser = ArgumentParser(description="Client end-to-end benchmark against a mock wallet server")
+    parser.add_argument("-n", dest="iterations", type=int, help="iterations per benchmark", default=100)
+    parser.add_argument("-w", dest="wallet", help="wallet to use (default: new temporary wallet)", default=None)
+    parser.add_argument("--latency", type=float, help="server seconds per reply", default=0.0)
+    parser.add_argument("--jitter", type=float, help="server random +/- seconds per reply", default=0.0)
+    parser.add_argument("--errors", type=float, help="server probability to drop the connection", default=0.0)
+    parser.add_argument("--dataset", type=int, help="transactions per address", default=1000)
+    parser.add_argument("--no-repl", dest="repl", action="store_false", help="skip REPL commands", default=True)
+    add_baseline_args(parser)
+    args = parser.parse_args()
+
+    wallet = os.path.abspath(args.wallet) if args.wallet else None
+
+    mock = MockServer(latency=args.latency, jitter=args.jitter, error_rate=args.errors,
+                      dataset_size=args.dataset, seed=1)
+    server = mock.start()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        isolate_home(tmp)
+        from client import Client
+
+        wallet = wallet if wallet else os.path.join(tmp, "wallet.json")
+        try:
+            with redirect_stdout(io.StringIO()):
+                client = Client(wallet, servers=[server])
+                client.set_server(server)
+                results = client_benchmarks(client, args.iterations)
+            if args.repl:
+                results.update(repl_benchmarks(wallet, server, args.iterations))
+        finally:
+            mock.stop()
+
+    print_table(results)
+    if args.repl:
+        from tansanit import Spinner
+        print(f"\nREPL commands timed without the spinner, which adds {Spinner.delay * 1000:.0f} ms to each interactively")
+    print(f"\nServer requests: {mock.requests}")
+    sys.exit(check("client", results, args))
+
+
+if __name__ == "__main__":
+    main()
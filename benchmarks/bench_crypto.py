@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+
+"""
+Micro-benchmark of the wallet crypto paths
+
+Signing, message encryption, key generation, simplecrypt (wallet encryption)
+and wallet open/unlock time by number of addresses. Signing and simplecrypt
+decryption are also run on a process pool to compare with a single process.
+"""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+
+from time import perf_counter
+from base64 import b64encode
+from argparse import ArgumentParser
+from multiprocessing import Pool
+from benchutil import summary, measure, print_table, check, add_baseline_args
+
+from bismuthclient import bismuthcrypto
+from bismuthclient.simplecrypt import encrypt, decrypt
+from Cryptodome.PublicKey import RSA
+from multiwallet import MultiWallet
+
+PASSWORD = "benchmark password"
+RECIPIENT = "f6c0363ca1c5aa28cc584252e65a63998493ff0a5ec1bb16beda9bac"
+
+_worker_key = None
+
+
+def _init_worker(private_key):
+    global _worker_key
+    _worker_key = RSA.importKey(private_key)
+
+
+def _sign(i):
+    return bismuthcrypto.sign_with_key(1560000000.0 + i, "", RECIPIENT, 1.0, "", str(i), _worker_key)
+
+
+def _decrypt(blob):
+    return decrypt(PASSWORD, blob)
+
+
+def throughput(func, items):
+    """Returns ops/s of func over items in this process"""
+    items = list(items)
+    start = perf_counter()
+    for item in items:
+        func(item)
+    return len(items) / (perf_counter() - start)
+
+
+def pool_throughput(func, items, processes, keys):
+    """Returns ops/s of func over items on a process pool"""
+    items = list(items)
+    with Pool(processes, initializer=_init_worker, initargs=(keys["private_key"],)) as pool:
+        # Start the workers before timing
+        pool.map(abs, range(processes))
+        start = perf_counter()
+        pool.map(func, items)
+        return len(items) / (perf_counter() - start)
+
+
+def rate_summary(ops, count):
+    """Summary of a throughput run in the format of benchutil.summary, the latencies are the mean ms per operation"""
+    ms = 1000 / ops if ops else 0
+    return {"count": count, "min": ms, "p50": ms, "p90": ms, "p99": ms, "max": ms, "ops": ops}
+
+
+def crypto_benchmarks(keys, iterations, kdf_iterations):
+    key = RSA.importKey(keys["private_key"])
+    pubkey = b64encode(keys["public_key"].encode("utf-8")).decode("utf-8")
+    message = "x" * 200
+    encrypted = bismuthcrypto.encrypt_message_with_pubkey(message, pubkey)
+    address_json = json.dumps(keys)
+    level1 = encrypt(PASSWORD, address_json, level=1)
+
+    benchmarks = {
+        "sign_with_key": (lambda: bismuthcrypto.sign_with_key(
+            1560000000.0, keys["address"], RECIPIENT, 1.0, "", "data", key), iterations),
+        "sign_message_with_key": (lambda: bismuthcrypto.sign_message_with_key(message, key), iterations),
+        "encrypt_message_with_pubkey": (lambda: bismuthcrypto.encrypt_message_with_pubkey(message, pubkey), iterations),
+        "decrypt_message_with_key": (lambda: bismuthcrypto.decrypt_message_with_key(encrypted, key), iterations),
+        "RSA.importKey": (lambda: RSA.importKey(keys["private_key"]), iterations),
+        "simplecrypt encrypt level 1": (lambda: encrypt(PASSWORD, address_json, level=1), kdf_iterations),
+        "simplecrypt decrypt level 1": (lambda: decrypt(PASSWORD, level1), kdf_iterations),
+        "keys_gen": (lambda: bismuthcrypto.keys_gen(), kdf_iterations),
+    }
+
+    results = {}
+    # sign_with_key prints on every call
+    with open(os.devnull, 'w') as devnull:
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            for name, (func, count) in benchmarks.items():
+                results[name] = summary(measure(func, iterations=count))
+        finally:
+            sys.stdout = stdout
+    return results
+
+
+def wallet_benchmarks(keys, counts, kdf_iterations, directory):
+    """Open/unlock time of encrypted wallets by address count"""
+    # The spend blob is level 2 and takes seconds, build it once
+    spend = b64encode(encrypt(PASSWORD, json.dumps({"type": None, "value": None}), level=2)).decode("utf-8")
+    blob = b64encode(encrypt(PASSWORD, json.dumps(keys), level=1)).decode("utf-8")
+
+    results = {}
+    for count in counts:
+        filename = os.path.join(directory, f"wallet-{count}.json")
+        with open(filename, 'w') as f:
+            json.dump({"salt": "bench", "spend": spend, "version": MultiWallet.__version__, "coin": "bis",
+                       "encrypted": True, "addresses": [blob] * count}, f)
+        results[f"wallet unlock {count} addresses"] = summary(
+            measure(lambda: MultiWallet(filename, password=PASSWORD), iterations=kdf_iterations, warmup=0))
+    return results
+
+
+def parallel_benchmarks(keys, iterations, kdf_iterations, processes):
+    """Single process vs process pool throughput, {name: (operations, ops/s single, ops/s pool)}"""
+    blobs = [encrypt(PASSWORD, json.dumps(keys), level=1) for _ in range(max(processes, kdf_iterations))]
+
+    with open(os.devnull, 'w') as devnull:
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            _init_worker(keys["private_key"])
+            rows = {
+                "sign_with_key": (iterations,
+                                  throughput(_sign, range(iterations)),
+                                  pool_throughput(_sign, range(iterations), processes, keys)),
+                "simplecrypt decrypt level 1": (len(blobs),
+                                                throughput(_decrypt, blobs),
+                                                pool_throughput(_decrypt, blobs, processes, keys)),
+            }
+        finally:
+            sys.stdout = stdout
+    return rows
+
+
+def main():
+    parser = ArgumentParser(description="Wallet crypto micro-benchmark")
+    parser.add_argument("-n", dest="iterations", type=int, help="iterations of fast operations", default=100)
+    parser.add_argument("-k", dest="kdf_iterations", type=int, help="iterations of key derivation operations", default=3)
+    parser.add_argument("-p", dest="processes", type=int, help="pool size", default=os.cpu_count())
+    parser.add_argument("--addresses", help="address counts for unlock benchmark", default="1,4,16")
+    add_baseline_args(parser)
+    args = parser.parse_args()
+
+    print("Generating key...")
+    keys = bismuthcrypto.keys_gen()
+    counts = [int(c) for c in args.addresses.split(",")]
+
+    tmp = tempfile.mkdtemp()
+    try:
+        results = crypto_benchmarks(keys, args.iterations, args.kdf_iterations)
+        results.update(wallet_benchmarks(keys, counts, args.kdf_iterations, tmp))
+        parallel = parallel_benchmarks(keys, args.iterations, args.kdf_iterations, args.processes)
+    finally:
+        shutil.rmtree(tmp)
+
+    print_table(results)
+
+    print(f"\n{'throughput ops/s':<32} {'1 process':>12} {f'{args.processes} processes':>14} {'speedup':>9}")
+    for name, (count, single, pooled) in parallel.items():
+        print(f"{name:<32} {single:>12.1f} {pooled:>14.1f} {pooled / single:>8.1f}x")
+        # Saved and compared with the other baselines
+        results[f"{name} 1 process"] = rate_summary(single, count)
+        results[f"{name} {args.processes} processes"] = rate_summary(pooled, count)
+
+    sys.exit(check("crypto", results, args))
+
+
+if __name__ == "__main__":
+    main()
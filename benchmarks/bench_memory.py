@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+"""
+Memory per cached transaction
+
+Bytes and allocations per transaction for the formatted dicts of latest_transactions(),
+the decoded JSON rows and the Transaction records the cache and history store hold.
+Rows go through JSON like on the wire, so that no string is shared by accident.
+"""
+
+import sys
+import json
+import tracemalloc
+
+from argparse import ArgumentParser
+from benchutil import check, add_baseline_args
+from mockserver import MockChain
+
+from bismuthclient.bismuthformat import TxFormatter
+from transaction import Transaction
+
+ADDRESS = "33b0e387133dde26cbdb395addb754538dcc99396eb338fe8ca855f3"
+
+
+def footprint(build, payload):
+    """Returns bytes and allocated blocks per transaction of what build(rows) returns"""
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename'))
+    rows = json.loads(payload)
+    result = build(rows)
+    # The decoded rows are freed once converted, like the page of a reply
+    del rows
+    after, _ = tracemalloc.get_traced_memory()
+    blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename')) - blocks
+    tracemalloc.stop()
+    count = len(result)
+    return {"bytes": (after - before) / count, "blocks": blocks / count}
+
+
+def main():
+    parser = ArgumentParser(description="Memory per cached transaction")
+    parser.add_argument("-n", dest="count", type=int, help="transactions", default=20000)
+    parser.add_argument("--key-size", dest="key_size", type=int,
+                        help="length of the public keys, 0 = as in the mock", default=604)
+    add_baseline_args(parser)
+    args = parser.parse_args()
+
+    rows = MockChain(dataset_size=args.count).transactions(ADDRESS, args.count)
+    if args.key_size:
+        # Every sender signs with its own key, as on chain
+        for row in rows:
+            row[6] = (row[2] * (args.key_size // len(row[2]) + 1))[:args.key_size]
+    payload = json.dumps(rows)
+
+    results = {
+        "formatted dict": footprint(lambda rows: [TxFormatter(row).to_json() for row in rows], payload),
+        "decoded row": footprint(lambda rows: [list(row) for row in rows], payload),
+        "Transaction record": footprint(lambda rows: [Transaction.from_row(row) for row in rows], payload),
+    }
+
+    print(f"{'representation':<24} {'bytes/tx':>10} {'allocs/tx':>10}")
+    for name, result in results.items():
+        print(f"{name:<24} {result['bytes']:>10.0f} {result['blocks']:>10.1f}")
+
+    sys.exit(check("memory", results, args, key="bytes"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+"""
+Startup time of tansanit.py
+
+Measures the import time of tansanit.py with '-X importtime' and the wall time
+from process start until the REPL could show its first prompt.
+"""
+
+import os
+import sys
+import tempfile
+import subprocess
+
+from argparse import ArgumentParser
+from benchutil import ROOT, summary, print_table, check, add_baseline_args, isolate_home
+
+# Constructs Tansanit up to the point where cmdloop() would prompt.
+# Server is unreachable on purpose, connecting must not be part of the number.
+FIRST_PROMPT = """
+import sys
+sys.argv = ['tansanit.py', '-w', {wallet!r}, '-s', '127.0.0.1:1', '--no-clear', '--no-banner']
+import tansanit
+tansanit.Tansanit()
+"""
+
+
+def import_times(runs):
+    """Returns the import time of tansanit per run and the cumulative time per module it imports"""
+    totals, modules = [], {}
+    for _ in range(runs):
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import tansanit"],
+            cwd=ROOT, capture_output=True, text=True)
+        children = []
+        for line in proc.stderr.splitlines():
+            if not line.startswith("import time:"):
+                continue
+            _, cumulative, name = line[len("import time:"):].split("|")
+            if not cumulative.strip().isdigit():
+                # Header
+                continue
+            # Nested imports are indented by two spaces per level and listed before their parent
+            depth = (len(name) - len(name.lstrip()) - 1) // 2
+            seconds = int(cumulative) / 1000000
+            if depth == 1:
+                children.append((name.strip(), seconds))
+            elif depth == 0:
+                if name.strip() == "tansanit":
+                    totals.append(seconds)
+                    for child, child_seconds in children:
+                        modules.setdefault(child, []).append(child_seconds)
+                children = []
+    return totals, modules
+
+
+def first_prompt_times(runs, wallet):
+    import time
+
+    code = FIRST_PROMPT.format(wallet=wallet)
+    samples = []
+    # First run creates the wallet, not part of the measurement
+    for i in range(runs + 1):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, check=True)
+        if i:
+            samples.append(time.perf_counter() - start)
+    return samples
+
+
+def main():
+    parser = ArgumentParser(description="Tansanit startup benchmark")
+    parser.add_argument("-n", dest="runs", type=int, help="number of runs", default=10)
+    parser.add_argument("--budget-ms", dest="budget", type=float, help="fail if first prompt p50 is slower", default=None)
+    add_baseline_args(parser)
+    args = parser.parse_args()
+
+    totals, modules = import_times(args.runs)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        isolate_home(tmp)
+        prompt = first_prompt_times(args.runs, os.path.join(tmp, "wallet.json"))
+
+    results = {"import tansanit": summary(totals), "first prompt": summary(prompt)}
+    print_table(results)
+
+    print("\nSlowest imports of tansanit (p50 ms)")
+    slowest = sorted(modules.items(), key=lambda m: summary(m[1])["p50"], reverse=True)[:10]
+    for name, samples in slowest:
+        print(f"  {summary(samples)['p50']:>9.2f}  {name}")
+
+    code = check("startup", results, args)
+    if args.budget and results["first prompt"]["p50"] > args.budget:
+        print(f"\nOVER BUDGET: first prompt {results['first prompt']['p50']:.2f} ms > {args.budget:.2f} ms")
+        code = 1
+    sys.exit(code)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Helpers shared by the benchmark scripts
+"""
+
+import os
+import sys
+import json
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_DIR = os.path.join(ROOT, "benchmarks", "baselines")
+
+# Make the wallet modules importable when run as 'python benchmarks/<script>.py'
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+# Files the wallet modules take from the environment on import
+ENV_FILES = {"TANSANIT_SERVERS_CACHE": "servers.json", "TANSANIT_PENDING": "pending.json",
+             "TANSANIT_AGENT_SOCK": "agent.sock", "TANSANIT_RPC_SOCK": "client.sock"}
+
+
+def isolate_home(home):
+    """
+    Points HOME and the TANSANIT_* files into a folder, benchmarks never touch the real ~/.tansanit.
+    Call before client or tansanit are imported, subprocesses started later inherit it.
+    """
+    os.environ["HOME"] = home
+    for name, filename in ENV_FILES.items():
+        os.environ[name] = os.path.join(home, ".tansanit", filename)
+    # Transaction history in memory
+    os.environ.pop("TANSANIT_HISTORY", None)
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not samples:
+        return 0
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summary(samples):
+    """Latency summary in milliseconds for a list of durations in seconds"""
+    total = sum(samples)
+    return {"count": len(samples),
+            "min": min(samples) * 1000 if samples else 0,
+            "p50": percentile(samples, 50) * 1000,
+            "p90": percentile(samples, 90) * 1000,
+            "p99": percentile(samples, 99) * 1000,
+            "max": max(samples) * 1000 if samples else 0,
+            "ops": len(samples) / total if total else 0}
+
+
+def measure(func, iterations=100, warmup=1):
+    """Calls func iterations times and returns the list of durations in seconds"""
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def print_table(results):
+    """Prints a {name: summary} dict as a table"""
+    print(f"{'benchmark':<36} {'count':>6} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9} {'ops/s':>9}")
+    for name, s in results.items():
+        print(f"{name:<36} {s['count']:>6} {s['p50']:>9.2f} {s['p90']:>9.2f} "
+              f"{s['p99']:>9.2f} {s['max']:>9.2f} {s['ops']:>9.1f}")
+
+
+def load_baseline(name):
+    filename = os.path.join(BASELINE_DIR, f"{name}.json")
+    if not os.path.isfile(filename):
+        return {}
+    with open(filename) as f:
+        return json.load(f)
+
+
+def save_baseline(name, results):
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+    with open(os.path.join(BASELINE_DIR, f"{name}.json"), 'w') as f:
+        json.dump(results, f, indent=4, sort_keys=True)
+
+
+def regressions(results, baseline, key="p50", tolerance=0.2):
+    """
+    Compares results against a baseline.
+
+    :param key: the summary value to compare
+    :param tolerance: allowed relative slowdown, 0.2 = 20%
+    :return: list of (name, baseline value, new value) that got slower than allowed
+    """
+    slower = []
+    for name, s in results.items():
+        if name in baseline and baseline[name][key] and s[key] > baseline[name][key] * (1 + tolerance):
+            slower.append((name, baseline[name][key], s[key]))
+    return slower
+
+
+def check(name, results, args, key="p50"):
+    """Saves or compares a baseline depending on the --save/--compare arguments. Returns the exit code"""
+    if args.save:
+        save_baseline(name, results)
+        print(f"\nBaseline '{name}' saved")
+        return 0
+    if args.compare:
+        slower = regressions(results, load_baseline(name), key=key, tolerance=args.tolerance)
+        for bench, old, new in slower:
+            print(f"REGRESSION {bench}: {key} {old:.2f} -> {new:.2f}")
+        return 1 if slower else 0
+    return 0
+
+
+def add_baseline_args(parser):
+    parser.add_argument("--save", action="store_true", help="save results as new baseline", default=False)
+    parser.add_argument("--compare", action="store_true", help="fail if slower than baseline", default=False)
+    parser.add_argument("--tolerance", type=float, help="allowed slowdown vs baseline (0.2 = 20%%)", default=0.2)
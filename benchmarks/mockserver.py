@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+
+"""
+Local stand-in for a Bismuth wallet server
+
+Speaks the rpcconnections wire protocol (10 byte length header + JSON, command
+first, then one message per option) and serves a synthetic, deterministic chain.
+Latency, jitter, errors and dataset size are configurable.
+"""
+
+import json
+import time
+import base64
+import random
+import socket
+import hashlib
+import threading
+import socketserver
+
+from argparse import ArgumentParser
+
+SLEN = 10
+
+START_HEIGHT = 1000000
+START_TIME = 1560000000
+
+
+def _hash(*parts):
+    return hashlib.sha224("-".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+
+class MockChain:
+    """Synthetic history for any address, plus a mempool that gets mined into blocks"""
+
+    def __init__(self, dataset_size=1000, block_time=0, counterparties=50):
+        """
+        :param dataset_size: int, number of synthetic transactions per address
+        :param block_time: float, seconds per block. 0 = only mine on mine() calls
+        :param counterparties: int, number of distinct addresses in synthetic history
+        """
+        self.dataset_size = dataset_size
+        self.block_time = block_time
+        self.height = START_HEIGHT + dataset_size * 3
+        self.started = time.time()
+        self.last_block = self.started
+        self.counterparties = [_hash("counterparty", i) for i in range(counterparties)]
+        self.mempool = []
+        self.public_keys = {}
+        self._history = {}
+        self._mined = {}
+        self._lock = threading.Lock()
+
+    def _synthetic(self, address):
+        if address not in self._history:
+            rows = []
+            for i in range(self.dataset_size):
+                counterparty = self.counterparties[int(_hash(address, i)[:4], 16) % len(self.counterparties)]
+                incoming = i % 3 != 0
+                sender, recipient = (counterparty, address) if incoming else (address, counterparty)
+                signature = base64.b64encode(hashlib.sha512(_hash(address, "sig", i).encode()).digest() * 8).decode()
+                rows.append([START_HEIGHT + (self.dataset_size - i) * 3,
+                             float(START_TIME + (self.dataset_size - i) * 180),
+                             sender,
+                             recipient,
+                             "%.8f" % (i % 97 + 0.5),
+                             signature,
+                             "mock",
+                             _hash("block", i),
+                             "0.00000000" if incoming else "0.01000000",
+                             "0",
+                             ["", "token:transfer", "alias:register"][i % 7 % 3],
+                             f"invoice {i}" if i % 5 else ""])
+            self._history[address] = rows
+        return self._history[address]
+
+    def tick(self):
+        """Mines the mempool if a block is due"""
+        if self.block_time and time.time() - self.last_block >= self.block_time:
+            self.mine()
+
+    def mine(self):
+        """Includes the whole mempool in a new block"""
+        with self._lock:
+            self.height += 1
+            self.last_block = time.time()
+            block_hash = _hash("block", self.height)
+            for tx in self.mempool:
+                timestamp, sender, recipient, amount, signature, public_key, operation, openfield, _ = tx
+                row = [self.height, timestamp, sender, recipient, amount, signature, public_key,
+                       block_hash, "0.01000000", "0", operation, openfield]
+                for address in {sender, recipient}:
+                    self._mined.setdefault(address, []).insert(0, row)
+            self.mempool = []
+
+    def transactions(self, address, num, offset=0):
+        with self._lock:
+            mined = list(self._mined.get(address, []))
+        history = mined[offset:offset + num]
+        if len(history) < num:
+            start = max(0, offset - len(mined))
+            history += self._synthetic(address)[start:start + num - len(history)]
+        return history
+
+    def balance(self, address):
+        credit = debit = fees = 0
+        for tx in self._synthetic(address) + self._mined.get(address, []):
+            if tx[3] == address:
+                credit += float(tx[4])
+            if tx[2] == address:
+                debit += float(tx[4])
+                fees += float(tx[8])
+        balance = credit - debit - fees
+        return ["%.8f" % v for v in (balance, credit, debit, fees, 0, balance)]
+
+    def insert(self, tx):
+        timestamp, sender, recipient, amount, signature, public_key, operation, openfield = tx
+        with self._lock:
+            if any(m[4] == signature for m in self.mempool):
+                return ["Transaction already in mempool"]
+            self.mempool.append([float(timestamp), sender, recipient, amount, signature, public_key,
+                                 operation, openfield, time.time()])
+            self.public_keys[sender] = public_key
+        return ["Success"]
+
+
+class MockServer:
+
+    # Number of options every command takes after the command itself
+    COMMANDS = {
+        "statusjson": 0,
+        "wstatusget": 0,
+        "balanceget": 1,
+        "globalbalanceget": 1,
+        "addlistlim": 2,
+        "addlistlimfrom": 3,
+        "aliasesget": 1,
+        "aliascheck": 1,
+        "pubkeyget": 1,
+        "mpinsert": 1,
+        "mpget": 0,
+        "blocklast": 0,
+    }
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0, error_rate=0.0,
+                 dataset_size=1000, block_time=0, seed=None):
+        """
+        :param latency: float, seconds added to every reply
+        :param jitter: float, random +/- seconds on top of latency
+        :param error_rate: float, probability to drop the connection instead of replying
+        :param dataset_size: int, synthetic transactions per address
+        :param block_time: float, seconds per block, 0 = mine manually
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.chain = MockChain(dataset_size=dataset_size, block_time=block_time)
+        self.random = random.Random(seed)
+        self.requests = {}
+        self._server = socketserver.ThreadingTCPServer((host, port), _MockHandler)
+        self._server.daemon_threads = True
+        self._server.mock = self
+        self._thread = None
+
+    @property
+    def ipport(self):
+        host, port = self._server.server_address[:2]
+        return f"{host}:{port}"
+
+    def start(self):
+        """Serves in a background thread, returns ip:port"""
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self.ipport
+
+    def serve(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reply(self, command, options):
+        """Returns the reply for a command or raises ConnectionAbortedError to simulate a failure"""
+        self.requests[command] = self.requests.get(command, 0) + 1
+        self.chain.tick()
+
+        delay = self.latency + (self.random.uniform(-self.jitter, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            time.sleep(delay)
+        if self.error_rate and self.random.random() < self.error_rate:
+            raise ConnectionAbortedError(command)
+
+        return getattr(self, f"_{command}")(*options)
+
+    def _statusjson(self):
+        return {"protocolversion": "mainnet0020", "walletversion": "mock", "testnet": False,
+                "blocks": self.chain.height, "timeoffset": 0, "connections": 8, "difficulty": 110.0,
+                "threads": 4, "uptime": int(time.time() - self.chain.started),
+                "consensus": self.chain.height, "consensus_percent": 100,
+                "server_timestamp": "%.2f" % time.time()}
+
+    def _wstatusget(self):
+        return {"clients": 1, "max_clients": 100, "version": "mock"}
+
+    def _balanceget(self, address):
+        return self.chain.balance(address)
+
+    def _globalbalanceget(self, addresses):
+        total = sum(float(self.chain.balance(address)[0]) for address in addresses)
+        return ["%.8f" % total]
+
+    def _addlistlim(self, address, num):
+        return self.chain.transactions(address, int(num))
+
+    def _addlistlimfrom(self, address, num, offset):
+        return self.chain.transactions(address, int(num), int(offset))
+
+    def _aliasesget(self, addresses):
+        return [f"alias_{address[:8]}" if int(address[:2], 16) % 3 == 0 else address for address in addresses]
+
+    def _aliascheck(self, alias):
+        return "Alias free"
+
+    def _pubkeyget(self, address):
+        return self.chain.public_keys.get(address, "")
+
+    def _mpinsert(self, tx):
+        return self.chain.insert(tx)
+
+    def _mpget(self):
+        return list(self.chain.mempool)
+
+    def _blocklast(self):
+        height = self.chain.height
+        return [height, time.time(), "", "", "0", "", "", _hash("block", height), "0", "0", "", ""]
+
+
+class _MockHandler(socketserver.BaseRequestHandler):
+
+    def _receive(self):
+        header = b""
+        while len(header) < SLEN:
+            chunk = self.request.recv(SLEN - len(header))
+            if not chunk:
+                return None
+            header += chunk
+        size = int(header)
+        data = b""
+        while len(data) < size:
+            chunk = self.request.recv(min(size - len(data), 65536))
+            if not chunk:
+                return None
+            data += chunk
+        return json.loads(data.decode("utf-8"))
+
+    def _send(self, data):
+        data = json.dumps(data).encode("utf-8")
+        self.request.sendall(str(len(data)).encode("utf-8").zfill(SLEN) + data)
+
+    def handle(self):
+        mock = self.server.mock
+        while True:
+            command = self._receive()
+            if command is None:
+                return
+            if command not in mock.COMMANDS:
+                # Real nodes ignore unknown commands, the client would time out
+                return
+            options = []
+            for _ in range(mock.COMMANDS[command]):
+                option = self._receive()
+                if option is None:
+                    return
+                options.append(option)
+            try:
+                reply = mock.reply(command, options)
+            except ConnectionAbortedError:
+                self.request.shutdown(socket.SHUT_RDWR)
+                return
+            self._send(reply)
+
+
+def main():
+    parser = ArgumentParser(description="Mock Bismuth wallet server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5658)
+    parser.add_argument("--latency", type=float, help="seconds per reply", default=0.0)
+    parser.add_argument("--jitter", type=float, help="random +/- seconds per reply", default=0.0)
+    parser.add_argument("--errors", type=float, help="probability to drop the connection", default=0.0)
+    parser.add_argument("--dataset", type=int, help="transactions per address", default=1000)
+    parser.add_argument("--block-time", dest="block_time", type=float, help="seconds per block", default=60)
+    args = parser.parse_args()
+
+    server = MockServer(args.host, args.port, latency=args.latency, jitter=args.jitter, error_rate=args.errors,
+                        dataset_size=args.dataset, block_time=args.block_time)
+    print(f"Mock wallet server on {server.ipport}")
+    server.serve()
+
+
+if __name__ == "__main__":
+    main()
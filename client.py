@@ -1,16 +1,29 @@
+import sys
 import time
 import json
+import heapq
 import base64
+import random
 import logging
+import threading
 
-from time import time
+from concurrent import futures
+from time import time, perf_counter
 from datetime import timedelta
-from bismuthclient import lwbench
-from bismuthclient import bismuthapi
 from bismuthclient import bismuthcrypto
-from bismuthclient import rpcconnections
+from metrics import Metrics
 from multiwallet import MultiWallet
-from bismuthclient.bismuthformat import TxFormatter, AmountFormatter
+from agent import AgentWallet
+from transport import Transport, ConnectionPool, READ_COMMANDS, received_bytes
+from hedge import HedgePolicy
+from quorum import QuorumPolicy
+from health import ServerHealth, to_ipport
+from clock import ClockSync
+from history import HistoryStore
+from export import HistoryExport
+from analytics import Ledger, to_amount
+from transaction import Transaction
+from bismuthclient.bismuthformat import AmountFormatter
 from os import path
 
 
@@ -19,20 +32,41 @@ A all in one Bismuth Native client that connects to local or distant wallet serv
 """
 
 
+class _Executor(futures.ThreadPoolExecutor):
+    """Thread pool whose tasks are profiled while a profiler.Profile records, see profiler.py"""
+
+    def submit(self, fn, *args, **kwargs):
+        # Imported by profiled commands only: not loaded, nothing records
+        profiler = sys.modules.get("profiler")
+        profile = profiler.Profile.active if profiler else None
+        if profile:
+            return super().submit(profile.run, fn, *args, **kwargs)
+        return super().submit(fn, *args, **kwargs)
+
+
 class Client:
 
     __version__ = '0.0.44'
 
     __slots__ = ('initial_servers', 'servers', 'log', 'address',
                  '_current_server', 'wallet_file', '_wallet', '_connection', '_cache',
-                 'verbose', 'full_servers', 'time_drift', '_alias_cache', '_alias_cache_file')
+                 'verbose', 'full_servers', 'time_drift', '_alias_cache', '_alias_cache_file', '_agent',
+                 '_metrics', '_transport', '_health',
+                 '_random', '_hedge', '_quorum', '_pool', '_executor', '_requests', '_lock', '_server_lock',
+                 '_inflight', '_prefetch_page', '_history', '_ledgers', '_clock', '_clock_interval', '_clock_wake')
+
+    # rebalance() only leaves a server scoring below this share of the best one
+    REBALANCE_RATIO = 0.5
+    # Seconds before the clock sync is retried after a failure, doubled per failure up to the interval
+    CLOCK_RETRY = 1
 
     # Hardcoded list of addresses that need a message (like exchanges)
     REJECT_EMPTY_MSG = ['f6c0363ca1c5aa28cc584252e65a63998493ff0a5ec1bb16beda9bac',
                         '49ca873779b36c4a503562ebf5697fca331685d79fd3deef64a46888',
                         'edf2d63cdf0b6275ead22c9e6d66aa8ea31dc0ccb367fad2e7c08a25']
 
-    def __init__(self, wallet_file='wallet.json', password=None, servers=None, log=None, verbose=False):
+    def __init__(self, wallet_file='wallet.json', password=None, servers=None, log=None, verbose=False, agent=None,
+                 transport=None):
         self.verbose = verbose
         self.servers = servers if servers else []
         self.initial_servers = self.servers
@@ -47,6 +81,38 @@ class Client:
         self._alias_cache = {}
         self._alias_cache_file = None
         self.time_drift = 0  # Difference between local time and server time
+        # Estimates time_drift from every statusjson, see set_clock_sync()
+        self._clock = ClockSync()
+        self._clock_interval = None
+        self._clock_wake = threading.Event()
+        self._agent = agent  # Optional AgentClient holding the unlocked keys
+        self._metrics = Metrics()
+        # Discovery and connections, see transport.py for record/replay
+        self._transport = transport if transport else Transport(log=self.log)
+        self._health = ServerHealth(log=self.log)
+        # Own random source, so that each instance spreads differently across servers
+        self._random = random.Random()
+        # Hedged requests, see set_hedging()
+        self._hedge = None
+        # Quorum reads, see set_quorum()
+        self._quorum = None
+        # Connections for commands running while the main one is busy
+        self._pool = ConnectionPool(self._transport, verbose=self.verbose)
+        self._executor = None
+        # Requests to single servers for hedging and quorum reads, see _init_executor()
+        self._requests = None
+        # Guards caches and wallet switches
+        self._lock = threading.RLock()
+        # Guards server selection, held during discovery
+        self._server_lock = threading.RLock()
+        # Read requests in flight: identical ones share the same Future
+        self._inflight = {}
+        # Transactions per page to prefetch, 0 = no prefetch, see set_prefetch()
+        self._prefetch_page = 0
+        # Local indexed copy of the transactions, see search_transactions()
+        self._history = HistoryStore(log=self.log)
+        # Columnar copies of the history per address, see report()
+        self._ledgers = {}
 
         self.load_multi_wallet(wallet_file, password=password)
 
@@ -60,29 +126,41 @@ class Client:
             with open(filename) as f:
                 self._alias_cache = json.load(f)
 
+    def set_health_file(self, filename: str):
+        """Define an optional file for persistent server health, used to reconnect at once on next start"""
+        self._health = ServerHealth(filename, log=self.log)
+
+    def set_history_file(self, filename: str):
+        """Define an optional SQLite file for the local transaction history, kept between runs"""
+        self._history.close()
+        self._history = HistoryStore(filename, log=self.log)
+        self._ledgers = {}
+
     def get_aliases(self, addresses: list) -> dict:
         """Get alias from a list of addresses. returns a dict {address:alias (or '')}"""
         # Filter out the ones from valid cache
         now = time()
         addresses = set(addresses)  # dedup
         cached = {address: self._alias_cache[address][0] for address in addresses if address in self._alias_cache and self._alias_cache[address][1] > now}
-        print("cached", cached)
         # Ask for the rest.
         unknown = [address for address in addresses if address not in cached]
+        if not unknown:
+            return cached
         aliases = self.command("aliasesget", [unknown])
         # Returns a list of aliases (or addresses if no alias)
         # print("aliases", aliases)
         new = dict(zip(unknown, aliases))
-        for address, alias in new.items():
-            # cache empty ones for 1 hour, existing ones for a day.
-            if address == alias:
-                self._alias_cache[address] = [alias, now + 3600]
-            else:
-                self._alias_cache[address] = [alias, now + 3600 * 24]
-        # save cache if alias_cache_file is defined
-        if self._alias_cache_file:
-            with open(self._alias_cache_file, 'w') as fp:
-                json.dump(self._alias_cache, fp)
+        with self._lock:
+            for address, alias in new.items():
+                # cache empty ones for 1 hour, existing ones for a day.
+                if address == alias:
+                    self._alias_cache[address] = [alias, now + 3600]
+                else:
+                    self._alias_cache[address] = [alias, now + 3600 * 24]
+            # save cache if alias_cache_file is defined
+            if self._alias_cache_file:
+                with open(self._alias_cache_file, 'w') as fp:
+                    json.dump(self._alias_cache, fp)
         # return merge
         return {**cached, **new}
 
@@ -102,17 +180,21 @@ class Client:
     # --- cache functions
 
     def _get_cached(self, key, timeout_sec=30):
-        if key in self._cache:
-            data = self._cache[key]
-            if data[0] + timeout_sec >= time():
-                return data[1]
+        with self._lock:
+            data = self._cache.get(key)
+        if data and data[0] + timeout_sec >= time():
+            self._metrics.cache_hit()
+            return data[1]
+        self._metrics.cache_miss()
         return None
 
     def _set_cache(self, key, value):
-        self._cache[key] = (time(), value)
+        with self._lock:
+            self._cache[key] = (time(), value)
 
     def clear_cache(self):
-        self._cache = {}
+        with self._lock:
+            self._cache = {}
 
     # --- server functions
 
@@ -120,83 +202,181 @@ class Client:
     def current_server(self):
         return self._current_server
 
+    def _use(self, server, connection):
+        """Switches server and connection together, returns the previous connection"""
+        with self._server_lock:
+            old = self._connection
+            switched = server != self._current_server
+            self._current_server, self._connection = server, connection
+        if switched:
+            # Another server has another clock, measure again
+            self._clock.reset()
+            self._clock_wake.set()
+        return old
+
     def set_server(self, ipport):
         """
         Tries to connect and use the given server
         :param ipport:
         :return:
         """
-        if not lwbench.connectible(ipport):
-            self._current_server = None
-            self._connection = None
-            return False
-        self._current_server = ipport
+        with self._server_lock:
+            if not self._transport.connectible(ipport):
+                self._health.failure(ipport, "Not connectible")
+                self._use(None, None)
+                return False
+            if not self.full_servers:
+                self.servers = [ipport]
+                self.full_servers = [self._health.get(ipport) or self._server_dict(ipport)]
 
-        if self.verbose:
-            print("connect server", ipport)
-        self._connection = rpcconnections.Connection(ipport, verbose=self.verbose)
+            if self.verbose:
+                print("connect server", ipport)
+            self._use(ipport, self._transport.connect(ipport, verbose=self.verbose))
+        self.prefetch()
         return ipport
 
+    @staticmethod
+    def _server_dict(ipport):
+        ip, port = ipport.split(':')
+        return {"ip": ip, "port": port, 'load': 'N/A', 'height': 'N/A'}
+
+    def _reconnect(self):
+        """
+        Connects to the last known good server from the health cache, without discovery or probing.
+        The server list is then refreshed in the background.
+        """
+        server = self._health.last_good
+        if not server or (self.initial_servers and server not in self.initial_servers):
+            return None
+        try:
+            if self.verbose:
+                print("reconnect server", server)
+            self._use(server, self._transport.connect(server, verbose=self.verbose))
+        except Exception as e:
+            self.log.warning(f"Last known good server {server} failed: {e}")
+            self._health.failure(server, e)
+            return None
+
+        if self.initial_servers:
+            self.servers = self.initial_servers
+            self.full_servers = [self._health.get(s) or self._server_dict(s) for s in self.servers]
+        else:
+            self.full_servers = self._health.servers()
+            self.servers = [to_ipport(s) for s in self.full_servers]
+            threading.Thread(target=self._refresh_in_background, daemon=True).start()
+        return server
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh_servers()
+        except Exception as e:
+            self.log.warning(f"Server refresh failed: {e}")
+
     def get_server(self):
         """
         Tries to find the best available server given the config and sets self._current_server for later use.
 
-        Returns the first connectible server.
+        Returns the last known good server if it still connects. Otherwise servers are tried in weighted
+        random order, see ServerHealth.weights(), and the first connectible one is used.
         """
-        # Use the API or bench to get the best one.
-        if not len(self.initial_servers):
-            self.full_servers = bismuthapi.get_wallet_servers_legacy(self.initial_servers, self.log, minver='0.1.5', as_dict=True)
-            self.servers = ["{}:{}".format(server['ip'], server['port']) for server in self.full_servers]
-        else:
-            self.servers = self.initial_servers
-            self.full_servers = [
-                {
-                    "ip": server.split(':')[0],
-                    "port": server.split(':')[1],
-                    'load':'N/A',
-                    'height': 'N/A'
-                }
-                for server in self.servers
-            ]
-
-        # Now try to connect
-        if self.verbose:
-            print("self.servers_list", self.servers)
-        for server in self.servers:
+        # Other threads wait for this one instead of searching too
+        with self._server_lock:
+            if self._reconnect():
+                self.prefetch()
+                return self._current_server
+
+            # Use the API or bench to get the best one.
+            if not len(self.initial_servers):
+                self.full_servers = self._transport.wallet_servers(self.initial_servers)
+                self._health.merge(self.full_servers)
+                self.servers = [to_ipport(server) for server in self.full_servers]
+            else:
+                self.servers = self.initial_servers
+                self.full_servers = [self._server_dict(server) for server in self.servers]
+
+            # Now try to connect
             if self.verbose:
-                print("test server", server)
-            if lwbench.connectible(server):
-                self._current_server = server
-                # TODO: if self._loop, use async version
+                print("self.servers_list", self.servers)
+            for server in self._health.order(self.servers, self._random):
                 if self.verbose:
-                    print("connect server", server)
-                self._connection = rpcconnections.Connection(server, verbose=self.verbose)
-                return server
-        self._current_server = None
-        self._connection = None
-        # TODO: raise
-        return None
+                    print("test server", server)
+                if self._probe(server):
+                    # TODO: if self._loop, use async version
+                    if self.verbose:
+                        print("connect server", server)
+                    self._use(server, self._transport.connect(server, verbose=self.verbose))
+                    self.prefetch()
+                    return server
+            self._use(None, None)
+            # TODO: raise
+            return None
+
+    def _probe(self, server):
+        """Checks that the server is connectible and records the connect time"""
+        start = perf_counter()
+        if self._transport.connectible(server):
+            self._health.probe(server, perf_counter() - start)
+            return True
+        self._health.failure(server, "Not connectible")
+        return False
+
+    def rebalance(self):
+        """
+        Probes the known servers and moves to another one if the current server scores below
+        REBALANCE_RATIO of the best. The new server is drawn in weighted random order like in get_server.
+        Commands in flight finish on the old connection before it's closed.
+
+        Returns the server in use.
+        """
+        servers = list(self.servers)
+        if not servers:
+            return self.get_server()
+        # The current server too: all are compared on the same connect time
+        for server in servers:
+            self._probe(server)
+
+        weights = self._health.weights(servers, measure="connect_rtt")
+        if weights.get(self._current_server, 0) >= self.REBALANCE_RATIO * max(weights.values()):
+            return self._current_server
+
+        for server in self._health.order(servers, self._random, measure="connect_rtt"):
+            if server == self._current_server:
+                continue
+            try:
+                connection = self._transport.connect(server, verbose=self.verbose)
+            except Exception as e:
+                self._health.failure(server, e)
+                continue
+            if self.verbose:
+                print("rebalance to server", server)
+            old = self._use(server, connection)
+            if old:
+                # Waits for a command in flight on the old connection
+                lock = getattr(old, 'command_lock', None)
+                if lock:
+                    with lock:
+                        old.close()
+                else:
+                    old.close()
+            return server
+        return self._current_server
 
     def refresh_servers(self):
         """
         Gets info from api, add to previous config list.
         :return:
         """
-        backup = list(self.full_servers)
-        self.full_servers = bismuthapi.get_wallet_servers_legacy(
-            self.initial_servers,
-            self.log,
-            minver='0.1.5', as_dict=True)
+        fresh = self._transport.wallet_servers(self.initial_servers)
+        self._health.merge(fresh)
 
-        for server in backup:
-            is_there = False
-            for present in self.full_servers:
-                if server['ip'] == present['ip'] and server['port'] == present['port']:
-                    is_there = True
-            if not is_there:
-                self.full_servers.append(server)
+        # Api order first, then the servers we knew before
+        merged = {to_ipport(server): server for server in fresh}
+        for server in self.full_servers or []:
+            merged.setdefault(to_ipport(server), server)
 
-        self.servers = [f"{server['ip']}:{server['port']}" for server in self.full_servers]
+        self.full_servers = list(merged.values())
+        self.servers = list(merged.keys())
+        self._health.save()
 
     # --- wallet functions
 
@@ -210,22 +390,283 @@ class Client:
         """
         if not self.address or not self._wallet:
             return []
-        try:
-            key = "tx{}-{}".format(num, offset)
-            cached = self._get_cached(key)
-            if cached:
-                return cached
-            if offset == 0:
-                transactions = self.command("addlistlim", [self.address, num])
+        transactions = self._transactions(self.address, num, offset)
+        if self._prefetch_page and transactions:
+            # The next page is likely to be asked for next
+            self._prefetch(self._transactions, self.address, num, int(offset) + int(num))
+        return [tx.to_json(for_display=for_display) for tx in transactions]
+
+    def iter_transactions(self, address=None, page=100, offset=0):
+        """
+        Yields the transactions of an address as Transaction records, newest first, fetching one page at a time.
+        Only the current page is held in memory.
+
+        :param address: string, default is the current address
+        :param page: int, transactions per request
+        :param offset: int, number of newest transactions to skip
+        """
+        address = address if address else self.address
+        yield from self._rows(address, page, offset, ahead=bool(self._prefetch_page))
+
+    def iter_transactions_oldest_first(self, address=None, page=100, count=None):
+        """
+        Yields the transactions of an address as Transaction records, oldest first, fetching one page at a time.
+        The server lists newest first: pages are requested from the last offset back to the first.
+        Only the current page is held in memory.
+
+        :param address: string, default is the current address
+        :param page: int, transactions per request
+        :param count: int, number of transactions of the address if known, see count_transactions()
+        """
+        address = address if address else self.address
+        end = count if count is not None else self.count_transactions(address)
+        # New transactions move the older ones to higher offsets while we walk
+        last_height, seen = None, set()
+        while end > 0:
+            start = max(0, end - page)
+            # One row more than the page: the newest of the last page, it stays at offset end unless the list shifted
+            transactions = self._fetch_transactions(address, end - start + (last_height is not None), start)
+            if not transactions:
+                return
+            oldest, height = transactions[-1], int(transactions[-1].block_height)
+            if last_height is not None and (height > last_height or height == last_height and oldest.signature not in seen):
+                # Nothing yielded yet in this page: step back over the rows pushed past it, repeats are skipped
+                end += page
+                continue
+            for tx in reversed(transactions):
+                height = int(tx.block_height)
+                if last_height is not None and height < last_height:
+                    continue
+                if height != last_height:
+                    last_height, seen = height, set()
+                if tx.signature in seen:
+                    continue
+                seen.add(tx.signature)
+                yield tx
+            end = start
+
+    def count_transactions(self, address=None):
+        """Returns the number of transactions of an address, with the single transaction requests of find_offset()"""
+        # No block is below -1: the offset found is the end of the list
+        return self.find_offset(-1, address)
+
+    def iter_wallet_transactions(self, page=100, block_height=None, oldest_first=False):
+        """
+        Yields the transactions of all wallet addresses as one timeline of Transaction records, newest first.
+        Histories are fetched concurrently, page by page, and merged with a heap: memory holds
+        about two pages per address. Transfers between own addresses are only yielded once.
+
+        :param page: int, transactions per request and address
+        :param block_height: int, start at this block instead of the newest transaction
+        :param oldest_first: bool, the whole timeline from the oldest transaction, block_height is ignored
+        """
+        addresses = [address['address'] for address in self._wallet.addresses]
+        own = set(addresses)
+        self._init_executor()
+
+        if oldest_first:
+            counts = {address: self._executor.submit(self.count_transactions, address) for address in addresses}
+            streams = [self.iter_transactions_oldest_first(address, page, counts[address].result())
+                       for address in addresses]
+        else:
+            offsets = {address: 0 for address in addresses}
+            if block_height:
+                found = {address: self._executor.submit(self.find_offset, block_height, address)
+                         for address in addresses}
+                offsets = {address: future.result() for address, future in found.items()}
+            # First pages of all addresses at once
+            first = {address: self._executor.submit(self._fetch_transactions, address, page, offsets[address])
+                     for address in addresses}
+            streams = [self._rows(address, page, offsets[address], ahead=True, first=first[address])
+                       for address in addresses]
+
+        internal = set()
+        current = None
+        for tx in heapq.merge(*streams, key=lambda tx: (tx.block_height, tx.timestamp), reverse=not oldest_first):
+            if tx.address in own and tx.recipient in own and tx.address != tx.recipient:
+                # Both histories have it, only remember signatures of the current block
+                if tx.block_height != current:
+                    internal, current = set(), tx.block_height
+                if tx.signature in internal:
+                    continue
+                internal.add(tx.signature)
+            yield tx
+
+    def _rows(self, address, page, offset, ahead=False, first=None):
+        """
+        Yields Transaction records page by page, bypassing the cache that would keep the whole history.
+
+        :param ahead: bool, fetch the next page while the current one is consumed
+        :param first: Future of the first page, if already requested
+        """
+        next_page = first
+        # Only the first page may come from the cache, filled by prefetch()
+        cached = None if first else self._get_cached(self._page_key(address, page, offset))
+        while True:
+            if cached is not None:
+                transactions, cached = cached, None
+            else:
+                transactions = next_page.result() if next_page else self._fetch_transactions(address, page, offset)
+            next_page = None
+            if ahead and len(transactions) == page:
+                next_page = self._executor.submit(self._fetch_transactions, address, page, offset + page)
+            yield from transactions
+            if len(transactions) < page:
+                return
+            offset += page
+
+    def sync_history(self, address=None, page=100):
+        """
+        Copies the transactions of an address missing from the local history and returns how many were added.
+        Pages are requested newest first and only down to the block of the previous sync.
+        """
+        address = address if address else self.address
+        synced = self._history.synced(address)
+        self._init_executor()
+
+        added = 0
+        newest = None
+        batch = []
+        rows = self._rows(address, page, 0, ahead=True)
+        for tx in rows:
+            if synced is not None and int(tx.block_height) < synced:
+                break
+            if newest is None:
+                newest = int(tx.block_height)
+            batch.append(tx)
+            if len(batch) >= page:
+                added += self._history.insert(address, batch)
+                batch = []
+        rows.close()
+        if batch:
+            added += self._history.insert(address, batch)
+        # Only once complete: an interrupted sync starts over, known rows are skipped
+        if newest is not None:
+            self._history.set_synced(address, newest)
+        return added
+
+    def search_transactions(self, address=None, direction=None, counterparty=None, operation=None, text=None,
+                            min_amount=None, max_amount=None, since=None, until=None, min_block=None,
+                            max_block=None, limit=100, sync=True, for_display=False, records=False):
+        """
+        Searches the local history of an address, newest first, see HistoryStore.search() for the criteria.
+
+        :param sync: bool, fetch the new transactions first
+        :param records: bool, return Transaction records instead of dicts
+        """
+        address = address if address else self.address
+        if sync:
+            self.sync_history(address)
+        transactions = self._history.search(address, direction=direction, counterparty=counterparty,
+                                            operation=operation, text=text, min_amount=min_amount,
+                                            max_amount=max_amount, since=since, until=until, min_block=min_block,
+                                            max_block=max_block, limit=limit)
+        if records:
+            return transactions
+        return [tx.to_json(for_display=for_display) for tx in transactions]
+
+    def export_transactions(self, filename, fmt=None, from_block=None, address=None):
+        """
+        Writes the history of an address to a file, oldest first, see export.py.
+        Without from_block, a previous export to the same file is continued with the new blocks.
+        Returns a dict with the file, format, rows written now, total rows and last exported block.
+
+        :param fmt: 'csv', 'jsonl' or 'parquet', default from the file extension
+        """
+        address = address if address else self.address
+        export = HistoryExport(filename, address, fmt=fmt, log=self.log)
+        after = export.resume(from_block)
+        self.sync_history(address)
+        written = export.write(self._history.iter_rows(address, after=after))
+        return {"file": filename, "format": export.format, "rows": written, "total": export.state["rows"],
+                "block_height": export.state["block_height"]}
+
+    def ledger(self, address=None, sync=True):
+        """
+        Returns the analytics.Ledger of an address. Kept in memory, later calls only load the new blocks.
+
+        :param sync: bool, fetch the new transactions first
+        """
+        address = address if address else self.address
+        if sync:
+            self.sync_history(address)
+        with self._lock:
+            ledger = self._ledgers.get(address)
+            if ledger is None:
+                ledger = self._ledgers[address] = Ledger(address)
+            ledger.extend(self._history.ledger(address, after=ledger.last_block))
+        return ledger
+
+    def report(self, period="month", top=10, address=None, sync=True):
+        """
+        Returns totals, flows per period with the balance at the end of each, and the top counterparties.
+        Amounts are strings with 8 decimals.
+
+        :param period: 'day', 'month' or 'year'
+        :param top: int, number of counterparties
+        """
+        ledger = self.ledger(address, sync=sync)
+        totals = {key: value if key == "transactions" else to_amount(value) for key, value in ledger.totals().items()}
+        flows = [{"period": key, "received": to_amount(received), "sent": to_amount(sent), "fees": to_amount(fees),
+                  "balance": to_amount(balance)} for key, received, sent, fees, balance in ledger.flows(period)]
+        counterparties = [{"address": counterparty, "received": to_amount(received), "sent": to_amount(sent),
+                           "count": count} for counterparty, received, sent, count in ledger.by_counterparty(top)]
+        return {"address": ledger.address, "totals": totals, "flows": flows, "counterparties": counterparties}
+
+    def find_offset(self, block_height, address=None):
+        """
+        Returns the offset of the newest transaction at or below block_height, for iter_transactions().
+        Exponential then binary search, one single transaction request per step.
+        """
+        address = address if address else self.address
+
+        def height(offset):
+            transactions = self._transactions(address, 1, offset)
+            return int(transactions[0].block_height) if transactions else None
+
+        # Find an offset past the block (or the end), doubling each time
+        low, high = 0, 1
+        while True:
+            current = height(high - 1)
+            if current is None or current <= block_height:
+                break
+            low, high = high, high * 2
+        # First offset in [low, high) whose height is at or below the block
+        high -= 1
+        while low < high:
+            middle = (low + high) // 2
+            current = height(middle)
+            if current is None or current <= block_height:
+                high = middle
             else:
-                transactions = self.command("addlistlimfrom", [self.address, num, offset])
+                low = middle + 1
+        return low
+
+    def _transactions(self, address, num, offset):
+        """Returns the Transaction records of a page, from cache or server"""
+        # Records are cached, formatting depends on the caller
+        key = self._page_key(address, num, offset)
+        cached = self._get_cached(key)
+        if cached is not None:
+            return cached
+        try:
+            transactions = self._fetch_transactions(address, num, offset)
         except Exception as e:
             self.log.error(e)
-            transactions = []
+            return []
+        self._set_cache(key, transactions)
+        return transactions
 
-        json_data = [TxFormatter(tx).to_json(for_display=for_display) for tx in transactions]
-        self._set_cache(key, json_data)
-        return json_data
+    @staticmethod
+    def _page_key(address, num, offset):
+        return "tx{}-{}-{}".format(address, num, int(offset))
+
+    def _fetch_transactions(self, address, num, offset):
+        if int(offset) == 0:
+            rows = self.command("addlistlim", [address, num])
+        else:
+            rows = self.command("addlistlimfrom", [address, num, offset])
+        return [Transaction.from_row(row) for row in rows]
 
     def balance(self, for_display=False):
         """
@@ -233,12 +674,13 @@ class Client:
         """
         if not self.address or not self._wallet:
             return 'N/A'
+        address = self.address
         try:
-            balance = self._get_cached('balance')
+            # Per address: a prefetch may still answer for the previous one
+            balance = self._get_cached('balance' + address)
             if not balance:
-                balance = self.command("balanceget", [self.address])[0]
-                self._set_cache('balance', balance)
-                balance = self._get_cached('balance')
+                balance = self.command("balanceget", [address])[0]
+                self._set_cache('balance' + address, balance)
         except Exception as e:
             self.log.error(e)
             return 'N/A'
@@ -252,7 +694,7 @@ class Client:
         """
         Returns the current global balance for all addresses of current multiwallet.
         """
-        if not type(self._wallet) == MultiWallet:
+        if not isinstance(self._wallet, (MultiWallet, AgentWallet)):
             raise RuntimeWarning("Not a Multiwallet")
         if not self.address or not self._wallet:
             return 'N/A'
@@ -282,21 +724,21 @@ class Client:
         try:
             timestamp = time()
             if self.time_drift > 0:
-                # we are more advanced than server, fix and add 0.1 sec safety
-                timestamp -= (self.time_drift + 0.1)
+                # we are more advanced than server, fix and add 0.1 sec safety plus the error of the estimate
+                timestamp -= (self.time_drift + 0.1 + self._clock.error)
                 # This is to avoid "rejected transaction because in the future
-            public_key_hashed = base64.b64encode(self._wallet.public_key.encode('utf-8'))
-            signature_enc = bismuthcrypto.sign_with_key(
-                timestamp,
-                self.address,
-                recipient,
-                amount,
-                operation,
-                data,
-                self._wallet.key)
-            txid = signature_enc[:56]
-            tx_submit = ('%.2f' % timestamp, self.address, recipient, '%.8f' % float(amount),
-                          str(signature_enc), str(public_key_hashed.decode("utf-8")), operation, data)
+            # Another thread must not switch address between signing and building the tx
+            with self._lock:
+                public_key_hashed = base64.b64encode(self._wallet.public_key.encode('utf-8'))
+                signature_enc = self._wallet.sign_transaction(
+                    timestamp,
+                    recipient,
+                    amount,
+                    operation,
+                    data)
+                txid = signature_enc[:56]
+                tx_submit = ('%.2f' % timestamp, self.address, recipient, '%.8f' % float(amount),
+                              str(signature_enc), str(public_key_hashed.decode("utf-8")), operation, data)
             reply = self.command('mpinsert', [tx_submit])
             if self.verbose:
                 print("Server replied '{}'".format(reply))
@@ -322,7 +764,7 @@ class Client:
         Signs the given message
         """
         try:
-            signature = bismuthcrypto.sign_message_with_key(message, self._wallet.key)
+            signature = self._wallet.sign_message(message)
             return signature
         except Exception as e:
             self.log.error(e)
@@ -347,7 +789,7 @@ class Client:
         Decrypts the given message
         """
         try:
-            decrypted = bismuthcrypto.decrypt_message_with_key(message, self._wallet.key)
+            decrypted = self._wallet.decrypt_message(message)
             return decrypted
         except Exception as e:
             self.log.error(e)
@@ -361,7 +803,7 @@ class Client:
             cached = self._get_cached('status')
             if cached:
                 return cached
-            status = self.command("statusjson")
+            status = self._statusjson()
             # print("getstatus", status)
             try:
                 status['uptime_human'] = str(timedelta(seconds=status['uptime']))
@@ -374,10 +816,6 @@ class Client:
                 self.log.error(e)
                 status['extended'] = None
 
-            if 'server_timestamp' in status:
-                self.time_drift = time() - float(status['server_timestamp'])
-            else:
-                self.time_drift = 0
             status['time_drift'] = self.time_drift
 
             self._set_cache('status', status)
@@ -386,22 +824,110 @@ class Client:
             status = {}
         return status
 
+    def height(self):
+        """
+        Returns the block height of the wallet server, uncached, with a single statusjson request
+        """
+        return self._statusjson()['blocks']
+
+    def _statusjson(self):
+        """
+        statusjson of the current server. The reply is timed: its server timestamp updates time_drift.
+        Concurrent calls for the same server share one request, never hedged: the reply has to come
+        from the server the request was sent to.
+        """
+        self._ensure_server()
+        with self._server_lock:
+            server, connection = self._current_server, self._connection
+
+        def request():
+            # Only the thread sending the request adds a clock sample
+            sent = time()
+            status = self._direct(server, connection, "statusjson", None)
+            received = time()
+            if 'server_timestamp' in status:
+                self._clock.sample(sent, float(status['server_timestamp']), received)
+                self.time_drift = self._clock.drift
+            if 'blocks' in status:
+                self._health.height(server, status['blocks'])
+            return status
+
+        # A copy each, status() adds to it
+        return dict(self._single_flight(json.dumps(["statusjson", server]), "statusjson", request))
+
+    def sync_clock(self, samples=1):
+        """
+        Measures the clock offset to the server and returns the estimate
+
+        :param samples: int, statusjson requests, the shortest round trip gives the best sample
+        """
+        for _ in range(samples):
+            self._statusjson()
+        return self._clock.to_dict()
+
+    def set_clock_sync(self, interval=300):
+        """
+        Keeps time_drift fresh for send(): the clock is measured on every connect and server switch,
+        then every interval seconds in a background thread. Sending never waits for a measurement.
+
+        :param interval: float, seconds between measurements. None = only measured by status() and height()
+        """
+        start = interval and not self._clock_interval
+        self._clock_interval = interval
+        self._clock_wake.set()
+        if start:
+            threading.Thread(target=self._sync_clock_in_background, name="clock", daemon=True).start()
+
+    def _sync_clock_in_background(self):
+        failures = 0
+        while True:
+            # set_clock_sync(None) stops the thread
+            interval = self._clock_interval
+            if not interval:
+                return
+            self._clock_wake.clear()
+            age = self._clock.age()
+            if self._current_server and (age is None or age >= interval):
+                try:
+                    # Several samples after a connect, one is enough to follow the drift
+                    self.sync_clock(samples=3 if age is None else 1)
+                    failures = 0
+                except Exception as e:
+                    failures += 1
+                    if failures == 1:
+                        self.log.warning(f"Clock sync failed: {e}")
+                    else:
+                        self.log.debug(f"Clock sync failed {failures} times: {e}")
+            age = self._clock.age()
+            if not self._current_server:
+                # Connecting wakes the thread
+                wait = interval
+            elif failures:
+                # No retry storm against a server that is down, a server switch still wakes at once
+                wait = min(interval, self.CLOCK_RETRY * 2 ** (failures - 1))
+            else:
+                wait = interval - age if age is not None else interval
+            self._clock_wake.wait(max(wait, 0))
+
     def load_multi_wallet(self, wallet_file='wallet.json', password=None):
         """
         Tries to load the wallet file
 
         :param wallet_file: string, a wallet.json file
-        :param password: string, password to decrypt wallet
+        :param password: string, password to decrypt wallet. Not needed if an agent holds the wallet
         """
         # TODO: Refactor
         self.wallet_file = None
         self.address = None
         self._wallet = None
-        self._wallet = MultiWallet(
-            wallet_file,
-            password=password,
-            verbose=self.verbose,
-            log=self.log)
+        if self._agent:
+            self._wallet = AgentWallet(self._agent)
+        else:
+            self._wallet = MultiWallet(
+                wallet_file,
+                password=password,
+                verbose=self.verbose,
+                log=self.log)
 
         if len(self._wallet.addresses) == 0:
             # Create a first address by default
@@ -414,12 +940,16 @@ class Client:
         self.set_address(self.address)
 
     def set_address(self, address: str = ''):
-        if not type(self._wallet) == MultiWallet:
+        if not isinstance(self._wallet, (MultiWallet, AgentWallet)):
             raise RuntimeWarning("Not a MultiWallet")
-        self._wallet.set_address(address)
-        if self.address != self._wallet.address:
-            self.clear_cache()
-        self.address = self._wallet.address
+        with self._lock:
+            self._wallet.set_address(address)
+            changed = self.address != self._wallet.address
+            if changed:
+                self.clear_cache()
+            self.address = self._wallet.address
+        if changed:
+            self.prefetch()
 
     def new_address(self, label, password, salt):
         try:
@@ -459,6 +989,36 @@ class Client:
         """
         return self._wallet.info()
 
+    def metrics(self):
+        """
+        returns RPC latency, error and byte counts per command and server, and the cache hit ratio
+        """
+        return self._metrics.snapshot()
+
+    def metrics_reset(self):
+        self._metrics.reset()
+
+    def write_metrics(self, filename):
+        """
+        writes the metrics in OpenMetrics format, e.g. for the node exporter textfile collector
+        """
+        self._metrics.write_textfile(filename)
+
+    def close(self):
+        """
+        closes the connection and the transport, e.g. to finish a recording
+        """
+        self.set_clock_sync(None)
+        if self._connection:
+            self._connection.close()
+        if self._executor:
+            self._executor.shutdown(wait=False)
+            self._requests.shutdown(wait=False)
+        self._pool.close()
+        self._health.save()
+        self._history.close()
+        self._transport.close()
+
     def info(self):
         """
         returns a dict with server info: ip, port, latest server status
@@ -468,9 +1028,90 @@ class Client:
             connected = bool(self._connection.sdef)
         info = {"wallet": self.wallet_file, "address": self.address, "server": self._current_server,
                 "servers_list": self.servers, "full_servers_list": self.full_servers,
-                "connected": connected}
+                "connected": connected, "clock": self._clock.to_dict()}
         return info
 
+    def set_hedging(self, percentile=95, budget=0.05):
+        """
+        Hedges read-only commands: if the current server takes longer than the given latency percentile,
+        the command is also sent to the next best server and the first reply is used.
+
+        :param percentile: float, latency percentile of each command, None = no hedging
+        :param budget: float, max share of extra requests
+        """
+        if percentile is None:
+            self._hedge = None
+            return
+        self._hedge = HedgePolicy(percentile=percentile, budget=budget)
+        self._init_executor()
+
+    def set_quorum(self, size=3, agree=None):
+        """
+        Sends balance and transaction reads to several servers at once and returns the answer
+        most of them agree on. Servers that disagree are flagged in the server health data.
+
+        :param size: int, number of servers to ask, None = no quorum reads
+        :param agree: int, identical answers needed, default is a majority of size
+        """
+        if size is None:
+            self._quorum = None
+            return
+        self._quorum = QuorumPolicy(size=size, agree=agree)
+        self._init_executor()
+
+    def set_prefetch(self, page=10):
+        """
+        Warms the caches in the background once connected and after each address switch: balance, status,
+        the first transaction page, also used by iter_transactions(), and the aliases in it. Each page of
+        latest_transactions() also fetches the next one.
+
+        :param page: int, transactions per page, as asked by the caller. 0 = no prefetch
+        """
+        self._prefetch_page = page
+        if page:
+            self._init_executor()
+
+    def prefetch(self):
+        """
+        Loads balance, status, the first transaction page and its aliases into the caches in the background.
+        Returns the futures of the tasks, done when the caches are warm.
+        """
+        if not self._prefetch_page or not self.address or not self._current_server:
+            return []
+        tasks = [self._prefetch(self.balance), self._prefetch(self.status),
+                 self._prefetch(self._prefetch_first_page, self.address)]
+        return [task for task in tasks if task]
+
+    def _prefetch_first_page(self, address):
+        transactions = self._transactions(address, self._prefetch_page, 0)
+        addresses = {tx.address for tx in transactions} | {tx.recipient for tx in transactions}
+        if addresses:
+            self.get_aliases(list(addresses))
+
+    def _prefetch(self, func, *args):
+        def run():
+            try:
+                func(*args)
+            except Exception as e:
+                self.log.debug(f"Prefetch failed: {e}")
+
+        try:
+            return self._executor.submit(run)
+        except RuntimeError:
+            # Executor shut down, client is closing
+            return None
+
+    def _init_executor(self):
+        """
+        Threads for prefetching and concurrent fetches, and threads for the requests of hedging and quorum reads.
+        Tasks of the first pool call command(), which waits on the second: waiting on a task of the own pool
+        could leave every worker blocked. Tasks of the second only talk to a server.
+        """
+        with self._lock:
+            if not self._executor:
+                self._executor = _Executor(max_workers=8, thread_name_prefix="client")
+                self._requests = _Executor(max_workers=16, thread_name_prefix="request")
+
     def command(self, command, options=None):
         """
         Makes sure we have a connection, runs a command and sends back the result.
@@ -478,10 +1119,177 @@ class Client:
         :param command: the command as a string
         :param options: optional options to the command, as a list if needed
         :return: the result as a native structure
+
+        Safe to call from several threads. Identical reads in flight are sent once and
+        every caller gets the same reply.
         """
+        self._ensure_server()
+        if self.verbose:
+            print("command {}, {}".format(command, options))
+        if command not in READ_COMMANDS:
+            return self._dispatch(command, options)
+
+        return self._single_flight(json.dumps([command, options]), command,
+                                   lambda: self._dispatch(command, options))
+
+    def _single_flight(self, key, command, run):
+        """Calls run() once for all threads asking for the same key at the same time, each gets its result"""
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = futures.Future()
+        if not leader:
+            self._metrics.coalesced(command)
+            return flight.result()
+
+        try:
+            result = run()
+            flight.set_result(result)
+            return result
+        except Exception as e:
+            flight.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    def _ensure_server(self):
         if not self._current_server:
             # TODO: failsafe if can't connect
-            self.get_server()
+            with self._server_lock:
+                if not self._current_server:
+                    self.get_server()
+
+    def _dispatch(self, command, options):
+        with self._server_lock:
+            server, connection = self._current_server, self._connection
+        if self._quorum and self._quorum.applies(command):
+            return self._quorum_read(server, connection, command, options)
+        if self._hedge and self._hedge.applies(command):
+            return self._hedged(server, connection, command, options)
+        return self._direct(server, connection, command, options)
+
+    def _direct(self, server, connection, command, options):
+        lock = getattr(connection, 'command_lock', None)
+        if lock and lock.locked():
+            # Another thread uses the main connection, don't queue behind it
+            return self._pooled(server, command, options)
+        return self._timed(connection.command, server, command, options)
+
+    def _pooled(self, server, command, options):
+        return self._timed(lambda c, o: self._pool.command(server, c, o), server, command, options)
+
+    def _hedged(self, server, connection, command, options):
+        self._hedge.earn()
+        delay = self._metrics.percentile(command, server, self._hedge.percentile, self._hedge.min_samples)
+        if delay is None:
+            # Not enough samples yet to know what slow is
+            return self._direct(server, connection, command, options)
+
+        # Pooled connections: the loser must not hold up the next command
+        primary = self._requests.submit(self._pooled, server, command, options)
+        try:
+            return primary.result(timeout=delay)
+        except futures.TimeoutError:
+            pass
+
+        backup_server = next((s for s in self._health.order(self.servers, self._random) if s != server), None)
+        if not backup_server or not self._hedge.spend():
+            return primary.result()
         if self.verbose:
-            print("command {}, {}".format(command, options))
-        return self._connection.command(command, options)
+            print("hedge {} to {}".format(command, backup_server))
+        backup = self._requests.submit(self._pooled, backup_server, command, options)
+
+        pending = {primary, backup}
+        while pending:
+            done, pending = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                # Connection returns '' on timeout
+                if not future.exception() and future.result() != "":
+                    self._metrics.hedge(command, won=future is backup)
+                    return future.result()
+        self._metrics.hedge(command)
+        return primary.result()
+
+    def _quorum_read(self, server, connection, command, options):
+        servers = [server] + [s for s in self._health.order(self.servers, self._random) if s != server]
+        servers = servers[:self._quorum.size]
+        if len(servers) < self._quorum.agree:
+            # Not enough servers for a quorum
+            return self._direct(server, connection, command, options)
+
+        # Heights of the last round: a majority is only taken early if no server still asked may be further ahead
+        known = self._health.heights(servers)
+        pending = {self._requests.submit(self._quorum_answer, s, command, options): s for s in servers}
+        answers, heights = {}, {}
+        result = None
+        while pending and result is None:
+            done, _ = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                source = pending.pop(future)
+                # Connection returns '' on timeout
+                if not future.exception() and future.result()[1] != "":
+                    heights[source], answers[source] = future.result()
+            result = self._quorum.majority(answers, heights, {s: known[s] for s in pending.values()})
+
+        if result is None:
+            if not answers:
+                raise RuntimeError(f"Quorum: no server answered '{command}'")
+            # No majority, trust the servers furthest ahead
+            result = self._quorum.highest(answers, heights)
+            self.log.warning(f"Quorum: no agreement on '{command}', using highest server")
+
+        for source in self._quorum.diverged(answers, heights, result):
+            self._health.diverged(source)
+
+        def late(future, source):
+            # Answers after the quorum was reached are still checked
+            if future.exception() or future.result()[1] == "":
+                return
+            height, answer = future.result()
+            if source in self._quorum.diverged({**answers, source: answer}, {**heights, source: height}, result):
+                self._health.diverged(source)
+
+        for future, source in pending.items():
+            future.add_done_callback(lambda f, s=source: late(f, s))
+        return result
+
+    def _quorum_answer(self, server, command, options):
+        """
+        Returns (height, answer) of a server, read in the same round: answers are only compared at the same height.
+        The height is None if the server couldn't tell it, the answer then doesn't vote.
+        """
+        try:
+            height = int(self._pooled(server, "blocklast", None)[0])
+            self._health.height(server, height)
+        except Exception as e:
+            self.log.warning(f"Quorum: no height from {server}: {e}")
+            height = None
+        return height, self._pooled(server, command, options)
+
+    def _timed(self, run, server, command, options):
+        """Runs run(command, options) and records its latency, size and outcome for the server"""
+        # Size of the JSON messages plus their 10 byte header
+        sent = sum(len(json.dumps(data)) + 10 for data in [command] + list(options or []))
+        # Forget the size of an earlier reply
+        received_bytes()
+        start = perf_counter()
+        try:
+            result = run(command, options)
+        except Exception as e:
+            self._metrics.observe(command, server, perf_counter() - start, sent=sent, error=True)
+            self._health.failure(server, e)
+            raise
+        elapsed = perf_counter() - start
+        # Size of the frame the connection read, replayed and custom transports have none
+        received = received_bytes()
+        if received is None:
+            received = len(json.dumps(result)) + 10 if result != "" else 0
+        # Connection returns '' on timeout
+        self._metrics.observe(command, server, elapsed, sent=sent, received=received, error=result == "")
+        if result == "":
+            self._health.failure(server, "Timeout")
+        else:
+            self._health.success(server, elapsed)
+        return result
@@ -0,0 +1,75 @@
+import threading
+
+from collections import deque
+from time import monotonic
+
+
+"""
+Clock offset to the wallet server, estimated like NTP from timed statusjson requests: the server timestamp
+is assumed to be taken halfway through the round trip. Of the last samples the one with the shortest
+round trip has the least error, its offset is smoothed into the estimate.
+"""
+
+
+class ClockSync:
+
+    __slots__ = ('window', 'alpha', 'resolution', 'offset', 'rtt', 'updated', '_samples', '_lock')
+
+    def __init__(self, window=8, alpha=0.3, resolution=0.01):
+        """
+        :param window: int, samples to pick the shortest round trip from
+        :param alpha: float, weight of a new sample in the smoothed offset
+        :param resolution: float, seconds, precision of the server timestamp
+        """
+        self.window = window
+        self.alpha = alpha
+        self.resolution = resolution
+        # Server time minus local time, None before the first sample
+        self.offset = None
+        self.rtt = None
+        self.updated = None
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def sample(self, sent, server_time, received):
+        """
+        Adds a measurement, returns the new offset
+
+        :param sent: float, local time the request was sent
+        :param server_time: float, timestamp in the reply
+        :param received: float, local time the reply came
+        """
+        rtt = max(received - sent, 0.0)
+        with self._lock:
+            self._samples.append((rtt, server_time - (sent + received) / 2))
+            rtt, offset = min(self._samples)
+            self.offset = offset if self.offset is None else self.offset + self.alpha * (offset - self.offset)
+            self.rtt = rtt
+            self.updated = monotonic()
+            return self.offset
+
+    def reset(self):
+        """Forgets the samples and the estimate, e.g. on a server switch: the next sample is taken as it is"""
+        with self._lock:
+            self._samples.clear()
+            self.offset = None
+            self.rtt = None
+            self.updated = None
+
+    @property
+    def drift(self):
+        """Local time minus server time, like Client.time_drift"""
+        return -self.offset if self.offset is not None else 0
+
+    @property
+    def error(self):
+        """Max error of the estimate in seconds: half the round trip plus the timestamp precision"""
+        return self.rtt / 2 + self.resolution if self.rtt is not None else 0
+
+    def age(self):
+        """Seconds since the last sample, None without one"""
+        return monotonic() - self.updated if self.updated is not None else None
+
+    def to_dict(self):
+        return {"drift": self.drift, "rtt": self.rtt, "error": self.error, "samples": len(self._samples),
+                "age": self.age()}
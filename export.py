@@ -0,0 +1,182 @@
+import os
+import csv
+import json
+import logging
+
+from history import COLUMNS
+
+
+"""
+Transaction export to CSV, JSON lines or Parquet, oldest first, in constant memory.
+A sidecar state file remembers the last exported block: an interrupted export resumes
+where it stopped and later runs only append the new blocks.
+"""
+
+
+FORMATS = ('csv', 'jsonl', 'parquet')
+
+
+def _pyarrow():
+    """Returns pyarrow and pyarrow.parquet, only needed for Parquet"""
+    try:
+        import pyarrow
+        import pyarrow.parquet as parquet
+    except ImportError:
+        raise RuntimeError("Parquet export needs pyarrow: pip install pyarrow")
+    return pyarrow, parquet
+
+
+def parse_options(tokens):
+    """Returns filename, format, from_block from ['<file>', '--format', <fmt>, '--from-block', <height>]"""
+    if not tokens or tokens[0].startswith("--"):
+        raise ValueError("No export file")
+    options = {"--format": None, "--from-block": None}
+    rest = tokens[1:]
+    while rest:
+        if len(rest) < 2 or rest[0] not in options:
+            raise ValueError(f"Unknown option '{rest[0]}'")
+        options[rest[0]] = rest[1]
+        rest = rest[2:]
+    fmt, from_block = options["--format"], options["--from-block"]
+    if fmt is not None and fmt not in FORMATS:
+        raise ValueError(f"Unknown export format '{fmt}', use one of {', '.join(FORMATS)}")
+    if from_block is not None and not from_block.isnumeric():
+        raise ValueError("--from-block needs a block height")
+    return tokens[0], fmt, int(from_block) if from_block is not None else None
+
+
+class HistoryExport:
+
+    __slots__ = ('filename', 'format', 'address', 'log', 'checkpoint', 'row_group', 'state_file', 'state')
+
+    def __init__(self, filename, address, fmt=None, log=None, checkpoint=10000, row_group=20000):
+        """
+        :param filename: string, file to write
+        :param address: string, the address whose transactions are exported
+        :param fmt: 'csv', 'jsonl' or 'parquet'. Default: from the file extension, else csv
+        :param checkpoint: int, CSV and JSON lines: save the state after about that many rows
+        :param row_group: int, Parquet: rows per row group, held in memory while written (~1 KB per row)
+        """
+        extension = os.path.splitext(filename)[1].lstrip('.').lower()
+        self.format = fmt if fmt else extension if extension in FORMATS else 'csv'
+        if self.format not in FORMATS:
+            raise RuntimeError(f"Unknown export format '{self.format}', use one of {', '.join(FORMATS)}")
+        if self.format == 'parquet':
+            # Fail before fetching anything
+            _pyarrow()
+        self.filename = filename
+        self.address = address
+        self.log = log if log else logging
+        self.checkpoint = checkpoint
+        self.row_group = row_group
+        self.state_file = f"{filename}.state"
+        self.state = None
+
+    def resume(self, from_block=None):
+        """
+        Returns the height to export after, None for the whole history.
+        With from_block a new export is started, otherwise a previous one of the same file continues.
+        """
+        self.state = {"address": self.address, "format": self.format, "block_height": None, "size": 0, "rows": 0}
+        if from_block is not None:
+            self.state["block_height"] = from_block - 1
+            return self.state["block_height"]
+        if not os.path.isfile(self.state_file):
+            return None
+        with open(self.state_file) as f:
+            state = json.load(f)
+        if state["address"] != self.address or state["format"] != self.format:
+            raise RuntimeError(f"'{self.filename}' is an export of {state['address']} as {state['format']}, "
+                               f"use another file or --from-block to start over")
+        if not os.path.isfile(self.filename):
+            # Export deleted, start over
+            return None
+        self.state = state
+        return state["block_height"]
+
+    def _save_state(self):
+        tmp = f"{self.state_file}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(tmp, self.state_file)
+
+    def write(self, rows):
+        """Writes Transaction records, oldest first, and returns how many were written. Call resume() first"""
+        if self.format == 'parquet':
+            return self._write_parquet(rows)
+        return self._write_text(rows)
+
+    def _write_text(self, rows):
+        mode = 'r+' if self.state["size"] and os.path.isfile(self.filename) else 'w'
+        written = 0
+        with open(self.filename, mode, newline='', encoding='utf-8') as f:
+            # Drops the rows written after the last saved state by an interrupted run
+            f.seek(self.state["size"])
+            f.truncate()
+            writer = csv.writer(f) if self.format == 'csv' else None
+            if writer and not self.state["size"]:
+                writer.writerow(COLUMNS)
+
+            current = None
+            since_checkpoint = 0
+            for tx in rows:
+                if tx.block_height != current:
+                    # State is only saved between blocks, a block is never half exported
+                    if since_checkpoint >= self.checkpoint:
+                        self._checkpoint(f, current, since_checkpoint)
+                        since_checkpoint = 0
+                    current = tx.block_height
+                if writer:
+                    writer.writerow(tx)
+                else:
+                    f.write(json.dumps(dict(zip(COLUMNS, tx))) + "\n")
+                written += 1
+                since_checkpoint += 1
+            if current is not None:
+                self._checkpoint(f, current, since_checkpoint)
+            elif not self.state["size"]:
+                # Header only, nothing to resume from
+                self._checkpoint(f, self.state["block_height"], 0)
+        return written
+
+    def _checkpoint(self, f, block_height, rows):
+        f.flush()
+        os.fsync(f.fileno())
+        self.state.update(block_height=block_height, size=f.tell(), rows=self.state["rows"] + rows)
+        self._save_state()
+
+    def _write_parquet(self, rows):
+        pyarrow, parquet = _pyarrow()
+        schema = pyarrow.schema([(column, pyarrow.int64() if column == 'block_height' else
+                                  pyarrow.float64() if column == 'timestamp' else pyarrow.string())
+                                 for column in COLUMNS])
+        # Parquet can't be appended to: the previous row groups are copied one by one into a new file
+        tmp = f"{self.filename}.tmp"
+        written = 0
+        current = self.state["block_height"]
+        with parquet.ParquetWriter(tmp, schema) as writer:
+            if self.state["rows"] and os.path.isfile(self.filename):
+                previous = parquet.ParquetFile(self.filename)
+                for i in range(previous.num_row_groups):
+                    writer.write_table(previous.read_row_group(i))
+
+            def write_group(columns):
+                writer.write_table(pyarrow.Table.from_arrays(
+                    [pyarrow.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema))
+
+            columns = [[] for _ in COLUMNS]
+            for tx in rows:
+                for column, value in zip(columns, tx):
+                    column.append(value)
+                written += 1
+                current = tx.block_height
+                if len(columns[0]) >= self.row_group:
+                    write_group(columns)
+                    columns = [[] for _ in COLUMNS]
+            if columns[0]:
+                write_group(columns)
+        # An interrupted run leaves the previous file and state untouched
+        os.replace(tmp, self.filename)
+        self.state.update(block_height=current, size=os.path.getsize(self.filename), rows=self.state["rows"] + written)
+        self._save_state()
+        return written
@@ -0,0 +1,197 @@
+import os
+import json
+import math
+import logging
+import threading
+
+from time import time
+
+
+"""
+Wallet server health: last seen latency, height, load and failure history, persisted between runs.
+"""
+
+
+DEFAULT_FILE = os.environ.get("TANSANIT_SERVERS_CACHE", os.path.join(os.path.expanduser("~"), ".tansanit", "servers.json"))
+
+
+def to_ipport(server):
+    """Returns 'ip:port' for a server dict"""
+    return f"{server['ip']}:{server['port']}"
+
+
+class ServerHealth:
+
+    __slots__ = ('filename', 'log', 'last_good', '_servers', '_lock')
+
+    # Weight of the latest sample in the moving averages
+    ALPHA = 0.2
+    # Assumed round trip in seconds of servers we never talked to
+    DEFAULT_RTT = 0.25
+    # Added to every round trip so that sub-millisecond servers don't take all the weight
+    RTT_FLOOR = 0.01
+    # Servers more blocks behind the highest known height are only used if nothing else is left
+    MAX_LAG = 10
+
+    def __init__(self, filename=None, log=None):
+        """
+        :param filename: string, JSON file to persist to. None = memory only
+        """
+        self.filename = filename
+        self.log = log if log else logging
+        self.last_good = None
+        self._servers = {}
+        self._lock = threading.Lock()
+        if filename:
+            self.load()
+
+    def load(self):
+        if not os.path.isfile(self.filename):
+            return
+        try:
+            with open(self.filename) as f:
+                data = json.load(f)
+            self._servers = data["servers"]
+            self.last_good = data["last_good"]
+        except Exception as e:
+            self.log.warning(f"Ignoring server cache '{self.filename}': {e}")
+
+    def save(self):
+        """Writes the cache atomically, several instances may share it"""
+        if not self.filename:
+            return
+        with self._lock:
+            data = json.dumps({"last_good": self.last_good, "servers": self._servers}, indent=2)
+        os.makedirs(os.path.dirname(os.path.abspath(self.filename)), exist_ok=True)
+        tmp = f"{self.filename}.{os.getpid()}.tmp"
+        with open(tmp, 'w') as f:
+            f.write(data)
+        os.replace(tmp, self.filename)
+
+    def _entry(self, server):
+        if server not in self._servers:
+            ip, port = server.split(':')
+            self._servers[server] = {"ip": ip, "port": port, "load": 'N/A', "height": 'N/A', "rtt": None,
+                                     "connect_rtt": None, "error_rate": 0.0, "failures": 0, "last_seen": 0,
+                                     "last_error": None, "divergences": 0, "last_divergence": None}
+        return self._servers[server]
+
+    def merge(self, servers):
+        """Updates load and height from a discovery list of dicts, adds new servers"""
+        with self._lock:
+            for server in servers:
+                entry = self._entry(to_ipport(server))
+                entry.update(server)
+
+    def success(self, server, seconds):
+        with self._lock:
+            entry = self._entry(server)
+            entry["rtt"] = seconds if entry["rtt"] is None else (1 - self.ALPHA) * entry["rtt"] + self.ALPHA * seconds
+            entry["error_rate"] *= 1 - self.ALPHA
+            entry["last_seen"] = time()
+            self.last_good = server
+
+    def failure(self, server, error=None):
+        with self._lock:
+            entry = self._entry(server)
+            entry["error_rate"] = (1 - self.ALPHA) * entry["error_rate"] + self.ALPHA
+            entry["failures"] += 1
+            entry["last_error"] = [time(), str(error)] if error else [time(), None]
+            if self.last_good == server:
+                self.last_good = None
+
+    def diverged(self, server):
+        """Flags a server that answered a quorum read differently from the majority"""
+        with self._lock:
+            entry = self._entry(server)
+            # Counts as an error, the server is picked less often
+            entry["error_rate"] = (1 - self.ALPHA) * entry["error_rate"] + self.ALPHA
+            entry["divergences"] = entry.get("divergences", 0) + 1
+            entry["last_divergence"] = time()
+            if self.last_good == server:
+                self.last_good = None
+
+    def height(self, server, height):
+        """Records the block height a server reported"""
+        with self._lock:
+            self._entry(server)["height"] = height
+
+    def heights(self, servers):
+        """Returns {server: height}, None for unknown"""
+        with self._lock:
+            return {server: self._servers[server]["height"] if server in self._servers else None
+                    for server in servers}
+
+    def probe(self, server, seconds):
+        """
+        Records a connect time, doesn't make the server the last good one.
+        Kept apart from the command round trips of success(): a connect is much shorter than a command.
+        """
+        with self._lock:
+            entry = self._entry(server)
+            rtt = entry.get("connect_rtt")
+            entry["connect_rtt"] = seconds if rtt is None else (1 - self.ALPHA) * rtt + self.ALPHA * seconds
+
+    def weights(self, servers, measure="rtt"):
+        """
+        Returns {server: weight} for a list of ip:port, higher is better.
+        The weight falls with round trip time, reported load relative to the busiest server,
+        blocks behind the highest server and recent error rate.
+
+        :param measure: 'rtt' to compare command round trips, 'connect_rtt' to compare connect times
+        """
+        def number(value):
+            try:
+                return float(value)
+            except (TypeError, ValueError):
+                return None
+
+        with self._lock:
+            entries = {server: dict(self._entry(server)) for server in servers}
+
+        heights = [number(entry["height"]) for entry in entries.values()]
+        loads = [number(entry["load"]) for entry in entries.values()]
+        max_height = max([h for h in heights if h is not None], default=None)
+        max_load = max([l for l in loads if l is not None], default=0)
+
+        weights = {}
+        for server, entry in entries.items():
+            rtt = entry.get(measure)
+            rtt = rtt if rtt is not None else self.DEFAULT_RTT
+            load = number(entry["load"])
+            height = number(entry["height"])
+            lag = max_height - height if max_height is not None and height is not None else 0
+            weight = (1 - entry["error_rate"]) ** 2 / (rtt + self.RTT_FLOOR)
+            if load is not None and max_load > 0:
+                weight /= 1 + load / max_load
+            weight /= 1 + lag
+            if lag > self.MAX_LAG:
+                weight *= 1e-6
+            weights[server] = weight
+        return weights
+
+    def order(self, servers, rng, measure="rtt"):
+        """
+        Returns the servers in weighted random order: the better the weight, the more
+        likely a server comes first. Each instance picks differently, spreading load.
+
+        :param rng: random.Random
+        :param measure: round trip to weigh by, see weights()
+        """
+        weights = self.weights(servers, measure)
+        # Efraimidis-Spirakis: sort on u^(1/w), as log to keep tiny weights apart
+        keys = {server: math.log(1 - rng.random()) / weight if weight > 0 else -math.inf
+                for server, weight in weights.items()}
+        return sorted(servers, key=lambda server: keys[server], reverse=True)
+
+    def get(self, server):
+        """Returns a copy of the entry of a server or None"""
+        with self._lock:
+            entry = self._servers.get(server)
+            return dict(entry) if entry else None
+
+    def servers(self):
+        """Returns all known servers as a list of dicts, last good one first"""
+        with self._lock:
+            entries = [dict(entry) for entry in self._servers.values()]
+        return sorted(entries, key=lambda entry: to_ipport(entry) != self.last_good)
@@ -0,0 +1,47 @@
+import threading
+
+from transport import READ_COMMANDS
+
+
+"""
+Hedged requests: a read-only command that gets no reply within a latency percentile is also
+sent to a second server, the first reply wins. A token bucket caps the extra load.
+"""
+
+
+class HedgePolicy:
+
+    __slots__ = ('percentile', 'budget', 'min_samples', 'burst', '_tokens', '_lock')
+
+    # Never mpinsert: a hedged send could be submitted twice
+    COMMANDS = READ_COMMANDS
+
+    def __init__(self, percentile=95, budget=0.05, min_samples=20, burst=10):
+        """
+        :param percentile: float, hedge when the reply takes longer than this latency percentile
+        :param budget: float, max share of extra requests, 0.05 = at most 5% more load
+        :param min_samples: int, don't hedge before that many replies of a command were timed
+        :param burst: int, max hedges that can be saved up and sent in a row
+        """
+        self.percentile = percentile
+        self.budget = budget
+        self.min_samples = min_samples
+        self.burst = burst
+        self._tokens = 0.0
+        self._lock = threading.Lock()
+
+    def applies(self, command):
+        return command in self.COMMANDS
+
+    def earn(self):
+        """Called for every hedgeable request, earns budget tokens"""
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + self.budget)
+
+    def spend(self):
+        """Returns True and takes a token if a hedge is within budget"""
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
@@ -0,0 +1,250 @@
+import os
+import sqlite3
+import logging
+import threading
+
+from decimal import Decimal
+from transaction import Transaction, FIELDS as COLUMNS
+
+
+"""
+Local transaction history: a SQLite copy of the transactions of wallet addresses, indexed for search.
+Filled incrementally from the servers, queried without any network round trip.
+"""
+
+
+# Opt-in: None keeps the history in memory for the session
+DEFAULT_FILE = os.environ.get("TANSANIT_HISTORY")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS owners (
+    id INTEGER PRIMARY KEY,
+    address TEXT NOT NULL UNIQUE,
+    synced INTEGER
+);
+CREATE TABLE IF NOT EXISTS transactions (
+    owner INTEGER NOT NULL,
+    block_height INTEGER NOT NULL,
+    timestamp REAL NOT NULL,
+    address TEXT NOT NULL,
+    recipient TEXT NOT NULL,
+    amount TEXT NOT NULL,
+    signature TEXT NOT NULL,
+    public_key TEXT,
+    block_hash TEXT,
+    fee TEXT,
+    reward TEXT,
+    operation TEXT,
+    openfield TEXT,
+    counterparty TEXT NOT NULL,
+    value REAL NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS transactions_id ON transactions (owner, substr(signature, 1, 56));
+CREATE INDEX IF NOT EXISTS transactions_height ON transactions (owner, block_height);
+CREATE INDEX IF NOT EXISTS transactions_timestamp ON transactions (owner, timestamp);
+CREATE INDEX IF NOT EXISTS transactions_counterparty ON transactions (owner, counterparty, block_height);
+CREATE INDEX IF NOT EXISTS transactions_operation ON transactions (owner, operation, block_height);
+"""
+
+# Trigram tokens match any substring of 3 characters or more
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS transactions_text
+    USING fts5(openfield, content='transactions', content_rowid='rowid', tokenize='trigram');
+CREATE TRIGGER IF NOT EXISTS transactions_text_insert AFTER INSERT ON transactions BEGIN
+    INSERT INTO transactions_text (rowid, openfield) VALUES (new.rowid, new.openfield);
+END;
+CREATE TRIGGER IF NOT EXISTS transactions_text_delete AFTER DELETE ON transactions BEGIN
+    INSERT INTO transactions_text (transactions_text, rowid, openfield) VALUES ('delete', old.rowid, old.openfield);
+END;
+"""
+
+
+def wallet_history_file(wallet_file):
+    """Returns the history file kept next to a wallet file: wallet.json -> wallet.history.sqlite"""
+    return f"{os.path.splitext(os.path.abspath(wallet_file))[0]}.history.sqlite"
+
+
+class HistoryStore:
+    """
+    Rows are keyed by a small owner id instead of the address, which keeps the indexes compact,
+    and deduplicated on the transaction id (first 56 characters of the signature).
+    """
+
+    __slots__ = ('filename', 'log', 'fts', '_db', '_lock', '_owners')
+
+    def __init__(self, filename=None, log=None):
+        """
+        :param filename: string, SQLite file. None = memory only
+        """
+        self.filename = filename if filename else ":memory:"
+        self.log = log if log else logging
+        if filename:
+            os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+        # One connection shared by all threads, serialized by the lock
+        self._db = sqlite3.connect(self.filename, check_same_thread=False)
+        self._lock = threading.Lock()
+        # address: owner id
+        self._owners = {}
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            # WAL stays consistent, a crash loses at most the last sync which is redone
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.executescript(SCHEMA)
+            try:
+                self._db.executescript(FTS_SCHEMA)
+                self.fts = True
+            except sqlite3.OperationalError as e:
+                # SQLite built without fts5 or older than 3.34: text search scans
+                self.log.warning(f"No full text index for history: {e}")
+                self.fts = False
+
+    def _owner(self, address):
+        """Returns the id of an address, call with the lock held"""
+        if address not in self._owners:
+            self._db.execute("INSERT OR IGNORE INTO owners (address) VALUES (?)", (address, ))
+            self._owners[address] = self._db.execute("SELECT id FROM owners WHERE address = ?",
+                                                     (address, )).fetchone()[0]
+        return self._owners[address]
+
+    def synced(self, owner):
+        """Returns the block height up to which the history of owner is complete, None if never synced"""
+        with self._lock:
+            row = self._db.execute("SELECT synced FROM owners WHERE address = ?", (owner, )).fetchone()
+        return row[0] if row else None
+
+    def insert(self, owner, transactions):
+        """Adds Transaction records of owner, known ones are skipped. Returns the number added"""
+        with self._lock, self._db:
+            owner_id = self._owner(owner)
+            values = [(owner_id, int(tx.block_height), float(tx.timestamp), *tuple(tx)[2:],
+                       tx.recipient if tx.address == owner else tx.address, float(tx.amount)) for tx in transactions]
+            # rowcount leaves out the rows written by the full text triggers
+            return self._db.executemany(f"INSERT OR IGNORE INTO transactions (owner, {', '.join(COLUMNS)}, "
+                                        f"counterparty, value) VALUES ({', '.join('?' * (len(COLUMNS) + 3))})",
+                                        values).rowcount
+
+    def set_synced(self, owner, block_height):
+        with self._lock, self._db:
+            self._db.execute("UPDATE owners SET synced = ? WHERE id = ?", (block_height, self._owner(owner)))
+
+    def search(self, owner, direction=None, counterparty=None, operation=None, text=None, min_amount=None,
+               max_amount=None, since=None, until=None, min_block=None, max_block=None, limit=100):
+        """
+        Returns the matching Transaction records of owner, newest first: by timestamp if since or until
+        is given, so that the timestamp index also gives the order, by block otherwise.
+
+        :param direction: 'in' or 'out', None = both
+        :param counterparty: string, the other address
+        :param operation: string, exact operation
+        :param text: string, part of the openfield
+        :param since: float, min timestamp
+        :param until: float, max timestamp, excluded
+        :param limit: int, max rows, None = all
+        """
+        with self._lock:
+            owner_id = self._owners.get(owner)
+            if owner_id is None:
+                row = self._db.execute("SELECT id FROM owners WHERE address = ?", (owner, )).fetchone()
+                if not row:
+                    return []
+                owner_id = self._owners[owner] = row[0]
+
+        where = ["owner = ?"]
+        params = [owner_id]
+
+        def add(condition, *values):
+            where.append(condition)
+            params.extend(values)
+
+        if direction == "out":
+            add("address = ?", owner)
+        elif direction == "in":
+            add("address != ?", owner)
+        if counterparty is not None:
+            add("counterparty = ?", counterparty)
+        if operation is not None:
+            add("operation = ?", operation)
+        if min_amount is not None:
+            add("value >= ?", min_amount)
+        if max_amount is not None:
+            add("value <= ?", max_amount)
+        if since is not None:
+            add("timestamp >= ?", since)
+        if until is not None:
+            add("timestamp < ?", until)
+        if min_block is not None:
+            add("block_height >= ?", min_block)
+        if max_block is not None:
+            add("block_height <= ?", max_block)
+        if text:
+            if self.fts and len(text) >= 3:
+                # Quoted as one phrase: no query syntax, any substring
+                add("rowid IN (SELECT rowid FROM transactions_text WHERE transactions_text MATCH ?)",
+                    '"' + text.replace('"', '""') + '"')
+            else:
+                escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+                add("openfield LIKE ? ESCAPE '\\'", f"%{escaped}%")
+
+        order = "timestamp DESC" if since is not None or until is not None else "block_height DESC, timestamp DESC"
+        query = f"SELECT {', '.join(COLUMNS)} FROM transactions WHERE {' AND '.join(where)} ORDER BY {order}"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            return [Transaction(*row) for row in self._db.execute(query, params)]
+
+    def iter_rows(self, owner, after=None, page=1000):
+        """
+        Yields all Transaction records of owner oldest first, page by page, without holding the lock in between.
+
+        :param after: int, only blocks above this height
+        """
+        with self._lock:
+            found = self._db.execute("SELECT id FROM owners WHERE address = ?", (owner, )).fetchone()
+        if not found:
+            return
+        # Keyset pagination: the index on (owner, block_height) also orders by rowid
+        position = (after if after is not None else -1, 2 ** 62)
+        while True:
+            with self._lock:
+                rows = self._db.execute(f"SELECT {', '.join(COLUMNS)}, rowid FROM transactions "
+                                        f"WHERE owner = ? AND (block_height, rowid) > (?, ?) "
+                                        f"ORDER BY block_height, rowid LIMIT ?", (found[0], *position, page)).fetchall()
+            for row in rows:
+                yield Transaction(*row[:-1])
+            if len(rows) < page:
+                return
+            position = (rows[-1][0], rows[-1][-1])
+
+    def ledger(self, owner, after=None, unit=100000000):
+        """
+        Returns (block_height, timestamp, incoming, outgoing, counterparty, amount, fee, reward) tuples of owner,
+        oldest first, amounts as integers of 1/unit. Read by analytics.py.
+
+        :param after: int, only blocks above this height
+        """
+        with self._lock:
+            row = self._db.execute("SELECT id FROM owners WHERE address = ?", (owner, )).fetchone()
+            if not row:
+                return []
+            rows = self._db.execute(
+                "SELECT block_height, timestamp, recipient = ?1, address = ?1, counterparty, amount, fee, reward "
+                "FROM transactions WHERE owner = ?2 AND block_height > ?3 ORDER BY block_height, rowid",
+                (owner, row[0], after if after is not None else -1)).fetchall()
+
+        def units(text):
+            # Decimal text to integer units without a double in between, which is off by one unit already
+            # for amounts like 88788076.88530173
+            return int(Decimal(text if text else 0) * unit)
+
+        return [(block_height, timestamp, incoming, outgoing, counterparty, units(amount), units(fee), units(reward))
+                for block_height, timestamp, incoming, outgoing, counterparty, amount, fee, reward in rows]
+
+    def count(self, owner):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM transactions JOIN owners ON owner = owners.id "
+                                    "WHERE owners.address = ?", (owner, )).fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,174 @@
+import time
+import logging
+import threading
+
+from tracker import TransactionTracker, CONFIRMED
+
+
+"""
+Watch of the server mempool for incoming payments. Every poll is diffed against the previous snapshot:
+only transactions not seen before are looked at. Incoming ones are reported at once as provisional
+and reported again when their block confirms them, or when they are dropped.
+"""
+
+
+PROVISIONAL = "provisional"
+
+
+class IncomingPayment:
+
+    __slots__ = ('txid', 'sender', 'recipient', 'amount', 'operation', 'openfield', 'timestamp', 'seen', 'status',
+                 'block_height')
+
+    def __init__(self, row):
+        """:param row: a row of mpget"""
+        timestamp, sender, recipient, amount, signature, _, operation, openfield = row[:8]
+        self.txid = signature[:56]
+        self.sender = sender
+        self.recipient = recipient
+        # Checked here, rows come from the server as they are
+        self.amount = "%.8f" % float(amount)
+        self.operation = operation
+        self.openfield = openfield
+        self.timestamp = float(timestamp)
+        self.seen = time.time()
+        self.status = PROVISIONAL
+        self.block_height = None
+
+    @property
+    def confirmed(self):
+        return self.status == CONFIRMED
+
+    def to_dict(self):
+        return {"txid": self.txid, "sender": self.sender, "recipient": self.recipient, "amount": self.amount,
+                "operation": self.operation, "openfield": self.openfield, "timestamp": self.timestamp,
+                "seen": self.seen, "status": self.status, "block_height": self.block_height}
+
+
+class MempoolWatcher:
+
+    __slots__ = ('client', 'log', 'interval', 'watched', 'tracker', '_snapshot', '_payments', '_callbacks',
+                 '_lock', '_thread', '_stop')
+
+    # Payments kept for payments()
+    KEEP = 100
+
+    def __init__(self, client, watch=None, interval=5, confirmations=1, timeout=3600, log=None):
+        """
+        :param client: a Client, payments to all its wallet addresses are reported
+        :param watch: list of watch-only addresses to report payments to as well
+        :param interval: float, seconds between mempool polls
+        :param confirmations: int, blocks to call a payment confirmed
+        :param timeout: float, seconds after which a payment not in a block is given up
+        """
+        self.client = client
+        self.log = log if log else logging
+        self.interval = interval
+        self.watched = set(watch) if watch else set()
+        # Upgrades payments once per new block, in memory only: the mempool is read again after a restart
+        self.tracker = TransactionTracker(client, confirmations=confirmations, timeout=timeout, interval=interval,
+                                          log=self.log)
+        self.tracker.add_callback(self._finished)
+        # txids of the previous poll, None before the first
+        self._snapshot = None
+        self._payments = {}
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def watch(self, address):
+        self.watched.add(address)
+
+    def unwatch(self, address):
+        self.watched.discard(address)
+
+    def addresses(self):
+        """Returns the wallet and the watch-only addresses"""
+        return {a["address"] for a in self.client.addresses()} | self.watched
+
+    def add_callback(self, callback):
+        """callback(payment) is called with the IncomingPayment when seen in the mempool and when finished"""
+        self._callbacks.append(callback)
+
+    def payments(self):
+        """Returns the incoming payments as dicts, newest first"""
+        with self._lock:
+            payments = [payment.to_dict() for payment in self._payments.values()]
+        return payments[::-1]
+
+    def poll(self):
+        """Reads the mempool once and returns the new incoming payments, then checks the seen ones for a new block"""
+        rows = self.client.command("mpget")
+        previous = self._snapshot if self._snapshot is not None else set()
+        snapshot = set()
+        new = []
+        addresses = None
+        for row in rows:
+            txid = row[4][:56]
+            snapshot.add(txid)
+            if txid in previous:
+                continue
+            if addresses is None:
+                # Only read when the mempool changed
+                addresses = self.addresses()
+            if row[2] in addresses and row[2] != row[1]:
+                try:
+                    new.append(IncomingPayment(row))
+                except (ValueError, TypeError) as e:
+                    self.log.warning(f"Ignoring malformed mempool transaction {txid}: {e}")
+        self._snapshot = snapshot
+
+        for payment in new:
+            with self._lock:
+                if payment.txid in self._payments:
+                    # Back in the mempool after a fork
+                    continue
+                self._payments[payment.txid] = payment
+                for txid in list(self._payments)[:-self.KEEP]:
+                    if self._payments[txid].status != PROVISIONAL:
+                        del self._payments[txid]
+            self.tracker.track(payment.txid, address=payment.recipient, recipient=payment.recipient,
+                               amount=payment.amount)
+            self._notify(payment)
+        self.tracker.check(mempool=snapshot)
+        return new
+
+    def _finished(self, tx):
+        with self._lock:
+            payment = self._payments.get(tx.txid)
+        if not payment:
+            return
+        payment.status = tx.status
+        payment.block_height = tx.block_height
+        self._notify(payment)
+
+    def _notify(self, payment):
+        for callback in self._callbacks:
+            try:
+                callback(payment)
+            except Exception as e:
+                self.log.error(f"Mempool callback failed: {e}")
+
+    def start(self):
+        """Polls in a background thread every interval seconds"""
+        if self._thread:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="mempool", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.poll()
+            except Exception as e:
+                self.log.error(f"Mempool poll failed: {e}")
+            if self._stop.wait(self.interval):
+                return
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,189 @@
+import os
+import threading
+
+from time import time
+
+
+"""
+RPC instrumentation: latency histograms, errors and bytes per command and server, cache hit ratio.
+"""
+
+
+class Histogram:
+
+    __slots__ = ('counts', 'sum', 'count', 'min', 'max')
+
+    # Upper bounds in seconds, last bucket is +Inf
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, float("inf"))
+
+    def __init__(self):
+        self.counts = [0] * len(self.BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+        self.min = float("inf")
+        self.max = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def percentile(self, pct):
+        """Estimates a percentile by linear interpolation inside its bucket, within the observed min and max"""
+        if not self.count:
+            return 0.0
+        rank = pct / 100 * self.count
+        seen = 0
+        lower = 0.0
+        for bound, count in zip(self.BUCKETS, self.counts):
+            if seen + count >= rank and count:
+                lower, upper = max(lower, self.min), min(bound, self.max)
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+            lower = bound
+        return self.max
+
+
+class Metrics:
+
+    __slots__ = ('started', '_rpc', '_cache', '_hedges', '_coalesced', '_lock')
+
+    def __init__(self):
+        self.started = time()
+        self._rpc = {}
+        self._cache = {"hits": 0, "misses": 0}
+        self._hedges = {}
+        self._coalesced = {}
+        self._lock = threading.Lock()
+
+    def observe(self, command, server, seconds, sent=0, received=0, error=False):
+        """Records one RPC"""
+        with self._lock:
+            key = (command, server or '')
+            if key not in self._rpc:
+                self._rpc[key] = {"histogram": Histogram(), "errors": 0, "sent": 0, "received": 0}
+            rpc = self._rpc[key]
+            rpc["histogram"].observe(seconds)
+            rpc["sent"] += sent
+            rpc["received"] += received
+            if error:
+                rpc["errors"] += 1
+
+    def percentile(self, command, server, pct, min_count=1):
+        """Returns the latency percentile of a command on a server, None if less than min_count samples"""
+        with self._lock:
+            rpc = self._rpc.get((command, server or ''))
+            if not rpc or rpc["histogram"].count < min_count:
+                return None
+            return rpc["histogram"].percentile(pct)
+
+    def hedge(self, command, won=False):
+        """Records a hedged request and whether it answered first"""
+        with self._lock:
+            hedges = self._hedges.setdefault(command, {"sent": 0, "won": 0})
+            hedges["sent"] += 1
+            if won:
+                hedges["won"] += 1
+
+    def coalesced(self, command):
+        """Records a request answered by an identical one already in flight"""
+        with self._lock:
+            self._coalesced[command] = self._coalesced.get(command, 0) + 1
+
+    def cache_hit(self):
+        with self._lock:
+            self._cache["hits"] += 1
+
+    def cache_miss(self):
+        with self._lock:
+            self._cache["misses"] += 1
+
+    def reset(self):
+        with self._lock:
+            self.started = time()
+            self._rpc = {}
+            self._cache = {"hits": 0, "misses": 0}
+            self._hedges = {}
+            self._coalesced = {}
+
+    def snapshot(self):
+        """
+        Returns a dict with the current values:
+        `{"since", "cache": {"hits", "misses", "ratio"}, "rpc": [{"command", "server", "count", "errors",
+        "sent", "received", "avg", "p50", "p90", "p99"}], "hedges": {command: {"sent", "won"}},
+        "coalesced": {command: count}}`,
+        durations in seconds
+        """
+        with self._lock:
+            rpc = []
+            for (command, server), data in sorted(self._rpc.items()):
+                histogram = data["histogram"]
+                rpc.append({"command": command, "server": server, "count": histogram.count,
+                            "errors": data["errors"], "sent": data["sent"], "received": data["received"],
+                            "avg": histogram.sum / histogram.count if histogram.count else 0,
+                            "p50": histogram.percentile(50), "p90": histogram.percentile(90),
+                            "p99": histogram.percentile(99)})
+            lookups = self._cache["hits"] + self._cache["misses"]
+            cache = dict(self._cache, ratio=self._cache["hits"] / lookups if lookups else 0)
+            hedges = {command: dict(counts) for command, counts in self._hedges.items()}
+            coalesced = dict(self._coalesced)
+        return {"since": self.started, "cache": cache, "rpc": rpc, "hedges": hedges, "coalesced": coalesced}
+
+    def openmetrics(self):
+        """Returns all metrics in OpenMetrics / Prometheus text format"""
+        def labels(command, server, **extra):
+            pairs = dict(command=command, server=server, **extra)
+            return ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+                            for k, v in pairs.items())
+
+        with self._lock:
+            items = sorted(self._rpc.items())
+            lines = ["# HELP tansanit_rpc_duration_seconds RPC latency",
+                     "# TYPE tansanit_rpc_duration_seconds histogram"]
+            for (command, server), data in items:
+                histogram = data["histogram"]
+                cumulative = 0
+                for bound, count in zip(histogram.BUCKETS, histogram.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(float(bound))
+                    lines.append(f"tansanit_rpc_duration_seconds_bucket{{{labels(command, server, le=le)}}} {cumulative}")
+                lines.append(f"tansanit_rpc_duration_seconds_sum{{{labels(command, server)}}} {histogram.sum}")
+                lines.append(f"tansanit_rpc_duration_seconds_count{{{labels(command, server)}}} {histogram.count}")
+
+            # Counters: HELP and TYPE name the family, the samples add _total
+            for name, key, text in (("tansanit_rpc_errors", "errors", "Failed RPCs"),
+                                    ("tansanit_rpc_sent_bytes", "sent", "Bytes sent"),
+                                    ("tansanit_rpc_received_bytes", "received", "Bytes received")):
+                lines += [f"# HELP {name} {text}", f"# TYPE {name} counter"]
+                for (command, server), data in items:
+                    lines.append(f"{name}_total{{{labels(command, server)}}} {data[key]}")
+
+            for name, key in (("tansanit_cache_hits", "hits"), ("tansanit_cache_misses", "misses")):
+                lines += [f"# HELP {name} Client cache {key}", f"# TYPE {name} counter",
+                          f"{name}_total {self._cache[key]}"]
+
+            for name, key, text in (("tansanit_hedges", "sent", "Hedged requests"),
+                                    ("tansanit_hedges_won", "won", "Hedged requests that answered first")):
+                lines += [f"# HELP {name} {text}", f"# TYPE {name} counter"]
+                for command, counts in sorted(self._hedges.items()):
+                    lines.append(f'{name}_total{{command="{command}"}} {counts[key]}')
+
+            lines += ["# HELP tansanit_rpc_coalesced Requests answered by an identical request in flight",
+                      "# TYPE tansanit_rpc_coalesced counter"]
+            for command, count in sorted(self._coalesced.items()):
+                lines.append(f'tansanit_rpc_coalesced_total{{command="{command}"}} {count}')
+
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, filename):
+        """Writes the metrics for the node exporter textfile collector. Atomic, so it never reads half a file"""
+        tmp = f"{filename}.{os.getpid()}.tmp"
+        with open(tmp, 'w') as f:
+            f.write(self.openmetrics())
+        os.replace(tmp, filename)
@@ -281,6 +281,19 @@ class MultiWallet:
 
             self.save()
 
+    def sign_transaction(self, timestamp, recipient, amount, operation: str = '', data: str = ''):
+        """Signs a transaction with the key of the selected address"""
+        return bismuthcrypto.sign_with_key(
+            timestamp, self._address, recipient, amount, operation, data, self.key)
+
+    def sign_message(self, message: str):
+        """Signs a message with the key of the selected address"""
+        return bismuthcrypto.sign_message_with_key(message, self.key)
+
+    def decrypt_message(self, message: str):
+        """Decrypts a message with the key of the selected address"""
+        return bismuthcrypto.decrypt_message_with_key(message, self.key)
+
     def is_address_in_wallet(self, address: str = ''):
         if self._infos['encrypted'] and self._locked:
             # TODO: check could be done via a decorator
@@ -0,0 +1,168 @@
+import os
+import sys
+import pstats
+import threading
+import cProfile
+import tracemalloc
+
+from datetime import datetime
+from time import perf_counter
+
+
+"""
+Profiles REPL commands and Client calls with cProfile and optionally tracemalloc.
+Time spent in wallet crypto and in RPCs is reported separately.
+Up to Python 3.11 cProfile only sees the thread that enables it: tasks of the client thread pools run under
+profilers of their own while a profile records, their stats are added to it. From 3.12 profiling is process
+wide and the profiler of the command sees them already. Other threads are not profiled before 3.12.
+"""
+
+
+PROFILE_DIR = "profiles"
+
+# (module, function) entry points whose cumulative time is attributed to a category
+CATEGORIES = {
+    "Crypto": (("bismuthcrypto", "sign_with_key"),
+               ("bismuthcrypto", "sign_message_with_key"),
+               ("bismuthcrypto", "encrypt_message_with_pubkey"),
+               ("bismuthcrypto", "decrypt_message_with_key"),
+               ("bismuthcrypto", "keys_gen"),
+               ("simplecrypt", "encrypt"),
+               ("simplecrypt", "decrypt")),
+    "RPC": (("rpcconnections", "command"),
+            ("rpcconnections", "__init__"),
+            ("lwbench", "connectible"),
+            ("bismuthapi", "get_wallet_servers_legacy")),
+}
+
+
+class Profile:
+    """
+    Context manager that profiles its block and writes a pstats file.
+    The file can be opened with snakeviz or turned into a flamegraph with flameprof.
+    """
+
+    __slots__ = ('name', 'memory', 'directory', 'top', 'filename', 'stats', 'elapsed',
+                 'allocations', 'tasks', 'merged', '_profiler', '_start', '_finished', '_lock')
+
+    # Profile recording right now, tasks submitted to the client pools run under it, see run()
+    active = None
+
+    def __init__(self, name, memory=False, directory=PROFILE_DIR, top=15):
+        """
+        :param name: string, name of the profiled command, used in the file name
+        :param memory: bool, also track allocations with tracemalloc
+        :param directory: string, where to write the pstats file. None = don't write
+        :param top: int, number of hotspots and allocations to report
+        """
+        self.name = name
+        self.memory = memory
+        self.directory = directory
+        self.top = top
+        self.filename = None
+        self.stats = None
+        self.elapsed = 0
+        self.allocations = []
+        # Worker thread tasks included in the stats, and the profilers of their own merged for them
+        self.tasks = 0
+        self.merged = 0
+        self._profiler = cProfile.Profile()
+        self._start = 0
+        self._finished = []
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        if self.memory:
+            tracemalloc.start(25)
+        self._start = perf_counter()
+        Profile.active = self
+        self._profiler.enable()
+        return self
+
+    def __exit__(self, exception, value, tb):
+        self._profiler.disable()
+        Profile.active = None
+        self.elapsed = perf_counter() - self._start
+
+        if self.memory:
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            self.allocations = snapshot.statistics("lineno")[:self.top]
+
+        self.stats = pstats.Stats(self._profiler)
+        with self._lock:
+            # Tasks still running are left out
+            finished, self._finished = self._finished, []
+        profilers = [profiler for profiler in finished if profiler]
+        for profiler in profilers:
+            self.stats.add(profiler)
+        self.tasks = len(finished)
+        self.merged = len(profilers)
+
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            slug = "".join(c if c.isalnum() else "_" for c in self.name)[:40]
+            self.filename = os.path.join(self.directory, f"{datetime.now():%Y%m%d-%H%M%S}-{slug}.pstats")
+            self.stats.dump_stats(self.filename)
+        return False
+
+    def run(self, func, *args, **kwargs):
+        """Runs a task in a worker thread under a profiler of that thread, added to the stats on exit"""
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Python 3.12+: profiling is process wide, the profiler of the command sees this thread
+            profiler = None
+        try:
+            return func(*args, **kwargs)
+        finally:
+            if profiler:
+                profiler.disable()
+            with self._lock:
+                self._finished.append(profiler)
+
+    def attribution(self):
+        """Returns {category: seconds} for the CATEGORIES plus 'Other'"""
+        result = {category: 0.0 for category in CATEGORIES}
+        for (filename, _, function), (_, _, _, cumulative, _) in self.stats.stats.items():
+            module = os.path.splitext(os.path.basename(filename))[0]
+            for category, entries in CATEGORIES.items():
+                if (module, function) in entries:
+                    result[category] += cumulative
+        result["Other"] = max(0.0, self.elapsed - sum(result.values()))
+        return result
+
+    def hotspots(self):
+        """Returns the top functions by own time as (ncalls, tottime, cumtime, name)"""
+        rows = []
+        for (filename, line, function), (_, calls, own, cumulative, _) in self.stats.stats.items():
+            name = f"{os.path.basename(filename)}:{line}({function})" if line else function
+            rows.append((calls, own, cumulative, name))
+        return sorted(rows, key=lambda r: r[1], reverse=True)[:self.top]
+
+    def report(self, out=None):
+        out = out if out else sys.stdout
+        target = f" -> {self.filename}" if self.filename else ""
+        out.write(f"\nProfile of '{self.name}': {self.elapsed * 1000:.1f} ms{target}\n")
+        if self.tasks:
+            # Time of concurrent tasks adds up, shares can exceed the wall time
+            out.write(f"Includes {self.tasks} tasks of client worker threads, other threads are not profiled\n")
+        else:
+            out.write("Command thread only, other threads are not profiled\n")
+        out.write("\n")
+
+        for category, seconds in self.attribution().items():
+            share = seconds / self.elapsed if self.elapsed else 0
+            out.write(f"  {category:<7} {seconds * 1000:>9.1f} ms {share:>5.0%}\n")
+
+        out.write(f"\n  {'ncalls':>8} {'tottime':>9} {'cumtime':>9}  function\n")
+        for calls, own, cumulative, name in self.hotspots():
+            out.write(f"  {calls:>8} {own * 1000:>7.1f}ms {cumulative * 1000:>7.1f}ms  {name}\n")
+
+        if self.allocations:
+            out.write(f"\n  {'size':>10} {'count':>8}  allocated at\n")
+            for stat in self.allocations:
+                frame = stat.traceback[0]
+                out.write(f"  {stat.size / 1024:>8.1f}KB {stat.count:>8}  "
+                          f"{os.path.basename(frame.filename)}:{frame.lineno}\n")
@@ -0,0 +1,89 @@
+import json
+
+
+"""
+Quorum reads: the same read goes to several servers and the answer most of them agree on wins.
+Catches servers that lag or are on a fork before their data reaches the caller.
+"""
+
+
+class QuorumPolicy:
+
+    __slots__ = ('size', 'agree')
+
+    # Reads whose answer depends on the chain state of the server
+    COMMANDS = frozenset(('balanceget', 'globalbalanceget', 'addlistlim', 'addlistlimfrom'))
+
+    def __init__(self, size=3, agree=None):
+        """
+        :param size: int, number of servers to ask
+        :param agree: int, identical answers needed to return early. Default: a majority of size
+        """
+        self.size = size
+        self.agree = agree if agree else size // 2 + 1
+
+    def applies(self, command):
+        return command in self.COMMANDS
+
+    @staticmethod
+    def key(result):
+        return json.dumps(result, sort_keys=True)
+
+    @staticmethod
+    def height(heights, server):
+        """Returns the block height a server reported, -1 if unknown"""
+        height = heights.get(server)
+        return int(height) if isinstance(height, (int, float)) else -1
+
+    def _top(self, answers, heights):
+        """Returns the answers at the highest known height, all of them when no height is given"""
+        if heights is None:
+            return list(answers.values())
+        known = [self.height(heights, server) for server in answers if self.height(heights, server) >= 0]
+        if not known:
+            return []
+        return [result for server, result in answers.items() if self.height(heights, server) == max(known)]
+
+    def majority(self, answers, heights=None, pending=None):
+        """
+        Returns the answer given by at least agree servers at the highest height, or None. answers is {server: result}.
+        A server behind answers differently without being wrong: only answers at the highest height vote,
+        servers of unknown height don't.
+
+        :param heights: {server: int or None}, heights read with the answers. None = all at the same height
+        :param pending: {server: int or None}, last known heights of the servers still to answer. A majority is
+        only returned if none of them may be further ahead
+        """
+        if heights is not None and pending:
+            top = max((self.height(heights, server) for server in answers), default=-1)
+            if any(self.height(pending, server) < 0 or self.height(pending, server) > top for server in pending):
+                return None
+        votes = {}
+        for result in self._top(answers, heights):
+            key = self.key(result)
+            votes[key] = votes.get(key, 0) + 1
+            if votes[key] >= self.agree:
+                return result
+        return None
+
+    def diverged(self, answers, heights, result):
+        """
+        Returns the servers that answered differently from result at its height or above.
+        Servers below are behind, not on another chain, and servers of unknown height can't be told apart.
+        """
+        expected = self.key(result)
+        height = max((self.height(heights, server) for server, answer in answers.items()
+                      if self.key(answer) == expected), default=-1)
+        return [server for server, answer in answers.items()
+                if self.key(answer) != expected and self.height(heights, server) >= max(height, 0)]
+
+    def highest(self, answers, heights):
+        """
+        Returns the answer most servers at the highest height gave, the first of them on a tie.
+        Without any known height, the answer of the first server. heights is {server: int or None}
+        """
+        top = self._top(answers, heights)
+        if not top:
+            return next(iter(answers.values()))
+        keys = [self.key(result) for result in top]
+        return top[max(range(len(top)), key=lambda i: (keys.count(keys[i]), -i))]
@@ -0,0 +1,238 @@
+import os
+import json
+import socket
+import inspect
+import logging
+import itertools
+import threading
+import socketserver
+
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+
+"""
+Shares one long-lived Client between local processes.
+JSON-RPC 2.0 over a Unix socket, one request or response per line.
+Requests on the same connection may be pipelined, responses come back as soon as they are ready.
+"""
+
+
+DEFAULT_SOCKET = os.environ.get(
+    "TANSANIT_RPC_SOCK",
+    os.path.join(os.path.expanduser("~"), ".tansanit", "client.sock"))
+
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+SERVER_ERROR = -32000
+
+
+class _RPCServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    rpc = None
+
+
+class _RPCHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        write_lock = threading.Lock()
+        pending = set()
+
+        def reply(response):
+            try:
+                data = json.dumps(response)
+            except (TypeError, ValueError) as e:
+                # Result not serializable: the consumer still gets an answer instead of waiting forever
+                self.server.rpc.log.error(f"Can't serialize response to '{response.get('id')}': {e}")
+                data = json.dumps(_error(response.get("id"), INTERNAL_ERROR, f"Result not serializable: {e}"))
+            with write_lock:
+                try:
+                    self.wfile.write(data.encode("utf-8") + b"\n")
+                    self.wfile.flush()
+                except (OSError, ValueError) as e:
+                    # Consumer went away
+                    self.server.rpc.log.debug(e)
+
+        for line in self.rfile:
+            try:
+                request = json.loads(line.decode("utf-8"))
+            except ValueError:
+                reply(_error(None, PARSE_ERROR, "Parse error"))
+                continue
+            pending = {f for f in pending if not f.done()}
+            try:
+                pending.add(self.server.rpc.executor.submit(self.server.rpc.handle, request, reply))
+            except RuntimeError:
+                reply(_error(request.get("id") if isinstance(request, dict) else None,
+                             SERVER_ERROR, "Server is shutting down"))
+                break
+
+        # Deliver outstanding responses before the connection is closed
+        wait(pending)
+
+
+def _error(request_id, code, message):
+    return {"jsonrpc": "2.0", "id": request_id, "error": {"code": code, "message": message}}
+
+
+class ClientServer:
+
+    __slots__ = ('client', 'socket_path', 'executor', 'log', '_server')
+
+    # Client methods available to consumers
+    METHODS = ('balance', 'global_balance', 'latest_transactions', 'status', 'info', 'wallet',
+               'addresses', 'get_aliases', 'has_alias', 'alias_exists', 'reject_empty_msg',
+               'refresh_servers', 'command', 'send', 'sign', 'encrypt_message', 'decrypt_message',
+               'metrics', 'rebalance', 'search_transactions', 'sync_history',
+               'export_transactions', 'report')
+
+    def __init__(self, client, socket_path=DEFAULT_SOCKET, workers=16, log=None):
+        """
+        :param client: the Client to share
+        :param socket_path: string, Unix socket to listen on
+        :param workers: int, max number of requests handled concurrently
+        """
+        self.client = client
+        self.socket_path = socket_path
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rpc")
+        self.log = log if log else logging
+        self._server = None
+
+    def serve(self):
+        """Listens on the socket until stopped"""
+        directory = os.path.dirname(self.socket_path)
+        directory and os.makedirs(directory, mode=0o700, exist_ok=True)
+
+        if os.path.exists(self.socket_path):
+            try:
+                RemoteClient(self.socket_path).close()
+                raise RuntimeWarning(f"Already serving on '{self.socket_path}'")
+            except OSError:
+                # Stale socket
+                os.remove(self.socket_path)
+
+        # Socket must only be accessible by the current user
+        umask = os.umask(0o177)
+        try:
+            self._server = _RPCServer(self.socket_path, _RPCHandler)
+        finally:
+            os.umask(umask)
+        self._server.rpc = self
+
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            self.executor.shutdown(wait=False)
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    def stop(self):
+        if self._server:
+            threading.Thread(target=self._server.shutdown, daemon=True).start()
+
+    def handle(self, request, reply):
+        """Runs a JSON-RPC request and sends the response through reply"""
+        if not isinstance(request, dict) or not isinstance(request.get("method"), str):
+            reply(_error(None, INVALID_REQUEST, "Invalid request"))
+            return
+
+        request_id = request.get("id")
+        method = request["method"]
+        params = request.get("params", [])
+
+        if method not in self.METHODS:
+            response = _error(request_id, METHOD_NOT_FOUND, f"Method '{method}' not found")
+        elif not isinstance(params, (list, dict)):
+            response = _error(request_id, INVALID_PARAMS, "Params must be a list or an object")
+        else:
+            function = getattr(self.client, method)
+            try:
+                # Only a mismatch with the signature is invalid params, a TypeError inside the method is not
+                arguments = inspect.signature(function).bind(**params) if isinstance(params, dict) \
+                    else inspect.signature(function).bind(*params)
+            except TypeError as e:
+                arguments, response = None, _error(request_id, INVALID_PARAMS, str(e))
+            if arguments is not None:
+                try:
+                    # Client is thread-safe, identical reads in flight are coalesced
+                    result = function(*arguments.args, **arguments.kwargs)
+                    response = {"jsonrpc": "2.0", "id": request_id, "result": result}
+                except Exception as e:
+                    self.log.error(e)
+                    response = _error(request_id, INTERNAL_ERROR, str(e))
+
+        # Notifications don't get a response
+        if "id" in request:
+            reply(response)
+
+
+class RemoteClient:
+    """
+    Thin stand-in for Client that forwards method calls to a ClientServer.
+    Safe to share between threads, concurrent calls are multiplexed over one connection.
+    """
+
+    __slots__ = ('_sock', '_file', '_pending', '_ids', '_lock', '_timeout')
+
+    def __init__(self, socket_path=DEFAULT_SOCKET, timeout=60):
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.connect(socket_path)
+        self._file = self._sock.makefile("rb")
+        self._pending = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._timeout = timeout
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def call_async(self, method, *args, **kwargs):
+        """Sends a request and returns a Future of its result"""
+        if args and kwargs:
+            raise TypeError("Use either positional or keyword arguments")
+        future = Future()
+        with self._lock:
+            request_id = next(self._ids)
+            self._pending[request_id] = future
+            request = {"jsonrpc": "2.0", "id": request_id, "method": method, "params": kwargs if kwargs else list(args)}
+            self._sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        return future
+
+    def call(self, method, *args, **kwargs):
+        return self.call_async(method, *args, **kwargs).result(self._timeout)
+
+    def close(self):
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
+
+    def _read(self):
+        try:
+            for line in self._file:
+                response = json.loads(line.decode("utf-8"))
+                with self._lock:
+                    future = self._pending.pop(response.get("id"), None)
+                if not future:
+                    continue
+                if "error" in response:
+                    future.set_exception(RuntimeWarning(response["error"]["message"]))
+                else:
+                    future.set_result(response["result"])
+        except (OSError, ValueError):
+            pass
+        # Connection closed, fail whoever is still waiting
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.set_exception(ConnectionError("Connection to client server closed"))
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def method(*args, **kwargs):
+            return self.call(name, *args, **kwargs)
+        return method
@@ -1,22 +1,38 @@
 #!/usr/bin/env python3
 
-import qrcode
 import logging
+import atexit
 import sys
 import os
 import json
 import time
 import threading
-import multiprocessing
+import shlex
+import itertools
 
 from cmd import Cmd
-from pyfiglet import Figlet
-from PyInquirer import prompt
+from concurrent.futures import Future
 from client import Client
+from agent import AgentClient, DEFAULT_SOCKET
+from rpcserver import DEFAULT_SOCKET as RPC_SOCKET
+from transport import RecordingTransport, ReplayTransport
+from health import DEFAULT_FILE as SERVERS_CACHE
+from history import DEFAULT_FILE as HISTORY_FILE, wallet_history_file
+from tracker import TransactionTracker, DEFAULT_FILE as PENDING_FILE
+from mempool import MempoolWatcher
+from viewer import TransactionViewer, TransactionFilter
+from export import parse_options
+from batch import OFFLINE_COMMANDS
 from argparse import ArgumentParser
-from bismuthclient.bismuthutil import BismuthUtil
 from logging.handlers import TimedRotatingFileHandler
-from datetime import datetime
+
+
+# Heavy modules (PyInquirer, qrcode, pyfiglet, bismuthutil) are
+# imported by the commands that need them to keep startup fast.
+# See benchmarks/bench_startup.py
+def prompt(questions):
+    from PyInquirer import prompt as inquirer_prompt
+    return inquirer_prompt(questions)
 
 
 # TODO: Remove 'self.log.error(e)' from tansanit.py since it's in client already
@@ -34,10 +50,19 @@ class Tansanit(Cmd):
 
     ARGS_RECEIVE = ["tty"]
     ARGS_BALANCE = ["all"]
+    ARGS_TRANSACTIONS = ["all", "full", "reverse", "in", "out", "op=", "addr=", "min=", "max=", "block="]
+    ARGS_FIND = ["in", "out", "op=", "addr=", "text=", "min=", "max=", "from=", "to=", "block="]
+    ARGS_EXPORT = ["--format", "--from-block", "csv", "jsonl", "parquet"]
+    ARGS_REPORT = ["day", "month", "year", "top="]
+    ARGS_PENDING = ["check"]
+    ARGS_INCOMING = ["check", "watch", "unwatch"]
     ARGS_CONNECT = ["auto"]
     ARGS_NOTIFY = ["on", "off"]
+    ARGS_STATS = ["reset", "prom"]
+    ARGS_PROFILE = ["mem"]
 
     job = None
+    _job_stop = None
     repeat = 20
 
     _balance = None
@@ -48,6 +73,13 @@ class Tansanit(Cmd):
         # Parse command line arguments
         self.args = self._parse_args()
 
+        # Run commands without REPL, prompts and shell
+        self.batch = bool(self.args.commands or self.args.batch)
+        self.out = sys.stdout
+        if self.batch:
+            # Only JSON results go to stdout
+            sys.stdout = sys.stderr
+
         # Set up logging
         self._logging(self.args.log)
 
@@ -58,19 +90,23 @@ class Tansanit(Cmd):
         wallet_path = os.path.dirname(self.args.wallet)
         wallet_path and os.makedirs(wallet_path, exist_ok=True)
 
+        # Use wallet agent if one holds this wallet
+        self.agent = self._get_agent(self.args.agent)
+
         # Get password if wallet is encrypted
-        password = self._get_password(self.args.wallet)
+        password = None if self.agent else self._get_password(self.args.wallet)
 
         try:
-            with Spinner():
+            with Spinner(enabled=not self.batch):
                 self._init_wallet(password)
-                if self.args.notify:
-                    self.run_job()
         except Exception as e:
             logging.error(e)
             print(f"\n{e}\n")
             raise SystemExit
 
+        # Find and connect to server in background
+        self.ready = self._connect()
+
     def _parse_args(self):
         desc = "Tansanit - command line wallet for Bismuth (BIS)"
         parser = ArgumentParser(description=desc)
@@ -115,10 +151,156 @@ class Tansanit(Cmd):
             "--notify",
             dest="notify",
             action="store_true",
-            help="notify on balance changes",
+            help="notify on balance changes and incoming payments",
             required=False,
             default=False)
 
+        # Watch-only addresses
+        parser.add_argument(
+            "--watch",
+            dest="watch",
+            action="append",
+            help="also notify on payments to this address (repeatable)",
+            required=False,
+            default=None)
+
+        # Skip banner
+        parser.add_argument(
+            "--no-banner",
+            dest="banner",
+            action="store_false",
+            help="don't show banner at startup",
+            required=False,
+            default=True)
+
+        # Wallet agent
+        parser.add_argument(
+            "--agent",
+            dest="agent",
+            nargs="?",
+            const=DEFAULT_SOCKET,
+            help="use running wallet agent (socket path)",
+            required=False,
+            default=None)
+
+        # Batch mode
+        parser.add_argument(
+            "-c",
+            dest="commands",
+            action="append",
+            help="run command, print JSON result and exit (repeatable)",
+            required=False,
+            default=None)
+
+        parser.add_argument(
+            "--batch",
+            dest="batch",
+            action="store_true",
+            help="run commands from stdin, print JSON results",
+            required=False,
+            default=False)
+
+        parser.add_argument(
+            "--yes",
+            dest="yes",
+            action="store_true",
+            help="confirm sends in batch mode",
+            required=False,
+            default=False)
+
+        # Metrics textfile
+        parser.add_argument(
+            "--metrics-file",
+            dest="metrics_file",
+            help="write metrics after each command (node exporter textfile)",
+            required=False,
+            default=None)
+
+        # Profiling
+        parser.add_argument(
+            "--profile",
+            dest="profile",
+            nargs="?",
+            const="cpu",
+            choices=["cpu", "mem"],
+            help="profile every command (mem: also track allocations)",
+            required=False,
+            default=None)
+
+        # Keep the transaction history between runs
+        parser.add_argument(
+            "--history",
+            dest="history",
+            nargs="?",
+            const="",
+            help="keep the history of 'find' and 'report' in a SQLite file (default: next to the wallet file)",
+            required=False,
+            default=None)
+
+        # Share client with local processes
+        parser.add_argument(
+            "--serve",
+            dest="serve",
+            nargs="?",
+            const=RPC_SOCKET,
+            help="serve client over JSON-RPC (socket path)",
+            required=False,
+            default=None)
+
+        # Move to a better server from time to time
+        parser.add_argument(
+            "--rebalance",
+            dest="rebalance",
+            type=int,
+            help="re-check servers every x seconds and switch if a better one is found",
+            required=False,
+            default=0)
+
+        # Hedge slow reads to a second server
+        parser.add_argument(
+            "--hedge",
+            dest="hedge",
+            nargs="?",
+            const=95,
+            type=float,
+            help="resend reads slower than this latency percentile to a second server (default: 95)",
+            required=False,
+            default=None)
+
+        # Ask several servers and use the answer most agree on
+        parser.add_argument(
+            "--quorum",
+            dest="quorum",
+            nargs="?",
+            const=3,
+            type=int,
+            help="read balances and transactions from x servers and use the majority answer (default: 3)",
+            required=False,
+            default=None)
+
+        # Record or replay server traffic
+        parser.add_argument(
+            "--record",
+            dest="record",
+            help="record server traffic to file (.jsonl.gz)",
+            required=False,
+            default=None)
+
+        parser.add_argument(
+            "--replay",
+            dest="replay",
+            help="answer from recorded traffic instead of servers",
+            required=False,
+            default=None)
+
+        parser.add_argument(
+            "--replay-speed",
+            dest="replay_speed",
+            type=float,
+            help="replay timing factor (2: twice as fast, 0: no delays)",
+            required=False,
+            default=1.0)
+
         return parser.parse_args()
 
     def _logging(self, level):
@@ -150,6 +332,14 @@ class Tansanit(Cmd):
         except:
             return None
 
+        if data["encrypted"] and self.batch:
+            # No prompts in batch mode
+            password = os.environ.get("TANSANIT_PASSWORD")
+            if not password:
+                print("Encrypted wallet: use --agent or set TANSANIT_PASSWORD", file=sys.stderr)
+                raise SystemExit(1)
+            return password
+
         if data["encrypted"]:
             enter_pass = [
                 {
@@ -175,17 +365,118 @@ class Tansanit(Cmd):
         else:
             return None
 
+    def _get_agent(self, socket_path):
+        if not socket_path:
+            return None
+
+        agent = AgentClient(socket_path)
+        info = agent.available()
+
+        if not info:
+            logging.warning(f"No wallet agent on '{socket_path}'")
+            return None
+        if info["file"] != os.path.abspath(self.args.wallet):
+            logging.warning(f"Wallet agent holds '{info['file']}', not '{self.args.wallet}'")
+            return None
+
+        return agent
+
     def _init_wallet(self, password=None):
         # Create and load wallet
-        self.client = Client(self.args.wallet, password=password)
+        self.client = Client(self.args.wallet, password=password, agent=self.agent,
+                             transport=self._get_transport())
+        if not self.args.replay:
+            # Reconnect to last known good server on next start
+            self.client.set_health_file(SERVERS_CACHE)
+            # Searched transactions stay indexed, next 'find' only fetches new ones
+            history = HISTORY_FILE if self.args.history is None \
+                else self.args.history or wallet_history_file(self.args.wallet)
+            if history:
+                self.client.set_history_file(history)
+            # Clock offset to the server is measured in the background, sends never wait for it
+            self.client.set_clock_sync()
+        if not self.batch:
+            # Same page size as 'transactions'
+            self.client.set_prefetch(page=5)
+        if self.args.hedge:
+            self.client.set_hedging(percentile=self.args.hedge)
+        if self.args.quorum:
+            self.client.set_quorum(size=self.args.quorum)
+        # Sent transactions stay tracked across restarts until confirmed
+        self.tracker = TransactionTracker(self.client, filename=None if self.args.replay else PENDING_FILE)
+        self.tracker.add_callback(self.tracked)
+        # Incoming payments are seen in the mempool, a block before the balance changes
+        self.mempool = MempoolWatcher(self.client, watch=self.args.watch)
+        self.mempool.add_callback(self.incoming)
+        # Saves server health, finishes recordings
+        atexit.register(self.client.close)
+
+    def _get_transport(self):
+        if self.args.replay:
+            return ReplayTransport(self.args.replay, speed=self.args.replay_speed)
+        if self.args.record:
+            return RecordingTransport(self.args.record)
+        return None
+
+    def _connect(self):
+        ready = Future()
+
+        def connect():
+            try:
+                if self.args.server:
+                    # Connect to specified server
+                    server = self.client.set_server(self.args.server)
+                else:
+                    # Automatically choose best server
+                    server = self.client.get_server()
+                ready.set_result(server)
+            except Exception as e:
+                logging.error(e)
+                ready.set_exception(e)
+                return
 
-        # Connect to server
-        if self.args.server:
-            # Connect to specified server
-            self.client.set_server(self.args.server)
-        else:
-            # Automatically choose best server
-            self.client.get_server()
+            if not self.batch:
+                self.tracker.start()
+
+            if self.args.notify and not self.batch:
+                self.run_job()
+                self.mempool.start()
+
+            if self.args.rebalance and not self.args.server:
+                self.rebalance()
+
+        # Daemon thread, server discovery must not keep us from quitting
+        threading.Thread(target=connect, daemon=True).start()
+        return ready
+
+    def _wait_ready(self):
+        if self.ready.done():
+            return
+
+        print("Connecting to server...")
+        with Spinner():
+            exception = self.ready.exception()
+
+        if exception:
+            print(f"Connection failed: {exception}\n")
+
+    def run_batch(self):
+        from batch import Batch
+
+        lines = self.args.commands if self.args.commands else sys.stdin
+        return Batch(self.client, ready=self.ready, yes=self.args.yes, out=self.out, tracker=self.tracker).run(lines)
+
+    def serve(self):
+        from rpcserver import ClientServer
+
+        # Consumers should get a connected client
+        self._wait_ready()
+        print(f"Serving client on '{self.args.serve}'")
+        ClientServer(self.client, self.args.serve).serve()
+
+    def banner(self):
+        from pyfiglet import Figlet
+        return Figlet(font="slant").renderText("Tansanit")
 
     def preloop(self):
         if self.args.clear:
@@ -194,6 +485,26 @@ class Tansanit(Cmd):
             else:
                 os.system("clear")
 
+    def onecmd(self, line):
+        command = self.parseline(line)[0]
+
+        # Network commands have to wait for the server connection
+        if command and command not in OFFLINE_COMMANDS:
+            self._wait_ready()
+
+        if self.args.profile and command and command != "profile":
+            return self._profile(line, memory=self.args.profile == "mem")
+
+        return super().onecmd(line)
+
+    def _profile(self, line, memory=False):
+        from profiler import Profile
+
+        with Profile(line, memory=memory) as profile:
+            stop = super().onecmd(line)
+        profile.report()
+        return stop
+
     def precmd(self, line):
         if self.args.clear:
             if os.name == "nt":
@@ -204,6 +515,11 @@ class Tansanit(Cmd):
         return line
 
     def postcmd(self, stop, line):
+        if self.args.metrics_file:
+            try:
+                self.client.write_metrics(self.args.metrics_file)
+            except OSError as e:
+                logging.error(e)
         print()
         return stop
 
@@ -291,6 +607,11 @@ class Tansanit(Cmd):
         print(f"Server:    {result['server']}\n"
               f"Connected: {result['connected']}")
 
+        clock = result["clock"]
+        if clock["age"] is not None:
+            print(f"Clock:     {clock['drift']:+.3f} s to server (±{clock['error']:.3f} s, "
+                  f"measured {clock['age']:.0f} s ago)")
+
     def do_send(self, args):
         """ Send coins to address """
 
@@ -339,6 +660,8 @@ class Tansanit(Cmd):
             else:
                 return
 
+        from bismuthclient.bismuthutil import BismuthUtil
+
         if not BismuthUtil.valid_address(address):
             msg = f"'{address}' is not a valid address!"
             logging.error(msg)
@@ -383,7 +706,9 @@ class Tansanit(Cmd):
                         data=data)
 
                     if reply:
-                        print(f"DONE! TRXID: {reply}\n")
+                        self.tracker.track(reply, recipient=address, amount=amount)
+                        print(f"DONE! TRXID: {reply}\n"
+                              f"Confirmation is tracked, see 'pending'\n")
                     else:
                         print("Transaction couldn't be send")
                 except Exception as e:
@@ -393,6 +718,8 @@ class Tansanit(Cmd):
     def do_receive(self, args):
         """ Show QR-Code to receive BIS """
 
+        import qrcode
+
         qr = qrcode.QRCode()
         qr.add_data(self.client.address)
 
@@ -422,65 +749,372 @@ class Tansanit(Cmd):
     def do_transactions(self, args):
         """ Show latest transactions """
 
+        usage = "Provide following syntax\n" \
+                "transactions [all] [count|full] [reverse] [in|out] [op=<operation>] [addr=<address>] " \
+                "[min=<amount>] [max=<amount>] [block=<height>]"
+
         num = 5
-        if args:
-            if args.strip().isnumeric():
-                num = args.strip()
+        wallet = False
+        reverse = False
+        block = None
+        criteria = dict()
+
+        for token in filter(None, args.split(" ")):
+            key, _, value = token.partition("=")
+            if token.isnumeric():
+                num = int(token)
+            elif token.lower() == "all":
+                wallet = True
+            elif token.lower() == "full":
+                num = None
+            elif token.lower() == "reverse":
+                reverse = True
+            elif token.lower() in ["in", "out"]:
+                criteria["direction"] = token.lower()
+            elif key == "op" and value:
+                criteria["operation"] = value
+            elif key == "addr" and value:
+                criteria["counterparty"] = value
+            elif key in ["min", "max"] and value.replace(".", "", 1).isnumeric():
+                criteria[f"{key}_amount"] = float(value)
+            elif key == "block" and value.isnumeric():
+                block = int(value)
             else:
-                print("Provide following argument\n"
-                      "transactions <number of last transactions>")
+                print(usage)
                 return
 
-        reverse = False
-        if args and len(list(filter(None, args.split(" ")))) > 0:
-            if args.lower() == "reverse":
-                reverse = True
+        own = {a["address"] for a in self.client.addresses()} if wallet else self.client.address
+        keep = TransactionFilter(own, **criteria)
+        # Without filter, don't fetch more than needed
+        page = min(num, 100) if num and not keep else 100
+
+        def source(block_height=None):
+            if wallet:
+                # Every address of the wallet, merged newest first
+                return self.client.iter_wallet_transactions(page=page, block_height=block_height)
+            offset = self.client.find_offset(block_height) if block_height else 0
+            return self.client.iter_transactions(page=page, offset=offset)
+
+        def ascending():
+            if wallet:
+                transactions = self.client.iter_wallet_transactions(page=page, oldest_first=True)
+            else:
+                transactions = self.client.iter_transactions_oldest_first(page=page)
+            # Up to the block to start at when newest first
+            return itertools.takewhile(lambda tx: int(tx.block_height) <= block, transactions) if block \
+                else transactions
+
+        viewer = TransactionViewer(own, selected=self.SELECTED)
 
         try:
-            with Spinner():
-                result = self.client.latest_transactions(num=num)
-            if not result:
-                print("No transactions yet")
+            # Both orders stream the full history, oldest first holds a given count in memory
+            shown = viewer.show(lambda block_height: source(block_height if block_height else block),
+                                count=num, oldest_first=not reverse, keep=keep if keep else None,
+                                ascending=ascending)
+        except Exception as e:
+            logging.error(e)
+            print(str(e))
+            return
+
+        if not shown:
+            print("No matching transactions" if keep or block else "No transactions yet")
+
+    def complete_transactions(self, text, line, begidx, endidx):
+        return [i for i in self.ARGS_TRANSACTIONS if i.startswith(text)]
+
+    def do_find(self, args):
+        """ Search transactions in the local history """
+        from datetime import datetime, timezone
+
+        usage = "Provide following syntax\n" \
+                "find [count] [in|out] [op=<operation>] [addr=<address>] [text=<openfield part>] " \
+                "[min=<amount>] [max=<amount>] [from=<YYYY-MM-DD>] [to=<YYYY-MM-DD>] [block=<height>]"
+
+        def day(value):
+            return datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp()
+
+        num = 20
+        criteria = dict()
+
+        try:
+            # Quotes keep spaces: text="invoice 12"
+            tokens = shlex.split(args)
+        except ValueError:
+            print(usage)
+            return
+
+        for token in tokens:
+            key, _, value = token.partition("=")
+            try:
+                if token.isnumeric():
+                    num = int(token)
+                elif token.lower() in ["in", "out"]:
+                    criteria["direction"] = token.lower()
+                elif key == "op" and value:
+                    criteria["operation"] = value
+                elif key == "addr" and value:
+                    criteria["counterparty"] = value
+                elif key == "text" and value:
+                    criteria["text"] = value
+                elif key in ["min", "max"] and value.replace(".", "", 1).isnumeric():
+                    criteria[f"{key}_amount"] = float(value)
+                elif key == "from":
+                    criteria["since"] = day(value)
+                elif key == "to":
+                    # Whole day included
+                    criteria["until"] = day(value) + 86400
+                elif key == "block" and value.isnumeric():
+                    criteria["max_block"] = int(value)
+                else:
+                    raise ValueError(token)
+            except ValueError:
+                print(usage)
                 return
+
+        try:
+            with Spinner():
+                added = self.client.sync_history()
         except Exception as e:
             logging.error(e)
             print(str(e))
             return
+        if added:
+            print(f"{added} new transactions indexed")
+
+        def source(block_height=None):
+            if block_height:
+                criteria["max_block"] = block_height
+            return iter(self.client.search_transactions(sync=False, limit=num, records=True, **criteria))
+
+        viewer = TransactionViewer(self.client.address, selected=self.SELECTED)
 
-        msg = str()
-        for trx in result:
-            trx_amount = trx["amount"]
-            trx_height = trx["block_height"]
-            trx_address = trx["address"]
-            trx_recipient = trx["recipient"]
-            trx_timestamp = trx["timestamp"]
-            trx_signature = trx["signature"]
-            trx_operation = trx["operation"]
-            trx_fee = trx["fee"]
+        if not viewer.show(source):
+            print("No matching transactions")
 
-            if trx_address == self.client.address:
-                trx_address = f"{trx_address}{self.SELECTED}"
+    def complete_find(self, text, line, begidx, endidx):
+        return [i for i in self.ARGS_FIND if i.startswith(text)]
+
+    def do_export(self, args):
+        """ Export transactions to a CSV, JSON lines or Parquet file """
+
+        try:
+            filename, fmt, from_block = parse_options(shlex.split(args))
+        except ValueError as e:
+            print(f"{e}\n"
+                  f"Provide following syntax\n"
+                  f"export <file> [--format csv|jsonl|parquet] [--from-block <height>]")
+            return
+
+        try:
+            with Spinner():
+                result = self.client.export_transactions(filename, fmt=fmt, from_block=from_block)
+        except Exception as e:
+            logging.error(e)
+            print(str(e))
+            return
+
+        print(f"DONE! {result['rows']} transactions exported to '{filename}' as {result['format']}, "
+              f"{result['total']} in total up to block {result['block_height']}")
+
+    def complete_export(self, text, line, begidx, endidx):
+        return [i for i in self.ARGS_EXPORT if i.startswith(text)]
+
+    def do_report(self, args):
+        """ Show balance history, flows and top counterparties """
+
+        period = "month"
+        top = 10
+
+        for token in filter(None, args.split(" ")):
+            key, _, value = token.partition("=")
+            if token.lower() in ["day", "month", "year"]:
+                period = token.lower()
+            elif key == "top" and value.isnumeric():
+                top = int(value)
             else:
-                trx_recipient = f"{trx_recipient}{self.SELECTED}"
-
-            dt = datetime.utcfromtimestamp(trx_timestamp).strftime("%Y-%m-%d %H:%M:%S")
-            trx_timestamp = f"{dt} UTC"
-
-            trx_msg = f"Amount:    {trx_amount}\n" \
-                      f"Block:     {trx_height}\n" \
-                      f"From:      {trx_address}\n" \
-                      f"To:        {trx_recipient}\n" \
-                      f"Timestamp: {trx_timestamp}\n" \
-                      f"Trx ID:    {trx_signature[:56]}\n" \
-                      f"Fee:       {trx_fee}\n" \
-                      f"Operation: {trx_operation}\n\n"
-
-            if reverse:
-                msg = msg + trx_msg
+                print("Provide following syntax\n"
+                      "report [day|month|year] [top=<count>]")
+                return
+
+        try:
+            with Spinner():
+                report = self.client.report(period=period, top=top)
+        except Exception as e:
+            logging.error(e)
+            print(str(e))
+            return
+
+        totals = report["totals"]
+        print(f"Transactions: {totals['transactions']}\n"
+              f"Received:     {totals['received']} BIS\n"
+              f"Rewards:      {totals['rewards']} BIS\n"
+              f"Sent:         {totals['sent']} BIS\n"
+              f"Fees:         {totals['fees']} BIS\n"
+              f"Balance:      {totals['balance']} BIS\n")
+
+        print(f"{'Period':<10} {'Received':>20} {'Sent':>20} {'Fees':>14} {'Balance':>20}")
+        for flow in report["flows"]:
+            print(f"{flow['period']:<10} {flow['received']:>20} {flow['sent']:>20} {flow['fees']:>14} "
+                  f"{flow['balance']:>20}")
+
+        print(f"\n{'Counterparty':<56} {'Received':>20} {'Sent':>20} {'Count':>6}")
+        for counterparty in report["counterparties"]:
+            print(f"{counterparty['address']:<56} {counterparty['received']:>20} {counterparty['sent']:>20} "
+                  f"{counterparty['count']:>6}")
+
+    def complete_report(self, text, line, begidx, endidx):
+        return [i for i in self.ARGS_REPORT if i.startswith(text)]
+
+    def do_pending(self, args):
+        """ Show sent transactions waiting for confirmation """
+
+        if args and args.lower() == "check":
+            try:
+                with Spinner():
+                    self.tracker.check()
+            except Exception as e:
+                logging.error(e)
+                print(str(e))
+                return
+        elif args:
+            print("Provide following syntax\n"
+                  "pending [check]")
+            return
+
+        transactions = self.tracker.pending()
+
+        if not transactions:
+            print("No sent transactions\n")
+            return
+
+        print(f"{'TRXID':<56} {'Amount':>14} {'Sent':<19} {'Status':<12} {'Block':>8}")
+        for tx in transactions:
+            sent = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(tx["submitted"]))
+            status = tx["status"] if tx["status"] else "in block" if tx["block_height"] else "pending"
+            block = tx["block_height"] if tx["block_height"] else ""
+            print(f"{tx['txid']:<56} {tx['amount'] or '':>14} {sent:<19} {status:<12} {block:>8}")
+
+    def complete_pending(self, text, line, begidx, endidx):
+        return [i for i in self.ARGS_PENDING if i.startswith(text)]
+
+    def tracked(self, tx):
+        msg = f"Transaction {tx.txid} {tx.status}"
+        logging.info(msg)
+        if not self.batch:
+            print(f"\n{msg}")
+
+    def do_incoming(self, args):
+        """ Show incoming payments seen in the mempool """
+
+        arg_list = list(filter(None, args.split(" ")))
+
+        if arg_list and arg_list[0] in ["watch", "unwatch"] and len(arg_list) == 2:
+            from bismuthclient.bismuthutil import BismuthUtil
+
+            if not BismuthUtil.valid_address(arg_list[1]):
+                print(f"'{arg_list[1]}' is not a valid address!")
+                return
+            if arg_list[0] == "watch":
+                self.mempool.watch(arg_list[1])
             else:
-                msg = trx_msg + msg
+                self.mempool.unwatch(arg_list[1])
+            print(f"Watch-only addresses: {', '.join(sorted(self.mempool.watched)) or 'none'}\n")
+            return
+        if arg_list == ["check"]:
+            try:
+                with Spinner():
+                    self.mempool.poll()
+            except Exception as e:
+                logging.error(e)
+                print(str(e))
+                return
+        elif arg_list:
+            print("Provide following syntax\n"
+                  "incoming [check|watch <address>|unwatch <address>]")
+            return
+
+        payments = self.mempool.payments()
+
+        if not payments:
+            print("No incoming payments seen, the mempool is watched with 'notify on'\n")
+            return
+
+        print(f"{'Seen':<19} {'Amount':>14} {'From':<56} {'Status':<12} {'Block':>8}")
+        for payment in payments:
+            seen = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(payment["seen"]))
+            status = "unconfirmed" if payment["status"] == "provisional" else payment["status"]
+            block = payment["block_height"] if payment["block_height"] else ""
+            print(f"{seen:<19} {payment['amount']:>14} {payment['sender']:<56} {status:<12} {block:>8}")
+
+    def complete_incoming(self, text, line, begidx, endidx):
+        return [i for i in self.ARGS_INCOMING if i.startswith(text)]
+
+    def do_stats(self, args):
+        """ Show RPC latency and cache statistics """
+
+        arg_list = list(filter(None, args.split(" ")))
+
+        if arg_list and arg_list[0] == "reset":
+            self.client.metrics_reset()
+            print("DONE! Statistics reset")
+            return
+        if arg_list and arg_list[0] == "prom":
+            if len(arg_list) != 2:
+                print("Provide following syntax\n"
+                      "stats prom <file>")
+                return
+            try:
+                self.client.write_metrics(arg_list[1])
+                print(f"DONE! Metrics written to '{arg_list[1]}'")
+            except OSError as e:
+                logging.error(e)
+                print(str(e))
+            return
+
+        metrics = self.client.metrics()
+        cache = metrics["cache"]
+
+        print(f"{'Command':<18} {'Server':<22} {'Count':>6} {'Err':>4} "
+              f"{'Avg ms':>8} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'KB in':>8}")
 
-        print(msg[:-2])
+        for rpc in metrics["rpc"]:
+            print(f"{rpc['command']:<18} {rpc['server']:<22} {rpc['count']:>6} {rpc['errors']:>4} "
+                  f"{rpc['avg'] * 1000:>8.1f} {rpc['p50'] * 1000:>8.1f} {rpc['p90'] * 1000:>8.1f} "
+                  f"{rpc['p99'] * 1000:>8.1f} {rpc['received'] / 1024:>8.1f}")
+
+        print(f"\nCache:     {cache['hits']} hits, {cache['misses']} misses ({cache['ratio']:.0%})")
+
+        for command, hedges in metrics["hedges"].items():
+            print(f"Hedged:    {command} {hedges['sent']} times, {hedges['won']} won")
+
+        for command, count in metrics["coalesced"].items():
+            print(f"Coalesced: {command} {count} times")
+
+    def complete_stats(self, text, line, begidx, endidx):
+        return [i for i in self.ARGS_STATS if i.startswith(text)]
+
+    def do_profile(self, args):
+        """ Profile a command: profile [mem] <command> """
+
+        memory = False
+        if args.startswith("mem "):
+            memory = True
+            args = args[4:].strip()
+
+        command = self.parseline(args)[0]
+        if not command:
+            print("Provide following syntax\n"
+                  "profile [mem] <command>")
+            return
+
+        # Waiting for the connection is not part of the command
+        if command not in OFFLINE_COMMANDS:
+            self._wait_ready()
+
+        return self._profile(args, memory=memory)
+
+    def complete_profile(self, text, line, begidx, endidx):
+        return [i for i in self.ARGS_PROFILE if i.startswith(text)]
 
     def do_refresh(self, args):
         """ Refresh server list """
@@ -574,6 +1208,8 @@ class Tansanit(Cmd):
     def do_select(self, args):
         """ Change currently active address """
 
+        from bismuthclient.bismuthutil import BismuthUtil
+
         if args:
             if BismuthUtil.valid_address(args):
                 self.client.set_address(args)
@@ -821,7 +1457,7 @@ class Tansanit(Cmd):
         result = prompt(question)
 
         if result and result[question[0]["name"]] == "Yes":
-            self.job.terminate() if self.job else None
+            self.stop_job()
             raise SystemExit
 
     def _select_address(self, name="addresses", message="Select an address"):
@@ -859,9 +1495,11 @@ class Tansanit(Cmd):
         else:
             if args.lower() == "on":
                 self.run_job()
+                self.mempool.start()
                 print("Balance check activated")
             elif args.lower() == "off":
-                self.job.terminate() if self.job else None
+                self.stop_job()
+                self.mempool.stop()
                 print("Balance check deactivated")
             else:
                 print("Provide argument 'on' or 'off'")
@@ -869,27 +1507,59 @@ class Tansanit(Cmd):
     def complete_notify(self, text, line, begidx, endidx):
         return [i for i in self.ARGS_NOTIFY if i.startswith(text)]
 
-    def notify(self, text):
-        title = '"Tansanit balance changed"'
-        os.system(f"osascript notify.scpt {title} {text}")
+    def notify(self, text, title="Tansanit balance changed"):
+        import subprocess
+
+        # Arguments as a list, no shell: texts can hold data from the server
+        try:
+            subprocess.run(["osascript", "notify.scpt", title, text], check=False)
+        except OSError as e:
+            logging.warning(f"Notification failed: {e}")
+
+    def incoming(self, payment):
+        from bismuthclient.bismuthformat import AmountFormatter
+
+        state = "unconfirmed" if payment.status == "provisional" else payment.status
+        amount = AmountFormatter(payment.amount).to_string(decimals=8)
+        logging.info(f"Incoming {amount} BIS to {payment.recipient} {state}: {payment.txid}")
+        self.notify(f"{amount} BIS {state}", title="Tansanit incoming payment")
 
     def run_job(self):
-        self.job.terminate() if self.job else None
-        self.job = multiprocessing.Process(target=self.check_balance)
+        self.stop_job()
+        # A thread, not a process: a fork while other threads hold locks can deadlock the child
+        self._job_stop = threading.Event()
+        self.job = threading.Thread(target=self.check_balance, args=(self._job_stop,), name="balance", daemon=True)
         self.job.start()
 
-    def check_balance(self):
+    def stop_job(self):
+        if self.job:
+            self._job_stop.set()
+            self.job = None
+
+    def rebalance(self):
         while True:
-            balance = self.client.balance(for_display=True)
+            time.sleep(self.args.rebalance)
+            try:
+                self.client.rebalance()
+            except Exception as e:
+                logging.error(e)
 
-            if not self._balance:
-                self._balance = balance
+    def check_balance(self, stop):
+        while True:
+            try:
+                balance = self.client.balance(for_display=True)
 
-            if self._balance != balance:
-                self._balance = balance
-                self.notify(f"{balance} BIS")
+                if not self._balance:
+                    self._balance = balance
 
-            time.sleep(self.repeat)
+                if self._balance != balance:
+                    self._balance = balance
+                    self.notify(f"{balance} BIS")
+            except Exception as e:
+                logging.error(e)
+
+            if stop.wait(self.repeat):
+                return
 
 
 class Spinner:
@@ -902,8 +1572,9 @@ class Spinner:
             for cursor in "|/-\\":
                 yield cursor
 
-    def __init__(self, delay=None):
+    def __init__(self, delay=None, enabled=True):
         self.spinner_generator = self.spinning_cursor()
+        self.enabled = enabled
         if delay and float(delay):
             self.delay = delay
 
@@ -916,10 +1587,14 @@ class Spinner:
             sys.stdout.write("\b"*9)
 
     def __enter__(self):
+        if not self.enabled:
+            return
         self.busy = True
         threading.Thread(target=self.spinner_task).start()
 
     def __exit__(self, exception, value, tb):
+        if not self.enabled:
+            return False
         self.busy = False
         time.sleep(self.delay)
         sys.stdout.write("\b"*9)
@@ -931,8 +1606,10 @@ class Spinner:
 
 
 if __name__ == "__main__":
-    f = Figlet(font="slant")
-
     t = Tansanit()
+    if t.batch:
+        sys.exit(t.run_batch())
+    if t.args.serve:
+        sys.exit(t.serve())
     t.prompt = "> "
-    t.cmdloop(f.renderText("Tansanit"))
+    t.cmdloop(t.banner() if t.args.banner else None)
@@ -0,0 +1,54 @@
+import os
+import io
+import sys
+import shutil
+
+from contextlib import redirect_stdout
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
+
+from mockserver import MockServer  # noqa: E402
+from client import Client  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def home(tmp_path, monkeypatch):
+    """Nothing may touch the real ~/.tansanit"""
+    monkeypatch.setenv("HOME", str(tmp_path))
+    return tmp_path
+
+
+@pytest.fixture(scope="session")
+def wallet_template(tmp_path_factory):
+    """Creating keys is slow, one wallet is generated per session and copied"""
+    filename = str(tmp_path_factory.mktemp("wallet") / "wallet.json")
+    with redirect_stdout(io.StringIO()):
+        Client(filename)
+    return filename
+
+
+@pytest.fixture
+def wallet(wallet_template, tmp_path):
+    filename = str(tmp_path / "wallet.json")
+    shutil.copy(wallet_template, filename)
+    return filename
+
+
+@pytest.fixture
+def server():
+    mock = MockServer(dataset_size=200)
+    mock.start()
+    yield mock
+    mock.stop()
+
+
+@pytest.fixture
+def client(wallet, server):
+    with redirect_stdout(io.StringIO()):
+        client = Client(wallet)
+        client.set_server(server.ipport)
+    yield client
+    client.close()
@@ -0,0 +1,20 @@
+import io
+import json
+
+from concurrent.futures import Future
+
+from batch import Batch
+
+
+def test_failed_connection_fails_online_commands(client, server):
+    ready = Future()
+    ready.set_exception(ConnectionError("no server"))
+    out = io.StringIO()
+
+    assert Batch(client, ready=ready, out=out).run(["receive", "balance"]) == 1
+    receive, balance = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert receive["ok"]
+    assert not balance["ok"]
+    assert balance["error"] == "Not connected: no server"
+    # The command didn't run
+    assert "balanceget" not in server.requests
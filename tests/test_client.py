@@ -0,0 +1,53 @@
+import io
+import json
+
+from contextlib import redirect_stdout
+
+
+RECIPIENT = "f6c0363ca1c5aa28cc584252e65a63998493ff0a5ec1bb16beda9bac"
+
+
+def test_balance_is_cached(client, server):
+    balance = client.balance()
+    assert float(balance) == float(server.chain.balance(client.address)[0])
+    assert client.balance() == balance
+    assert server.requests["balanceget"] == 1
+    client.clear_cache()
+    client.balance()
+    assert server.requests["balanceget"] == 2
+
+
+def test_latest_transactions(client):
+    transactions = client.latest_transactions(num=10)
+    assert len(transactions) == 10
+    heights = [int(tx["block_height"]) for tx in transactions]
+    assert heights == sorted(heights, reverse=True)
+    assert client.latest_transactions(num=10, offset=5)[:5] == transactions[5:]
+
+
+def test_status(client, server):
+    status = client.status()
+    assert int(status["blocks"]) == server.chain.height
+
+
+def test_send_reaches_mempool(client, server):
+    with redirect_stdout(io.StringIO()):
+        txid = client.send(RECIPIENT, 0.01, data="test")
+    assert txid
+    assert [tx[4][:56] for tx in server.chain.mempool] == [txid]
+
+
+
+def test_received_bytes_from_frame(client, server):
+    from transport import Transport, received_bytes
+
+    connection = Transport().connect(server.ipport)
+    reply = connection.command("addlistlim", [client.address, 50])
+    connection.close()
+    # The size of the frame read, without serializing the reply again
+    assert received_bytes() == len(json.dumps(reply)) + 10
+    assert received_bytes() is None
+
+    client.latest_transactions(num=50)
+    rpc = next(rpc for rpc in client.metrics()["rpc"] if rpc["command"] == "addlistlim")
+    assert rpc["received"] == len(json.dumps(reply)) + 10
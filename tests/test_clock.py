@@ -0,0 +1,101 @@
+import io
+import time
+import threading
+
+from contextlib import redirect_stdout
+
+from client import Client
+from clock import ClockSync
+
+
+def test_offset_from_round_trip_midpoint():
+    clock = ClockSync()
+    clock.sample(100.0, 95.1, 100.2)
+    assert abs(clock.offset - -5.0) < 1e-9
+    assert abs(clock.drift - 5.0) < 1e-9
+    assert abs(clock.rtt - 0.2) < 1e-9
+
+
+def test_shortest_round_trip_wins():
+    clock = ClockSync(alpha=1)
+    clock.sample(0.0, 1.0, 0.1)
+    # Slow reply, its midpoint is far off
+    clock.sample(10.0, 11.0, 12.0)
+    assert abs(clock.offset - 0.95) < 1e-9
+    assert abs(clock.error - (0.05 + clock.resolution)) < 1e-9
+
+
+def test_server_switch_replaces_estimate():
+    clock = ClockSync()
+    for t in range(3):
+        clock.sample(t, t + 0.01 - 5.0, t + 0.02)
+    assert abs(clock.drift - 5.0) < 1e-6
+
+    clock.reset()
+    assert clock.age() is None and clock.error == 0
+    for t in range(3):
+        clock.sample(t, t + 0.01, t + 0.02)
+    # Nothing of the previous server's -5 s is left
+    assert abs(clock.drift) < 1e-6
+
+
+def test_client_remeasures_after_switch(client, server, wallet):
+    from mockserver import MockServer
+
+    client.sync_clock(samples=2)
+    assert client.info()["clock"]["samples"] == 2
+
+    other = MockServer(dataset_size=10)
+    try:
+        client.set_server(other.start())
+        assert client.info()["clock"]["samples"] == 0
+        clock = client.sync_clock()
+        assert clock["samples"] == 1
+        assert abs(client.time_drift) < clock["error"] + 0.1
+    finally:
+        other.stop()
+
+
+def test_failed_sync_backs_off(client, monkeypatch):
+    attempts = []
+
+    def fail(self):
+        attempts.append(1)
+        raise RuntimeError("Server down")
+
+    # Measured once, then the server goes down: the estimate ages past the interval
+    client.sync_clock()
+    monkeypatch.setattr(Client, "_statusjson", fail)
+    monkeypatch.setattr(Client, "CLOCK_RETRY", 0.1)
+    client.set_clock_sync(interval=0.2)
+    time.sleep(1.2)
+    client.set_clock_sync(None)
+    # One per retry: 0.1 s, then 0.2 s at most, not a busy loop
+    assert 1 <= len(attempts) <= 10
+
+
+def test_concurrent_statusjson_coalesced(wallet):
+    from mockserver import MockServer
+
+    mock = MockServer(dataset_size=10, latency=0.2)
+    try:
+        with redirect_stdout(io.StringIO()):
+            client = Client(wallet, servers=[mock.start()])
+        client.set_server(mock.ipport)
+        start = threading.Barrier(6)
+
+        def height():
+            start.wait()
+            return client.height()
+
+        threads = [threading.Thread(target=height) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert mock.requests["statusjson"] == 1
+        # The waiters share the reply, only the request that was sent is a clock sample
+        assert client.info()["clock"]["samples"] == 1
+        client.close()
+    finally:
+        mock.stop()
@@ -0,0 +1,39 @@
+import io
+
+from contextlib import redirect_stdout
+
+from client import Client
+from health import ServerHealth
+from mockserver import MockServer
+
+
+def test_probe_keeps_command_rtt():
+    health = ServerHealth()
+    health.success("1.2.3.4:5658", 0.2)
+    health.probe("1.2.3.4:5658", 0.001)
+    entry = health.get("1.2.3.4:5658")
+    assert entry["rtt"] == 0.2
+    assert entry["connect_rtt"] == 0.001
+
+
+def test_rebalance_compares_like_with_like(wallet, monkeypatch):
+    def probe(self, server):
+        # Same connect time everywhere, real ones jitter with the machine load
+        self._health.probe(server, 0.001)
+        return True
+
+    monkeypatch.setattr(Client, "_probe", probe)
+    mocks = [MockServer(dataset_size=10) for _ in range(3)]
+    servers = [mock.start() for mock in mocks]
+    try:
+        with redirect_stdout(io.StringIO()):
+            client = Client(wallet, servers=servers)
+        current = client.get_server()
+        for _ in range(5):
+            # Slow commands on the current server, as a large reply would be
+            client._health.success(current, 2.0)
+            assert client.rebalance() == current
+        client.close()
+    finally:
+        for mock in mocks:
+            mock.stop()
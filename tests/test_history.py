@@ -0,0 +1,37 @@
+import os
+
+from history import HistoryStore, wallet_history_file
+from transaction import Transaction
+
+
+def test_file_next_to_wallet(tmp_path):
+    filename = wallet_history_file(str(tmp_path / "wallets" / "main.json"))
+    assert filename == str(tmp_path / "wallets" / "main.history.sqlite")
+
+
+def test_search_keeps_history_in_memory(client, home):
+    found = client.search_transactions(limit=5, records=True)
+    assert len(found) == 5
+    assert not os.path.exists(home / ".tansanit")
+
+
+def test_history_file_kept(client, tmp_path):
+    filename = wallet_history_file(str(tmp_path / "wallet.json"))
+    client.set_history_file(filename)
+    client.sync_history()
+    client.close()
+    store = HistoryStore(filename)
+    assert store.synced(client.address) is not None
+    store.close()
+
+
+def test_ledger_amounts_are_exact():
+    store = HistoryStore()
+    owner, other = "a" * 56, "b" * 56
+    store.insert(owner, [
+        Transaction(10, "1600000000.00", other, owner, "88788076.88530173", "s1" * 40, "pk", "h", "0", "0", "", ""),
+        Transaction(11, "1600000100.00", owner, other, "0.00000001", "s2" * 40, "pk", "h", "0.01000000", "0", "", "")])
+    rows = store.ledger(owner)
+    assert [row[5:] for row in rows] == [(8878807688530173, 0, 0), (1, 1000000, 0)]
+    assert rows[0][2:4] == (True, False)
+    store.close()
@@ -0,0 +1,37 @@
+from metrics import Metrics
+
+
+def families(text):
+    """Returns {family: type} of the TYPE lines and the sample names"""
+    types, samples = {}, []
+    for line in text.splitlines():
+        if line.startswith("# TYPE "):
+            _, _, name, kind = line.split(" ")
+            types[name] = kind
+        elif line and not line.startswith("#"):
+            samples.append(line.split("{")[0].split(" ")[0])
+    return types, samples
+
+
+def test_counter_families_without_total():
+    metrics = Metrics()
+    metrics.observe("balanceget", "127.0.0.1:5658", 0.02, sent=40, received=20, error=True)
+    metrics.cache_hit()
+    metrics.hedge("balanceget", won=True)
+    metrics.coalesced("balanceget")
+    text = metrics.openmetrics()
+    types, samples = families(text)
+
+    assert text.endswith("# EOF\n")
+    for name, kind in types.items():
+        assert not name.endswith("_total")
+        if kind == "counter":
+            assert f"{name}_total" in samples
+    assert 'tansanit_rpc_errors_total{command="balanceget",server="127.0.0.1:5658"} 1' in text
+    assert "tansanit_cache_hits_total 1" in text
+    assert 'tansanit_hedges_won_total{command="balanceget"} 1' in text
+    assert 'tansanit_rpc_coalesced_total{command="balanceget"} 1' in text
+    # Every sample belongs to a declared family
+    suffixes = ("_total", "_bucket", "_sum", "_count")
+    for sample in samples:
+        assert sample in types or any(sample.endswith(s) and sample[:-len(s)] in types for s in suffixes)
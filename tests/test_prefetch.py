@@ -0,0 +1,35 @@
+import itertools
+
+from concurrent import futures
+
+
+def requests(client, command):
+    return sum(rpc["count"] for rpc in client.metrics()["rpc"] if rpc["command"] == command)
+
+
+def test_prefetch_warms_caches(client):
+    client.set_prefetch(page=5)
+    futures.wait(client.prefetch(), timeout=10)
+    assert requests(client, "balanceget") == 1
+    assert requests(client, "statusjson") == 1
+    assert requests(client, "addlistlim") == 1
+    # The aliases of the first page
+    assert requests(client, "aliasesget") == 1
+
+    client.balance()
+    client.status()
+    assert requests(client, "balanceget") == 1
+    assert requests(client, "statusjson") == 1
+
+
+def test_first_page_comes_from_prefetch(client):
+    client.set_prefetch(page=5)
+    futures.wait(client.prefetch(), timeout=10)
+
+    first = list(itertools.islice(client.iter_transactions(page=5), 5))
+    assert len(first) == 5
+    assert requests(client, "addlistlim") == 1
+    # Later pages are fetched, the first one still comes from the cache
+    assert len(list(itertools.islice(client.iter_transactions(page=5), 12))) == 12
+    assert requests(client, "addlistlim") == 1
+    assert requests(client, "addlistlimfrom") >= 2
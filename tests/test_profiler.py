@@ -0,0 +1,27 @@
+import io
+import sys
+
+from profiler import Profile
+
+
+def test_worker_threads_are_profiled(client, tmp_path):
+    with Profile("transactions all", directory=str(tmp_path)) as profile:
+        list(client.iter_wallet_transactions(page=50))
+    assert profile.tasks > 0
+    if sys.version_info < (3, 12):
+        # A profiler per task, merged into the stats
+        assert profile.merged == profile.tasks
+    else:
+        # Process wide profiling, the profiler of the command sees the worker threads
+        assert profile.merged == 0
+    names = {function for (_, _, function) in profile.stats.stats}
+    # Pages are fetched in the client pool
+    assert "_fetch_transactions" in names
+    out = io.StringIO()
+    profile.report(out)
+    assert "tasks of client worker threads" in out.getvalue()
+
+
+def test_no_tasks_outside_a_profile(client):
+    list(client.iter_wallet_transactions(page=50))
+    assert Profile.active is None
@@ -0,0 +1,85 @@
+import io
+
+from contextlib import redirect_stdout
+
+from client import Client
+from mockserver import MockServer
+from quorum import QuorumPolicy
+
+
+A, B, C = "10.0.0.1:5658", "10.0.0.2:5658", "10.0.0.3:5658"
+
+
+def test_majority_without_heights():
+    policy = QuorumPolicy(size=3)
+    assert policy.majority({A: ["5"], B: ["5"], C: ["6"]}) == ["5"]
+    assert policy.majority({A: ["5"], B: ["6"]}) is None
+
+
+def test_votes_at_highest_height():
+    policy = QuorumPolicy(size=5)
+    heights = {A: 101, B: 101, C: 101, "d:1": 100, "e:1": 100}
+    answers = {A: ["7"], B: ["7"], C: ["6"], "d:1": ["6"], "e:1": ["6"]}
+    # Three answers say 6, but two of them come from servers a block behind
+    assert policy.majority(answers, heights) is None
+    answers[C] = ["7"]
+    assert policy.majority(answers, heights) == ["7"]
+
+
+def test_server_ahead_alone_wins():
+    policy = QuorumPolicy(size=3)
+    heights = {A: 101, B: 100, C: 100}
+    answers = {A: ["7"], B: ["6"], C: ["6"]}
+    assert policy.majority(answers, heights) is None
+    assert policy.highest(answers, heights) == ["7"]
+    assert policy.diverged(answers, heights, ["7"]) == []
+
+
+def test_unknown_heights_dont_vote():
+    policy = QuorumPolicy(size=3)
+    heights = {A: 100, B: None, C: None}
+    answers = {A: ["7"], B: ["6"], C: ["6"]}
+    assert policy.majority(answers, heights) is None
+    assert policy.highest(answers, heights) == ["7"]
+    assert policy.diverged(answers, heights, ["7"]) == []
+
+
+def test_no_early_majority_while_a_server_may_be_ahead():
+    policy = QuorumPolicy(size=3)
+    answers, heights = {A: ["6"], B: ["6"]}, {A: 100, B: 100}
+    assert policy.majority(answers, heights, pending={C: 101}) is None
+    assert policy.majority(answers, heights, pending={C: None}) is None
+    assert policy.majority(answers, heights, pending={C: 100}) == ["6"]
+
+
+def test_servers_behind_are_not_diverged():
+    policy = QuorumPolicy(size=3)
+    heights = {A: 101, B: 101, C: 100}
+    answers = {A: ["7"], B: ["7"], C: ["6"]}
+    result = policy.majority(answers, heights)
+    assert policy.diverged(answers, heights, result) == []
+    heights[C] = 101
+    assert policy.diverged(answers, heights, result) == [C]
+
+
+def test_current_server_a_block_ahead(wallet):
+    mocks = [MockServer(dataset_size=20) for _ in range(3)]
+    servers = [mock.start() for mock in mocks]
+    try:
+        with redirect_stdout(io.StringIO()):
+            client = Client(wallet, servers=servers)
+        current = client.get_server()
+        ahead = mocks[servers.index(current)]
+        stale = float(client.balance())
+        client.clear_cache()
+        # A payment in a block only the current server has seen yet
+        ahead.chain.insert(("%.2f" % 2e9, ahead.chain.counterparties[0], client.address, "5.00000000",
+                            "new" * 60, "pk", "", ""))
+        ahead.chain.mine()
+        client.set_quorum(size=3)
+        assert float(client.balance()) == stale + 5
+        assert all(client._health.get(server)["divergences"] == 0 for server in servers)
+        client.close()
+    finally:
+        for mock in mocks:
+            mock.stop()
@@ -0,0 +1,71 @@
+import os
+import json
+import time
+import socket
+import threading
+
+import pytest
+
+from rpcserver import ClientServer, INVALID_PARAMS, INTERNAL_ERROR
+
+
+class Stand:
+    """Answers like a Client for the methods used here"""
+
+    def balance(self, for_display=False):
+        return "1.00000000" if for_display else 1.0
+
+    def info(self):
+        # A set isn't JSON
+        return {"servers": {"127.0.0.1:5658"}}
+
+    def status(self):
+        return len(None)
+
+
+@pytest.fixture
+def rpc(tmp_path):
+    path = str(tmp_path / "client.sock")
+    server = ClientServer(Stand(), socket_path=path, workers=2)
+    thread = threading.Thread(target=server.serve, daemon=True)
+    thread.start()
+    for _ in range(100):
+        if os.path.exists(path):
+            break
+        time.sleep(0.01)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(path)
+    sock.settimeout(5)
+    lines = sock.makefile("rb")
+
+    def call(method, params, request_id=1):
+        sock.sendall(json.dumps({"jsonrpc": "2.0", "id": request_id, "method": method,
+                                 "params": params}).encode("utf-8") + b"\n")
+        return json.loads(lines.readline().decode("utf-8"))
+
+    yield call
+    sock.close()
+    server.stop()
+    thread.join(5)
+
+
+def test_result(rpc):
+    assert rpc("balance", {"for_display": True})["result"] == "1.00000000"
+
+
+def test_wrong_arguments_are_invalid_params(rpc):
+    assert rpc("balance", [True, 2])["error"]["code"] == INVALID_PARAMS
+    assert rpc("balance", {"unknown": 1})["error"]["code"] == INVALID_PARAMS
+    assert rpc("balance", "x")["error"]["code"] == INVALID_PARAMS
+
+
+def test_type_error_inside_method_is_internal(rpc):
+    assert rpc("status", [])["error"]["code"] == INTERNAL_ERROR
+
+
+def test_unserializable_result_still_answered(rpc):
+    response = rpc("info", [], request_id=7)
+    assert response["id"] == 7
+    assert response["error"]["code"] == INTERNAL_ERROR
+    # The connection keeps working
+    assert rpc("balance", [])["result"] == 1.0
@@ -0,0 +1,51 @@
+import io
+import itertools
+
+from contextlib import redirect_stdout
+
+from viewer import TransactionViewer
+
+
+def signatures(transactions):
+    return [tx.signature for tx in transactions]
+
+
+def test_oldest_first_streams_pages(client):
+    newest_first = signatures(client.iter_transactions(page=30))
+    assert len(newest_first) == 200
+    assert signatures(client.iter_transactions_oldest_first(page=30)) == newest_first[::-1]
+
+
+def test_oldest_first_skips_shifted_transactions(client, server):
+    transactions = client.iter_transactions_oldest_first(page=30)
+    head = list(itertools.islice(transactions, 45))
+    # New transactions shift every offset while the history is walked
+    for i in range(7):
+        server.chain.insert(("%.2f" % (2e9 + i), server.chain.counterparties[0], client.address, "1.00000000",
+                             f"new{i}" * 30, "pk", "", ""))
+    server.chain.mine()
+    rest = list(transactions)
+    walked = signatures(head + rest)
+    assert len(walked) == len(set(walked)) == 207
+    assert walked[-7:] == signatures(client.iter_transactions(page=7))[:7][::-1]
+
+
+def test_wallet_timeline_oldest_first(client):
+    with redirect_stdout(io.StringIO()):
+        client.new_address("second", "", "")
+    newest_first = signatures(client.iter_wallet_transactions(page=40))
+    oldest_first = signatures(client.iter_wallet_transactions(page=40, oldest_first=True))
+    assert len(oldest_first) == 400
+    assert sorted(oldest_first) == sorted(newest_first)
+
+
+def test_viewer_streams_full_history_oldest_first(client):
+    out = io.StringIO()
+    viewer = TransactionViewer(client.address, out=out, interactive=False)
+
+    def source(block_height=None):
+        raise AssertionError("the newest first history must not be read")
+
+    shown = viewer.show(source, count=None, oldest_first=True,
+                        ascending=lambda: client.iter_transactions_oldest_first(page=50))
+    assert shown == 200
@@ -0,0 +1,250 @@
+import os
+import json
+import time
+import logging
+import threading
+
+from concurrent.futures import Future
+
+
+"""
+Confirmation tracking of sent transactions. Pending transactions are checked together once per new block:
+one transaction list per sending address and one mempool read, whatever the number of transactions.
+"""
+
+
+DEFAULT_FILE = os.environ.get("TANSANIT_PENDING", os.path.join(os.path.expanduser("~"), ".tansanit", "pending.json"))
+
+CONFIRMED = "confirmed"
+DROPPED = "dropped"
+TIMED_OUT = "timed out"
+
+
+class TrackedTransaction:
+
+    __slots__ = ('txid', 'address', 'recipient', 'amount', 'submitted', 'height', 'block_height', 'missing',
+                 'status', 'future')
+
+    def __init__(self, txid, address, recipient=None, amount=None, submitted=None, height=None, block_height=None,
+                 missing=0, status=None):
+        """
+        :param submitted: float, time the transaction was sent
+        :param height: int, block height when it was sent
+        :param block_height: int, block that includes it, once seen
+        :param missing: int, new blocks in a row that had it neither in the mempool nor in a block
+        """
+        self.txid = txid
+        self.address = address
+        self.recipient = recipient
+        self.amount = amount
+        self.submitted = submitted if submitted else time.time()
+        self.height = height
+        self.block_height = block_height
+        self.missing = missing
+        self.status = status
+        # Resolves to the final status
+        self.future = Future()
+
+    def to_dict(self):
+        return {"txid": self.txid, "address": self.address, "recipient": self.recipient, "amount": self.amount,
+                "submitted": self.submitted, "height": self.height, "block_height": self.block_height,
+                "missing": self.missing, "status": self.status}
+
+
+class TransactionTracker:
+
+    __slots__ = ('client', 'filename', 'log', 'confirmations', 'timeout', 'grace', 'interval', 'height',
+                 '_pending', '_done', '_callbacks', '_lock', '_thread', '_stop')
+
+    # Finished transactions kept for pending()
+    KEEP_DONE = 50
+
+    def __init__(self, client, filename=None, confirmations=1, timeout=3600, grace=3, interval=10, log=None):
+        """
+        :param client: a Client
+        :param filename: string, JSON file to keep pending transactions in across restarts. None = memory only
+        :param confirmations: int, blocks including and after the transaction's block to call it confirmed
+        :param timeout: float, seconds after which an unconfirmed transaction is given up
+        :param grace: int, new blocks a transaction may be missing from mempool and chain before it is dropped
+        :param interval: float, seconds between block height checks
+        """
+        self.client = client
+        self.filename = filename
+        self.log = log if log else logging
+        self.confirmations = confirmations
+        self.timeout = timeout
+        self.grace = grace
+        self.interval = interval
+        # Last block height seen
+        self.height = None
+        self._pending = {}
+        self._done = []
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        if filename:
+            self.load()
+
+    def load(self):
+        if not os.path.isfile(self.filename):
+            return
+        try:
+            with open(self.filename) as f:
+                data = json.load(f)
+            for entry in data["pending"]:
+                self._pending[entry["txid"]] = TrackedTransaction(**entry)
+            self.height = data["height"]
+        except Exception as e:
+            self.log.warning(f"Ignoring pending transactions '{self.filename}': {e}")
+
+    def save(self):
+        """Writes the pending transactions atomically"""
+        if not self.filename:
+            return
+        with self._lock:
+            data = json.dumps({"height": self.height, "pending": [tx.to_dict() for tx in self._pending.values()]},
+                              indent=2)
+        os.makedirs(os.path.dirname(os.path.abspath(self.filename)), exist_ok=True)
+        tmp = f"{self.filename}.{os.getpid()}.tmp"
+        with open(tmp, 'w') as f:
+            f.write(data)
+        os.replace(tmp, self.filename)
+
+    def add_callback(self, callback):
+        """callback(tx) is called with the TrackedTransaction once it is confirmed, dropped or timed out"""
+        self._callbacks.append(callback)
+
+    def track(self, txid, address=None, recipient=None, amount=None):
+        """
+        Starts tracking a sent transaction and returns a Future of its final status.
+        A txid already tracked returns the same Future.
+
+        :param address: string, sender, default is the current address of the client
+        """
+        with self._lock:
+            if txid in self._pending:
+                return self._pending[txid].future
+            tx = TrackedTransaction(txid, address if address else self.client.address, recipient=recipient,
+                                    amount=amount, height=self.height)
+            self._pending[txid] = tx
+        self.save()
+        return tx.future
+
+    def pending(self):
+        """Returns the pending then the recently finished transactions as dicts, newest first"""
+        with self._lock:
+            pending = [tx.to_dict() for tx in self._pending.values()]
+            done = [tx.to_dict() for tx in self._done]
+        return sorted(pending, key=lambda tx: -tx["submitted"]) + done[::-1]
+
+    def check(self, mempool=None):
+        """
+        Checks the pending transactions if a new block came, returns the number finished.
+        Costs one statusjson request without a new block.
+
+        :param mempool: set of the txids in the mempool if just read, else mpget is requested
+        """
+        with self._lock:
+            if not self._pending:
+                return 0
+        height = int(self.client.height())
+        now = time.time()
+
+        finished = []
+        if height != self.height:
+            with self._lock:
+                pending = list(self._pending.values())
+            for tx in pending:
+                if tx.height is None:
+                    # Sent before the first check, at most one block ago
+                    tx.height = self.height if self.height is not None else height - 1
+            found = self._blocks(pending)
+            if mempool is None:
+                mempool = {row[4][:56] for row in self.client.command("mpget")}
+            for tx in pending:
+                if tx.txid in found:
+                    tx.block_height = found[tx.txid]
+                    tx.missing = 0
+                    if height - tx.block_height + 1 >= self.confirmations:
+                        finished.append((tx, CONFIRMED))
+                elif tx.txid in mempool:
+                    tx.block_height = None
+                    tx.missing = 0
+                else:
+                    # Gone from the block it was seen in (fork) or never mined
+                    tx.block_height = None
+                    tx.missing += 1
+                    if tx.missing > self.grace:
+                        finished.append((tx, DROPPED))
+            self.height = height
+
+        with self._lock:
+            done = {tx.txid for tx, _ in finished}
+            for tx in self._pending.values():
+                if tx.block_height is None and now - tx.submitted > self.timeout and tx.txid not in done:
+                    finished.append((tx, TIMED_OUT))
+
+        for tx, status in finished:
+            self._finish(tx, status)
+        self.save()
+        return len(finished)
+
+    def _blocks(self, pending):
+        """Returns {txid: block height} of the pending transactions found on chain, one list per sending address"""
+        oldest = {}
+        for tx in pending:
+            oldest[tx.address] = min(oldest.get(tx.address, tx.height), tx.height)
+        txids = {tx.txid for tx in pending}
+        found = {}
+        for address, height in oldest.items():
+            # Newest first, down to the block before the oldest send
+            for record in self.client.iter_transactions(address, page=20):
+                if int(record.block_height) < height:
+                    break
+                if record.txid in txids:
+                    found[record.txid] = int(record.block_height)
+        return found
+
+    def _finish(self, tx, status):
+        with self._lock:
+            self._pending.pop(tx.txid, None)
+            tx.status = status
+            self._done = (self._done + [tx])[-self.KEEP_DONE:]
+        for callback in self._callbacks:
+            try:
+                callback(tx)
+            except Exception as e:
+                self.log.error(f"Tracker callback failed: {e}")
+        tx.future.set_result(status)
+
+    def wait(self):
+        """Checks every interval seconds in the calling thread until no transaction is pending"""
+        while True:
+            self.check()
+            with self._lock:
+                if not self._pending:
+                    return
+            time.sleep(self.interval)
+
+    def start(self):
+        """Checks in a background thread every interval seconds"""
+        if self._thread:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="tracker", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                self.log.error(f"Tracker check failed: {e}")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self.save()
@@ -0,0 +1,58 @@
+import sys
+
+from bismuthclient.bismuthformat import TxFormatter
+
+
+"""
+Compact transaction record shared by the cache, the history store and the viewer.
+Formatting for display only happens when a transaction is rendered.
+"""
+
+
+# Same order as the rows returned by addlistlim
+FIELDS = ('block_height', 'timestamp', 'address', 'recipient', 'amount', 'signature', 'public_key', 'block_hash',
+          'fee', 'reward', 'operation', 'openfield')
+
+# Values that repeat across transactions: the same address, the sender's public key, all transactions of a block
+SHARED = frozenset(('address', 'recipient', 'public_key', 'block_hash', 'fee', 'reward', 'operation'))
+
+
+class Transaction:
+    """One transaction, iterates over its fields in row order"""
+
+    __slots__ = FIELDS
+
+    def __init__(self, block_height, timestamp, address, recipient, amount, signature, public_key, block_hash, fee,
+                 reward, operation, openfield):
+        self.block_height = block_height
+        self.timestamp = timestamp
+        self.address = address
+        self.recipient = recipient
+        self.amount = amount
+        self.signature = signature
+        self.public_key = public_key
+        self.block_hash = block_hash
+        self.fee = fee
+        self.reward = reward
+        self.operation = operation
+        self.openfield = openfield
+
+    @classmethod
+    def from_row(cls, row):
+        """Returns a Transaction from a decoded row, repeated strings are shared instead of copied"""
+        return cls(*(sys.intern(value) if field in SHARED and type(value) is str else value
+                     for field, value in zip(FIELDS, row)))
+
+    def __iter__(self):
+        return (getattr(self, field) for field in FIELDS)
+
+    def __repr__(self):
+        return f"Transaction({self.block_height}, {self.address} -> {self.recipient}, {self.amount})"
+
+    @property
+    def txid(self):
+        return self.signature[:56]
+
+    def to_json(self, for_display=False):
+        """Returns the dict of Client.latest_transactions()"""
+        return TxFormatter(list(self)).to_json(for_display=for_display)
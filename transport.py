@@ -0,0 +1,315 @@
+import gzip
+import json
+import time
+import socket
+import logging
+import threading
+
+from collections import deque
+from time import perf_counter
+from bismuthclient import lwbench
+from bismuthclient import rpcconnections
+
+
+"""
+Pluggable network layer of the Client: server discovery, reachability checks and connections.
+Traffic can be recorded to a gzipped JSON lines file and replayed later without any server.
+"""
+
+
+# Commands without side effects: safe to coalesce, hedge or repeat. Never add mpinsert
+READ_COMMANDS = frozenset(('balanceget', 'globalbalanceget', 'addlistlim', 'addlistlimfrom', 'statusjson',
+                           'wstatusget', 'aliasesget', 'aliascheck', 'pubkeyget', 'mpget', 'blocklast'))
+
+
+# Size of the last reply read by each thread, see received_bytes()
+_frames = threading.local()
+
+
+def received_bytes():
+    """Returns the size with header of the last reply this thread read from a server and forgets it, None if none"""
+    size = getattr(_frames, "size", None)
+    _frames.size = None
+    return size
+
+
+class _Connection(rpcconnections.Connection):
+    """rpcconnections.Connection with Nagle disabled that keeps the size of the replies it reads"""
+
+    __slots__ = ()
+
+    def check_connection(self):
+        reconnect = not self.sdef
+        super().check_connection()
+        if reconnect:
+            # Command and options are separate small writes, without NODELAY the
+            # options wait for the delayed ACK of the command (~40 ms per call)
+            self.sdef.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def _receive(self, slen=rpcconnections.SLEN, timeout=rpcconnections.LTIMEOUT):
+        """Reads a reply like rpcconnections, the frame size is known without serializing the reply again"""
+        self.check_connection()
+        self.sdef.settimeout(timeout)
+        try:
+            header = self.sdef.recv(slen)
+            if not header:
+                self.close()
+                raise RuntimeError("Socket EOF")
+            length = int(header)
+        except socket.timeout:
+            self.close()
+            return ""
+        try:
+            chunks, received = [], 0
+            while received < length:
+                chunk = self.sdef.recv(min(length - received, 65536))
+                if not chunk:
+                    raise RuntimeError("Socket EOF2")
+                chunks.append(chunk)
+                received += len(chunk)
+            self.last_activity = time.time()
+            _frames.size = slen + length
+            return json.loads(b"".join(chunks).decode("utf-8"))
+        except Exception as e:
+            self.close()
+            raise RuntimeError("Connections: {}".format(e))
+
+
+class Transport:
+    """Default transport: api for server discovery, plain sockets to the wallet servers"""
+
+    __slots__ = ('log', )
+
+    def __init__(self, log=None):
+        self.log = log if log else logging
+
+    def wallet_servers(self, initial_servers):
+        """Returns the wallet servers as a list of dicts with ip, port, load and height"""
+        # Imports requests, only needed for server discovery
+        from bismuthclient import bismuthapi
+        return bismuthapi.get_wallet_servers_legacy(initial_servers, self.log, minver='0.1.5', as_dict=True)
+
+    def connectible(self, ipport):
+        return lwbench.connectible(ipport)
+
+    def connect(self, ipport, verbose=False):
+        """Returns a connection object with command(command, options) and close()"""
+        return _Connection(ipport, verbose=verbose)
+
+    def close(self):
+        pass
+
+
+class ConnectionPool:
+    """Idle connections per server, so that concurrent commands don't queue on one socket"""
+
+    __slots__ = ('transport', 'size', 'verbose', '_idle', '_lock')
+
+    def __init__(self, transport, size=4, verbose=False):
+        """
+        :param size: int, max idle connections kept per server
+        """
+        self.transport = transport
+        self.size = size
+        self.verbose = verbose
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def command(self, ipport, command, options=None):
+        """Runs a command on an idle or new connection to the server"""
+        with self._lock:
+            idle = self._idle.get(ipport)
+            connection = idle.pop() if idle else None
+        if not connection:
+            connection = self.transport.connect(ipport, verbose=self.verbose)
+        try:
+            result = connection.command(command, options)
+        except Exception:
+            connection.close()
+            raise
+        with self._lock:
+            idle = self._idle.setdefault(ipport, [])
+            if len(idle) < self.size:
+                idle.append(connection)
+                connection = None
+        if connection:
+            connection.close()
+        return result
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+
+class RecordingTransport:
+    """
+    Wraps a transport and appends every exchange to a gzipped JSON lines file.
+    Each line is {"t", "type", ...}, t being seconds since the start of the recording.
+    """
+
+    __slots__ = ('inner', 'filename', 'log', '_file', '_lock', '_start')
+
+    def __init__(self, filename, inner=None, log=None):
+        self.inner = inner if inner else Transport(log=log)
+        self.filename = filename
+        self.log = log if log else logging
+        self._file = gzip.open(filename, 'at', encoding='utf-8')
+        self._lock = threading.Lock()
+        self._start = perf_counter()
+
+    def record(self, kind, **data):
+        line = json.dumps(dict(t=round(perf_counter() - self._start, 6), type=kind, **data))
+        with self._lock:
+            if self._file:
+                self._file.write(line + "\n")
+                # Sync flush: the file stays readable if we get killed
+                self._file.flush()
+
+    def wallet_servers(self, initial_servers):
+        servers = self.inner.wallet_servers(initial_servers)
+        self.record("servers", result=servers)
+        return servers
+
+    def connectible(self, ipport):
+        result = self.inner.connectible(ipport)
+        self.record("connectible", server=ipport, result=result)
+        return result
+
+    def connect(self, ipport, verbose=False):
+        return _RecordingConnection(self, ipport, self.inner.connect(ipport, verbose=verbose))
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+        self.inner.close()
+
+
+class _RecordingConnection:
+
+    __slots__ = ('transport', 'ipport', 'connection')
+
+    def __init__(self, transport, ipport, connection):
+        self.transport = transport
+        self.ipport = ipport
+        self.connection = connection
+
+    @property
+    def sdef(self):
+        return self.connection.sdef
+
+    @property
+    def command_lock(self):
+        return self.connection.command_lock
+
+    def command(self, command, options=None):
+        start = perf_counter()
+        try:
+            result = self.connection.command(command, options)
+        except Exception as e:
+            self.transport.record("command", server=self.ipport, command=command, options=options,
+                                  error=str(e), seconds=round(perf_counter() - start, 6))
+            raise
+        self.transport.record("command", server=self.ipport, command=command, options=options,
+                              result=result, seconds=round(perf_counter() - start, 6))
+        return result
+
+    def close(self):
+        self.connection.close()
+
+
+class ReplayTransport:
+    """
+    Answers from a recording, without any server.
+
+    Replies are matched on command and options, then on command alone, in recorded order.
+    The last reply is repeated once a queue is used up. Every reply takes its recorded
+    duration divided by speed, speed 0 replies at once.
+    """
+
+    __slots__ = ('filename', 'speed', 'log', 'servers', '_connectible', '_exact', '_commands', '_lock')
+
+    def __init__(self, filename, speed=1.0, log=None):
+        self.filename = filename
+        self.speed = speed
+        self.log = log if log else logging
+        self.servers = []
+        self._connectible = {}
+        self._exact = {}
+        self._commands = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    @staticmethod
+    def _key(command, options):
+        return json.dumps([command, options], sort_keys=True)
+
+    def _load(self):
+        events = []
+        with gzip.open(self.filename, 'rt', encoding='utf-8') as f:
+            try:
+                for line in f:
+                    events.append(json.loads(line))
+            except (EOFError, json.JSONDecodeError):
+                # Recording was interrupted, keep what was flushed
+                self.log.warning(f"Truncated recording '{self.filename}', {len(events)} events loaded")
+
+        for event in events:
+            if event["type"] == "servers":
+                self.servers = event["result"]
+            elif event["type"] == "connectible":
+                self._connectible[event["server"]] = event["result"]
+            elif event["type"] == "command":
+                key = self._key(event["command"], event["options"])
+                self._exact.setdefault(key, deque()).append(event)
+                self._commands.setdefault(event["command"], deque()).append(event)
+
+    def wallet_servers(self, initial_servers):
+        return list(self.servers)
+
+    def connectible(self, ipport):
+        # Servers never checked during the recording were used straight away
+        return self._connectible.get(ipport, True)
+
+    def connect(self, ipport, verbose=False):
+        return _ReplayConnection(self, ipport)
+
+    def reply(self, command, options):
+        """Returns the recorded event for this command"""
+        with self._lock:
+            queue = self._exact.get(self._key(command, options))
+            if not queue:
+                queue = self._commands.get(command)
+            if not queue:
+                raise RuntimeError(f"Replay: no recorded reply for '{command}'")
+            event = queue.popleft() if len(queue) > 1 else queue[0]
+        return event
+
+    def close(self):
+        pass
+
+
+class _ReplayConnection:
+
+    __slots__ = ('transport', 'ipport', 'sdef')
+
+    def __init__(self, transport, ipport):
+        self.transport = transport
+        self.ipport = ipport
+        self.sdef = True
+
+    def command(self, command, options=None):
+        # Options go through JSON on the wire, tuples become lists
+        event = self.transport.reply(command, json.loads(json.dumps(options)))
+        if self.transport.speed:
+            time.sleep(event["seconds"] / self.transport.speed)
+        if "error" in event:
+            raise RuntimeError(event["error"])
+        return event["result"]
+
+    def close(self):
+        self.sdef = None
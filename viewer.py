@@ -0,0 +1,149 @@
+import sys
+import itertools
+
+from datetime import datetime
+
+
+"""
+Pager for transaction lists: pages of Transaction records are pulled lazily from an iterator,
+filtered, rendered in one pass and written with a single call per page.
+"""
+
+
+class TransactionFilter:
+    """Callable that keeps the transactions matching all given criteria"""
+
+    __slots__ = ('addresses', 'direction', 'operation', 'counterparty', 'min_amount', 'max_amount')
+
+    def __init__(self, address, direction=None, operation=None, counterparty=None, min_amount=None, max_amount=None):
+        """
+        :param address: string, the address the transactions belong to, or a set of own addresses
+        :param direction: 'in' or 'out', None = both
+        :param operation: string, exact operation
+        :param counterparty: string, the other address
+        :param min_amount: float
+        :param max_amount: float
+        """
+        self.addresses = {address} if isinstance(address, str) else set(address)
+        self.direction = direction
+        self.operation = operation
+        self.counterparty = counterparty
+        self.min_amount = min_amount
+        self.max_amount = max_amount
+
+    def __bool__(self):
+        return any(value is not None for value in (self.direction, self.operation, self.counterparty,
+                                                   self.min_amount, self.max_amount))
+
+    def __call__(self, tx):
+        outgoing = tx.address in self.addresses
+        if self.direction == "in" and outgoing or self.direction == "out" and not outgoing:
+            return False
+        if self.operation is not None and tx.operation != self.operation:
+            return False
+        if self.counterparty is not None and self.counterparty != (tx.recipient if outgoing else tx.address):
+            return False
+        if self.min_amount is not None or self.max_amount is not None:
+            amount = float(tx.amount)
+            if self.min_amount is not None and amount < self.min_amount:
+                return False
+            if self.max_amount is not None and amount > self.max_amount:
+                return False
+        return True
+
+
+class TransactionViewer:
+
+    __slots__ = ('addresses', 'out', 'page_size', 'interactive', 'selected')
+
+    def __init__(self, address, out=None, page_size=20, interactive=None, selected="  <-- SELECTED"):
+        """
+        :param address: string, the address to mark in the output, or a set of own addresses
+        :param out: writable text stream, default is stdout
+        :param page_size: int, transactions per screen
+        :param interactive: bool, ask before each page. Default: if out is a terminal
+        """
+        self.addresses = {address} if isinstance(address, str) else set(address)
+        self.out = out if out else sys.stdout
+        self.page_size = page_size
+        self.interactive = self.out.isatty() if interactive is None else interactive
+        self.selected = selected
+
+    def render(self, tx):
+        sender, recipient = tx.address, tx.recipient
+        if sender in self.addresses:
+            sender = f"{sender}{self.selected}"
+        if recipient in self.addresses:
+            recipient = f"{recipient}{self.selected}"
+
+        dt = datetime.utcfromtimestamp(float(tx.timestamp)).strftime("%Y-%m-%d %H:%M:%S")
+
+        return f"Amount:    {tx.amount}\n" \
+               f"Block:     {tx.block_height}\n" \
+               f"From:      {sender}\n" \
+               f"To:        {recipient}\n" \
+               f"Timestamp: {dt} UTC\n" \
+               f"Trx ID:    {tx.txid}\n" \
+               f"Fee:       {tx.fee}\n" \
+               f"Operation: {tx.operation}\n\n"
+
+    def write_page(self, transactions):
+        """Renders a page in one pass and writes it at once"""
+        self.out.write("".join(self.render(tx) for tx in transactions))
+        self.out.flush()
+
+    def ask(self, shown, can_jump):
+        """Returns None to stop, '' for the next page or a block height to jump to"""
+        hint = "Enter: more, g <block>: jump, q: quit" if can_jump else "Enter: more, q: quit"
+        while True:
+            try:
+                answer = input(f"-- {shown} shown. {hint} -- ").strip().lower()
+            except EOFError:
+                return None
+            if answer == "q":
+                return None
+            if not answer:
+                return ""
+            if can_jump and answer.startswith("g ") and answer[2:].strip().isnumeric():
+                return int(answer[2:].strip())
+
+    def show(self, source, count=None, oldest_first=False, keep=None, ascending=None):
+        """
+        Pages through transactions and returns how many were shown.
+
+        :param source: callable(block_height=None) returning an iterator of transactions, newest first,
+        starting at the given block
+        :param count: int, max transactions to show, None = all
+        :param oldest_first: bool, show the oldest of the count first. Holds count transactions in memory
+        :param keep: callable(tx) -> bool, filter
+        :param ascending: callable() returning an iterator of all transactions, oldest first.
+        Streams oldest_first without a count instead of holding the whole history
+        """
+        def stream(block_height=None):
+            transactions = source(block_height)
+            if keep:
+                transactions = filter(keep, transactions)
+            return itertools.islice(transactions, count)
+
+        if oldest_first and count is None and ascending:
+            transactions = filter(keep, ascending()) if keep else ascending()
+        elif oldest_first:
+            # The oldest of the last count: ordering needs the selection, at most count transactions
+            transactions = iter(list(stream())[::-1])
+        else:
+            transactions = stream()
+
+        shown = 0
+        while True:
+            page = list(itertools.islice(transactions, self.page_size))
+            if not page:
+                return shown
+            self.write_page(page)
+            shown += len(page)
+            if len(page) < self.page_size or not self.interactive:
+                continue
+            answer = self.ask(shown, can_jump=not oldest_first)
+            if answer is None:
+                return shown
+            if answer != "":
+                transactions = stream(answer)